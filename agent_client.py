@@ -0,0 +1,172 @@
+import json
+import logging
+import threading
+import time
+
+import requests
+
+import metrics
+
+# This module lets a recording agent work off the job queue of a coordinator on another
+# machine. RemoteJobQueue has the interface the pipeline expects of job_queue.JobQueue:
+# jobs are claimed from the coordinator over HTTP, every stage transition and the final
+# result are reported back, and a heartbeat keeps the leases of the agent's jobs alive
+# and streams its status and metrics. If the agent goes away, its leases expire and the
+# coordinator hands the jobs to another agent. The outcome of a job is reported until the
+# coordinator takes it, since a lost result would have the job recorded (and uploaded) again.
+
+class AgentError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        # The coordinator's HTTP status, or None if it could not be reached.
+        self.status_code = status_code
+
+class RemoteJobQueue:
+    def __init__(self, coordinator_url, agent_id, token='', jobs=None, status=None,
+                 heartbeat_interval=30, claim_wait=20, request_timeout=15, report_retry_interval=5,
+                 max_report_retry_interval=60):
+        """
+        Args:
+            coordinator_url (str): Base URL of the coordinator's web server, e.g. http://10.0.0.2:5001.
+            agent_id (str): Name of this agent. Must be unique among the agents.
+            token (str): Shared secret sent with every request, if the coordinator requires one.
+            jobs (list): The jobs currently in this agent's pipeline (the pipeline's tracked jobs).
+                Their leases are renewed on every heartbeat.
+            status (dict): The agent's current status, reported with every heartbeat.
+            heartbeat_interval (float): Seconds between heartbeats. Must be well below the
+                coordinator's lease time.
+            claim_wait (float): Seconds the coordinator holds a claim request open while the queue is empty.
+            request_timeout (float): Seconds to wait for the coordinator to answer (on top of claim_wait).
+            report_retry_interval (float): Seconds before reporting a job's outcome again after the
+                coordinator could not be reached; doubles up to max_report_retry_interval.
+        """
+        self.coordinator_url = coordinator_url.rstrip('/')
+        self.agent_id = agent_id
+        self.jobs = jobs if jobs is not None else []
+        self.status = status if status is not None else {}
+        self.heartbeat_interval = heartbeat_interval
+        self.claim_wait = claim_wait
+        self.request_timeout = request_timeout
+        self.report_retry_interval = report_retry_interval
+        self.max_report_retry_interval = max_report_retry_interval
+        self.session = requests.Session()
+        self.session.headers['X-Agent-Token'] = token
+        self.lost_jobs = 0
+        self._heartbeat = None
+
+    def _post(self, path, payload, timeout=None, attempts=3):
+        """Posts JSON to the coordinator, retrying on connection errors. Returns the decoded answer, or None."""
+        body = json.dumps(dict(payload, agent_id=self.agent_id), default=str)
+        for attempt in range(attempts):
+            try:
+                response = self.session.post(f"{self.coordinator_url}{path}", data=body,
+                                             headers={'Content-Type': 'application/json'},
+                                             timeout=timeout or self.request_timeout)
+            except requests.RequestException as e:
+                if attempt + 1 == attempts:
+                    raise AgentError(f"Coordinator unreachable: {e}")
+                time.sleep(2 ** attempt)
+                continue
+            if response.status_code == 204:
+                return None
+            if response.status_code == 409:
+                # The lease was lost (e.g. the agent was unreachable for too long) and the job
+                # was handed to another agent. This agent's work on it no longer counts.
+                return {"lost": True}
+            if response.status_code >= 400:
+                raise AgentError(f"Coordinator answered {response.status_code} to {path}: {response.text[:200]}",
+                                 response.status_code)
+            return response.json()
+
+    def get(self):
+        """Blocks until the coordinator hands this agent a job, and returns it."""
+        while True:
+            try:
+                answer = self._post('/agent/claim', {"wait": self.claim_wait},
+                                    timeout=self.claim_wait + self.request_timeout, attempts=1)
+            except AgentError as e:
+                logging.warning(f"Could not claim a job: {e}. Retrying in 10 seconds...")
+                time.sleep(10)
+                continue
+            if answer and answer.get('job'):
+                job = answer['job']
+                logging.info(f"Claimed job {job['job_id']} from the coordinator.")
+                return job
+
+    def put(self, job):
+        raise AgentError("Jobs are submitted to the coordinator, not to an agent.")
+
+    def task_done(self):
+        pass
+
+    def _report(self, path, job, until_accepted=False, **payload):
+        """
+        Reports a job to the coordinator. Returns False if it was not accepted.
+
+        Args:
+            until_accepted (bool): Keep trying while the coordinator cannot be reached (or fails),
+                until it accepts the report or answers that the job is no longer leased to this
+                agent. Meanwhile the job stays in the pipeline, so the heartbeat renews its lease.
+        """
+        delay = self.report_retry_interval
+        while True:
+            try:
+                answer = self._post(path, dict(payload, job=job))
+                break
+            except AgentError as e:
+                # A rejected request (4xx) will not be accepted by trying again.
+                if not until_accepted or (e.status_code is not None and e.status_code < 500):
+                    logging.error(f"Failed to report job {job.get('job_id')} to the coordinator: {e}")
+                    return False
+                logging.error(f"Failed to report job {job.get('job_id')} to the coordinator: {e}. "
+                              f"Retrying in {delay:.0f} seconds...")
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_report_retry_interval)
+        if answer and answer.get('lost'):
+            self.lost_jobs += 1
+            logging.warning(f"Job {job.get('job_id')} is no longer leased to this agent.")
+            return False
+        return True
+
+    def transition(self, job, stage_name):
+        return self._report(f"/agent/jobs/{job['job_id']}/update", job, stage=stage_name)
+
+    def complete(self, job):
+        return self._report(f"/agent/jobs/{job['job_id']}/complete", job, until_accepted=True)
+
+    def schedule_retry(self, job, delay):
+        return self._report(f"/agent/jobs/{job['job_id']}/retry_later", job, until_accepted=True, delay=delay)
+
+    def snapshot(self, limit=None):
+        # The waiting jobs live on the coordinator.
+        return []
+
+    def qsize(self):
+        return 0
+
+    def heartbeat(self):
+        """
+        Renews the leases of this agent's jobs and reports its status and metrics.
+        Returns the IDs of lost jobs.
+        """
+        jobs = [job for job in list(self.jobs) if job.get('job_id') is not None]
+        answer = self._post('/agent/heartbeat', {"status": self.status, "jobs": jobs,
+                                                 "metrics": metrics.registry.snapshot()}, attempts=1)
+        lost = (answer or {}).get('lost', [])
+        for job_id in lost:
+            self.lost_jobs += 1
+            logging.warning(f"The coordinator no longer leases job {job_id} to this agent.")
+        return lost
+
+    def start_heartbeat(self):
+        if self._heartbeat is None:
+            self._heartbeat = threading.Thread(target=self._heartbeat_loop, name="AgentHeartbeat", daemon=True)
+            self._heartbeat.start()
+
+    def _heartbeat_loop(self):
+        while True:
+            try:
+                self.heartbeat()
+            except Exception as e:
+                logging.warning(f"Heartbeat to the coordinator failed: {e}")
+            time.sleep(self.heartbeat_interval)
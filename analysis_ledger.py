@@ -0,0 +1,81 @@
+import json
+import logging
+import os
+import time
+
+import db
+
+# This module records which demos CSDM has already analyzed, keyed by demo content
+# hash and CSDM version, so a demo that is used by several jobs is only analyzed once.
+
+LEDGER_DB = 'analysis_ledger.db'
+
+def csdm_version(csdm_project_path):
+    """
+    Returns an identifier for the installed CSDM build: the package.json version plus
+    the build time of out/cli.js, so rebuilding a modified CSDM also invalidates the ledger.
+    """
+    version = "unknown"
+    try:
+        with open(os.path.join(csdm_project_path, 'package.json'), 'r', encoding='utf-8') as f:
+            version = json.load(f).get('version', version)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Could not read the CSDM version from package.json: {e}")
+    cli_path = os.path.join(csdm_project_path, 'out', 'cli.js')
+    if os.path.exists(cli_path):
+        version += f"+{int(os.path.getmtime(cli_path))}"
+    return version
+
+class AnalysisLedger:
+    def __init__(self, path=LEDGER_DB):
+        self.path = path
+        with db.connect(self.path) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS analyses ("
+                " demo_sha256 TEXT NOT NULL,"
+                " csdm_version TEXT NOT NULL,"
+                " demo_path TEXT,"
+                " analyzed_at REAL NOT NULL,"
+                " duration REAL,"
+                " PRIMARY KEY (demo_sha256, csdm_version))"
+            )
+
+    def is_analyzed(self, demo_sha256, version):
+        with db.connect(self.path) as conn:
+            row = conn.execute(
+                "SELECT 1 FROM analyses WHERE demo_sha256 = ? AND csdm_version = ?", (demo_sha256, version)
+            ).fetchone()
+        return row is not None
+
+    def record(self, demo_sha256, version, demo_path, duration):
+        """Records a successful analysis."""
+        with db.connect(self.path) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO analyses (demo_sha256, csdm_version, demo_path, analyzed_at, duration) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (demo_sha256, version, demo_path, time.time(), duration)
+            )
+
+    def invalidate(self, demo_sha256=None):
+        """
+        Forgets the analyses of one demo, or of all demos if no hash is given
+        (e.g. after the CSDM database was reset).
+
+        Returns:
+            int: The number of entries removed.
+        """
+        with db.connect(self.path) as conn:
+            if demo_sha256:
+                cursor = conn.execute("DELETE FROM analyses WHERE demo_sha256 = ?", (demo_sha256,))
+            else:
+                cursor = conn.execute("DELETE FROM analyses")
+            return cursor.rowcount
+
+    def entries(self, limit=100):
+        """Returns the most recent analyses, newest first."""
+        with db.connect(self.path) as conn:
+            rows = conn.execute(
+                "SELECT demo_sha256, csdm_version, demo_path, analyzed_at, duration FROM analyses "
+                "ORDER BY analyzed_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [dict(row) for row in rows]
@@ -0,0 +1,91 @@
+import bz2
+import hashlib
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import bz2_parallel
+
+def setup_logging():
+    """Sets up basic logging for the benchmark script."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
+
+def make_synthetic_demo(path, size_mb):
+    """
+    Writes a demo-sized .dem.bz2 file. Real demos are a mix of incompressible
+    entity data and highly repetitive tick records, so the synthetic data is too.
+    """
+    compressor = bz2.BZ2Compressor(9)
+    written = 0
+    tick = 0
+    with open(path, 'wb') as f:
+        while written < size_mb * 1024 * 1024:
+            record = os.urandom(96) + (b'tick%08d' % tick) * 16 + bytes(64)
+            f.write(compressor.compress(record))
+            written += len(record)
+            tick += 1
+        f.write(compressor.flush())
+
+def file_hash(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def run_benchmark(size_mb=300, workers=None):
+    """
+    Compares the old single-threaded shutil.copyfileobj extraction with the
+    parallel block decompressor used by demo_downloader.
+    """
+    setup_logging()
+    workers = workers or os.cpu_count() or 1
+    logging.info("--- Starting bz2 Decompression Benchmark ---")
+
+    temp_dir = tempfile.mkdtemp(prefix="demo2video_bench_")
+    try:
+        source = os.path.join(temp_dir, "synthetic.dem.bz2")
+        logging.info(f"Generating a {size_mb} MB synthetic demo...")
+        make_synthetic_demo(source, size_mb)
+        logging.info(f"Compressed size: {os.path.getsize(source) / 1024 / 1024:.1f} MB")
+
+        # 1. Old path: bz2.open + shutil.copyfileobj
+        serial_output = os.path.join(temp_dir, "serial.dem")
+        start = time.perf_counter()
+        with bz2.open(source, 'rb') as f_in:
+            with open(serial_output, 'wb') as f_out:
+                shutil.copyfileobj(f_in, f_out)
+        serial_time = time.perf_counter() - start
+        logging.info(f"shutil.copyfileobj: {serial_time:.2f} s")
+
+        # 2. Parallel path. Warm up the process pool first, as it is shared across demos.
+        bz2_parallel.decompress_file(source, os.path.join(temp_dir, "warmup.dem"), workers)
+        parallel_output = os.path.join(temp_dir, "parallel.dem")
+        start = time.perf_counter()
+        bz2_parallel.decompress_file(source, parallel_output, workers)
+        parallel_time = time.perf_counter() - start
+        logging.info(f"bz2_parallel ({workers} workers requested, {os.cpu_count()} cores): {parallel_time:.2f} s")
+
+        if file_hash(serial_output) == file_hash(parallel_output):
+            logging.info("Outputs are byte-identical.")
+        else:
+            logging.error("Outputs differ!")
+        logging.info(f"Speed-up: {serial_time / parallel_time:.2f}x")
+
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        logging.info("--- bz2 Decompression Benchmark Finished ---")
+
+
+if __name__ == '__main__':
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    run_benchmark(size)
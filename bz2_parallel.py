@@ -0,0 +1,217 @@
+import bz2
+import logging
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# This module decompresses bz2 demos on several CPU cores.
+#
+# A bz2 stream is a 4 byte header followed by independent blocks (up to 900 kB of
+# uncompressed data each) and an end-of-stream marker. Blocks are not byte aligned,
+# but each one starts with a 48-bit magic number, so the stream can be split at those
+# bit offsets. Every block is wrapped into its own single-block bz2 stream and
+# decompressed in a worker process, and the results are written back in order.
+
+BLOCK_MAGIC = 0x314159265359
+EOS_MAGIC = 0x177245385090
+
+_executor = None
+_executor_workers = 0
+
+def _get_executor(workers):
+    """Returns a shared process pool, so worker start-up is only paid once per run."""
+    global _executor, _executor_workers
+    if _executor is None or _executor_workers != workers:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+        _executor = ProcessPoolExecutor(max_workers=workers)
+        _executor_workers = workers
+    return _executor
+
+def _read_bits(data, start_bit, nbits):
+    """Reads `nbits` bits starting at `start_bit` from a bytes-like object as an int."""
+    first = start_bit // 8
+    last = (start_bit + nbits + 7) // 8
+    value = int.from_bytes(data[first:last], 'big')
+    value >>= last * 8 - (start_bit + nbits)
+    return value & ((1 << nbits) - 1)
+
+def _find_magic(data, magic, start_bit, end_bit=None):
+    """Returns the bit offset of the first `magic` in [start_bit, end_bit), or -1."""
+    best = -1
+    end = len(data) if end_bit is None else min(len(data), end_bit // 8 + 6)
+    for shift in range(8):
+        # In a 7 byte window holding the magic at this bit shift, bytes 1-5 are fully determined.
+        window = (magic << (8 - shift)).to_bytes(7, 'big')
+        needle = window[1:6]
+        i = data.find(needle, start_bit // 8 + 1, end)
+        while i != -1:
+            bit = (i - 1) * 8 + shift
+            if bit >= start_bit and bit + 48 <= len(data) * 8 and _read_bits(data, bit, 48) == magic:
+                if end_bit is None or bit < end_bit:
+                    best = bit
+                    # Later shifts only need to look before this match.
+                    end = i + 5
+                break
+            i = data.find(needle, i + 1, end)
+    return best
+
+def _decompress_block(block, start_bit, nbits, level):
+    """Decompresses one block, given as a bit range of `block`, by wrapping it in its own stream."""
+    bits = _read_bits(block, start_bit, nbits)
+    block_crc = (bits >> (nbits - 80)) & 0xFFFFFFFF
+    # A single-block stream's combined CRC equals the block CRC.
+    stream = (((bits << 48) | EOS_MAGIC) << 32) | block_crc
+    total_bits = nbits + 80
+    padding = -total_bits % 8
+    stream <<= padding
+    return bz2.decompress(b'BZh' + level + stream.to_bytes((total_bits + padding) // 8, 'big'))
+
+class SerialBZ2Decompressor:
+    """Single-threaded decompressor with the same interface as ParallelBZ2Decompressor."""
+
+    def __init__(self):
+        self._decompressor = bz2.BZ2Decompressor()
+
+    def feed(self, data):
+        output = []
+        while data:
+            if self._decompressor.eof:
+                # Concatenated bz2 streams: start a new decompressor on the leftover data.
+                data = self._decompressor.unused_data + data
+                self._decompressor = bz2.BZ2Decompressor()
+            output.append(self._decompressor.decompress(data))
+            data = self._decompressor.unused_data if self._decompressor.eof else b''
+        return b''.join(output)
+
+    def flush(self):
+        if not self._decompressor.eof:
+            raise EOFError("Compressed data ended before the end-of-stream marker was reached.")
+        return b''
+
+class ParallelBZ2Decompressor:
+    """
+    Incremental bz2 decompressor that hands each block to a process pool.
+
+    feed() accepts compressed data in chunks of any size and returns whatever
+    decompressed output is ready, in stream order. flush() waits for the remaining
+    blocks and raises EOFError if the data ended in the middle of a stream.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._executor = _get_executor(workers)
+        self._buffer = bytearray()
+        self._level = None          # Header level byte of the stream being read, None between streams
+        self._block_start = None    # Bit offset of the current block in the buffer
+        self._scan_from = 0         # Bit offset to resume searching for the next magic
+        self._stream_crc = 0
+        self._pending = deque()     # Futures of submitted blocks, in stream order
+
+    def feed(self, data):
+        self._buffer += data
+        self._split_blocks()
+        return self._collect(block=len(self._pending) > self.workers * 2)
+
+    def flush(self):
+        self._split_blocks()
+        if self._level is not None or self._buffer:
+            raise EOFError("Compressed data ended before the end-of-stream marker was reached.")
+        output = [self._collect(block=True)]
+        while self._pending:
+            output.append(self._collect(block=True))
+        return b''.join(output)
+
+    def _split_blocks(self):
+        while True:
+            if self._level is None:
+                if len(self._buffer) < 4:
+                    return
+                if self._buffer[:3] != b'BZh' or not 0x31 <= self._buffer[3] <= 0x39:
+                    raise ValueError("Invalid bz2 stream header.")
+                self._level = bytes(self._buffer[3:4])
+                self._block_start = 32
+                self._scan_from = 32
+                self._stream_crc = 0
+
+            # The current block starts with its own magic, so the next one is at least 48 bits on.
+            # An empty stream has the end-of-stream marker right after the header.
+            next_block = _find_magic(self._buffer, BLOCK_MAGIC, max(self._scan_from, self._block_start + 48))
+            end_of_stream = _find_magic(self._buffer, EOS_MAGIC, max(self._scan_from, self._block_start),
+                                        None if next_block == -1 else next_block)
+            if end_of_stream != -1 and (next_block == -1 or end_of_stream < next_block):
+                if end_of_stream + 80 > len(self._buffer) * 8:
+                    return
+                self._submit(self._block_start, end_of_stream)
+                stream_crc = _read_bits(self._buffer, end_of_stream + 48, 32)
+                if stream_crc != self._stream_crc:
+                    raise ValueError("bz2 stream CRC mismatch; the stream was not split correctly.")
+                # The next stream starts on the following byte boundary.
+                del self._buffer[:(end_of_stream + 80 + 7) // 8]
+                self._level = None
+                continue
+            if next_block != -1:
+                self._submit(self._block_start, next_block)
+                del self._buffer[:next_block // 8]
+                self._block_start = next_block % 8
+                self._scan_from = self._block_start + 48
+                continue
+
+            # No boundary yet; keep enough overlap to find a magic split across chunks.
+            self._scan_from = max(self._block_start, len(self._buffer) * 8 - 7 * 8)
+            return
+
+    def _submit(self, start_bit, end_bit):
+        if end_bit - start_bit <= 48:
+            # Empty stream: the end-of-stream marker follows the header directly.
+            return
+        first = start_bit // 8
+        block = bytes(self._buffer[first:(end_bit + 7) // 8])
+        block_crc = _read_bits(self._buffer, start_bit + 48, 32)
+        self._stream_crc = (((self._stream_crc << 1) | (self._stream_crc >> 31)) & 0xFFFFFFFF) ^ block_crc
+        future = self._executor.submit(_decompress_block, block, start_bit - first * 8, end_bit - start_bit, self._level)
+        self._pending.append(future)
+
+    def _collect(self, block):
+        """Returns the output of finished blocks at the head of the queue, in order."""
+        output = []
+        while self._pending and (block or self._pending[0].done()):
+            try:
+                output.append(self._pending.popleft().result())
+            except (OSError, EOFError) as e:
+                # A block that does not decompress on its own means the stream was split at a
+                # false magic; callers fall back to serial decompression on ValueError.
+                raise ValueError(f"A block could not be decompressed on its own: {e}") from e
+            block = False
+        return b''.join(output)
+
+def create_decompressor(workers=1):
+    """
+    Returns a parallel decompressor when more than one worker is requested and the machine
+    has more than one core, else a serial one. Extra processes only add overhead on one core.
+    """
+    workers = min(workers or 1, os.cpu_count() or 1)
+    if workers > 1:
+        return ParallelBZ2Decompressor(workers)
+    return SerialBZ2Decompressor()
+
+def decompress_file(source_path, dest_path, workers=None, chunk_size=4 * 1024 * 1024):
+    """
+    Decompresses a .bz2 file to `dest_path` using `workers` processes (default: all CPU cores).
+    Falls back to single-threaded decompression if the stream cannot be split.
+    """
+    workers = workers or os.cpu_count() or 1
+    try:
+        _decompress_file_with(create_decompressor(workers), source_path, dest_path, chunk_size)
+    except ValueError as e:
+        logging.warning(f"Parallel decompression failed ({e}). Falling back to single-threaded.")
+        _decompress_file_with(SerialBZ2Decompressor(), source_path, dest_path, chunk_size)
+
+def _decompress_file_with(decompressor, source_path, dest_path, chunk_size):
+    with open(source_path, 'rb') as f_in, open(dest_path, 'wb', buffering=chunk_size) as f_out:
+        while True:
+            chunk = f_in.read(chunk_size)
+            if not chunk:
+                break
+            f_out.write(decompressor.feed(chunk))
+        f_out.write(decompressor.flush())
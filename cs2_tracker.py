@@ -0,0 +1,153 @@
+import logging
+import time
+
+import psutil
+
+# This module tracks the CS2 process launched for a highlights session.
+# The game is looked up once, in the child tree of the process that launched it
+# (the CSDM CLI or its worker), so another cs2.exe on the machine is never mistaken
+# for ours. If the game does not show up there (e.g. it was relaunched through Steam),
+# any game process started after the launch is accepted. Once found, the tracker blocks on that PID with psutil.wait_procs instead
+# of scanning every process on the machine.
+
+GAME_PROCESS_NAMES = ('cs2.exe', 'cs2')
+
+class GameProcessTracker:
+    def __init__(self, launcher_pid=None, process_names=GAME_PROCESS_NAMES, poll_interval=0.5, handoff_grace=10):
+        """
+        Args:
+            launcher_pid (int): PID of the process that launches the game. If None, or if the game
+                does not show up under it, any matching process started after the launch is used.
+            process_names (tuple): Executable names of the game. Tests can pass the name of a fake game.
+            poll_interval (float): Seconds between looks at the launcher's child tree.
+            handoff_grace (float): Seconds after the launch during which only the launcher's child
+                tree is searched, as long as the launcher runs. The CSDM worker never exits, so
+                a game it handed off (e.g. to Steam) is only found by the search after this.
+        """
+        self.launcher_pid = launcher_pid
+        self.process_names = {name.lower() for name in process_names}
+        self.poll_interval = poll_interval
+        self.handoff_grace = handoff_grace
+        self.launched_at = time.time()
+        self.process = None
+        self.found_at = None
+        self.exited_at = None
+        self.exit_code = None
+
+    def _matches(self, process):
+        try:
+            return process.name().lower() in self.process_names
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            return False
+
+    def _search_children(self):
+        try:
+            launcher = psutil.Process(self.launcher_pid)
+            children = launcher.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return None
+        return next((child for child in children if self._matches(child)), None)
+
+    def _launcher_exited(self):
+        # A launcher started with Popen stays a zombie until it is reaped, but it is gone all the same.
+        try:
+            return psutil.Process(self.launcher_pid).status() == psutil.STATUS_ZOMBIE
+        except psutil.NoSuchProcess:
+            return True
+
+    def _search_all(self):
+        # Only processes started after the launch, so an unrelated game that was already running is ignored.
+        for process in psutil.process_iter(['name', 'create_time']):
+            name = (process.info['name'] or '').lower()
+            if name in self.process_names and (process.info['create_time'] or 0) >= self.launched_at - 1:
+                return process
+        return None
+
+    def find(self, timeout=60, stop_event=None):
+        """
+        Waits for the game process to appear.
+
+        Args:
+            timeout (float): Maximum seconds to wait.
+            stop_event (threading.Event): Aborts the wait when set.
+
+        Returns:
+            psutil.Process: The game process, or None if it did not appear.
+        """
+        if self.process is not None:
+            return self.process
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            process = None
+            if self.launcher_pid is not None:
+                process = self._search_children()
+                if process is None and self._launcher_exited():
+                    # The launcher handed the game off (e.g. through Steam) and exited.
+                    self.launcher_pid = None
+            if process is None and (self.launcher_pid is None or time.time() - self.launched_at >= self.handoff_grace):
+                process = self._search_all()
+
+            if process is not None:
+                self.process = process
+                self.found_at = time.time()
+                logging.info(f"Found {process.name()} (PID {process.pid}) "
+                             f"{self.found_at - self.launched_at:.1f} seconds after launch.")
+                return process
+
+            if stop_event is not None and stop_event.wait(self.poll_interval):
+                return None
+            elif stop_event is None:
+                time.sleep(self.poll_interval)
+        return None
+
+    def _on_exit(self, process):
+        self.exited_at = time.time()
+        self.exit_code = process.returncode
+
+    def wait(self, timeout=1800, stop_event=None):
+        """
+        Blocks until the game process exits.
+
+        Args:
+            timeout (float): Maximum seconds to wait.
+            stop_event (threading.Event): Aborts the wait when set.
+
+        Returns:
+            bool: True if the game exited, False on timeout or abort.
+        """
+        if self.process is None:
+            return False
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            # Wake up every second to check the stop event; without one, just block.
+            slice_timeout = min(remaining, 1.0) if stop_event is not None else remaining
+            gone, _ = psutil.wait_procs([self.process], timeout=slice_timeout, callback=self._on_exit)
+            if gone:
+                return True
+            if stop_event is not None and stop_event.is_set():
+                return False
+
+    def is_running(self):
+        try:
+            return self.process is not None and self.process.is_running() and self.exited_at is None
+        except psutil.NoSuchProcess:
+            return False
+
+    def kill(self):
+        """Kills the game and anything it started. Returns True if there was something to kill."""
+        if not self.is_running():
+            return False
+        try:
+            processes = self.process.children(recursive=True) + [self.process]
+        except psutil.NoSuchProcess:
+            return False
+        for process in processes:
+            try:
+                process.kill()
+            except psutil.NoSuchProcess:
+                pass
+        psutil.wait_procs(processes, timeout=5, callback=lambda p: p is self.process and self._on_exit(p))
+        return True
@@ -2,16 +2,94 @@ import subprocess
 import logging
 import os
 import time
-import psutil
+import threading
+from collections import deque
+
+from analysis_ledger import AnalysisLedger, csdm_version
+from csdm_daemon import CSDMSupervisor, CSDMWorkerError
 
 # This module handles all interactions with the CS Demo Manager CLI tools.
 
-def analyze_demo(csdm_project_path, demo_path):
+# Demos (by content hash) that CSDM has already analyzed.
+analysis_ledger = AnalysisLedger()
+
+# One lock per demo hash, so two jobs for the same demo never analyze it at the same time.
+_analysis_locks = {}
+_analysis_locks_lock = threading.Lock()
+
+# Long-lived CSDM worker processes, see enable_daemon(). None = start `node out/cli.js` per command.
+daemon = None
+
+# Recent command durations in seconds, per (command, mode), to compare daemon and per-command runs.
+command_latencies = {}
+_latencies_lock = threading.Lock()
+
+def enable_daemon(csdm_project_path, health_check_interval=30):
+    """Runs CSDM commands in persistent worker processes instead of a fresh Node process each time."""
+    global daemon
+    daemon = CSDMSupervisor(csdm_project_path, health_check_interval=health_check_interval)
+    logging.info("CSDM commands will run in persistent worker processes.")
+
+def record_latency(command, mode, seconds):
+    with _latencies_lock:
+        command_latencies.setdefault((command, mode), deque(maxlen=200)).append(seconds)
+
+def latency_stats():
+    """Returns count, mean and median duration of recent CSDM commands, per command and mode."""
+    stats = {}
+    with _latencies_lock:
+        for (command, mode), samples in command_latencies.items():
+            ordered = sorted(samples)
+            stats.setdefault(command, {})[mode] = {
+                "count": len(ordered),
+                "mean_seconds": round(sum(ordered) / len(ordered), 3),
+                "median_seconds": round(ordered[len(ordered) // 2], 3)
+            }
+    return {"latency": stats, "workers": daemon.stats() if daemon else None}
+
+def analyze_demo(csdm_project_path, demo_path, demo_hash=None):
     """
     Runs the 'analyze' command on a demo file using the node CLI.
+
+    If the demo's content hash is given, the analysis is skipped when the ledger shows this
+    demo was already analyzed by the same CSDM build, and successful runs are recorded.
     """
+    if not demo_hash:
+        return _run_analysis(csdm_project_path, demo_path)
+
+    with _analysis_locks_lock:
+        lock = _analysis_locks.setdefault(demo_hash, threading.Lock())
+    with lock:
+        version = csdm_version(csdm_project_path)
+        if analysis_ledger.is_analyzed(demo_hash, version):
+            logging.info(f"Demo {demo_path} was already analyzed by CSDM {version}. Skipping analysis.")
+            return True
+
+        start_time = time.time()
+        if not _run_analysis(csdm_project_path, demo_path):
+            return False
+        analysis_ledger.record(demo_hash, version, demo_path, time.time() - start_time)
+        return True
+
+def _run_analysis(csdm_project_path, demo_path):
+    if daemon:
+        logging.info(f"Sending analysis of {demo_path} to the CSDM worker.")
+        start_time = time.time()
+        try:
+            exit_code = daemon.run('analyze', [demo_path])
+        except CSDMWorkerError as e:
+            logging.error(f"CSDM worker failed ({e}). Running the analysis as a separate process instead.")
+        else:
+            record_latency('analyze', 'daemon', time.time() - start_time)
+            if exit_code == 0:
+                logging.info("Analysis command completed successfully.")
+                return True
+            logging.error(f"Analysis command failed with exit code {exit_code}.")
+            return False
+
     command = ['node', 'out/cli.js', 'analyze', demo_path]
     logging.info(f"Executing analysis command in '{csdm_project_path}': {' '.join(command)}")
+    start_time = time.time()
     try:
         result = subprocess.run(
             command,
@@ -21,6 +99,7 @@ def analyze_demo(csdm_project_path, demo_path):
             check=True,
             shell=True
         )
+        record_latency('analyze', 'subprocess', time.time() - start_time)
         logging.info("Analysis command completed successfully.")
         return True
     except subprocess.CalledProcessError as e:
@@ -33,63 +112,77 @@ def analyze_demo(csdm_project_path, demo_path):
 def start_highlights(csdm_project_path, demo_path, steam_id_64):
     """
     Launches CS2 to play highlights for a specific player.
+
+    Returns:
+        int: PID of the process launching CS2 (CS2 will be in its child tree), or None on failure.
     """
+    if daemon:
+        start_time = time.time()
+        try:
+            launcher_pid = daemon.launch('highlights', [demo_path, steam_id_64])
+            record_latency('highlights', 'daemon', time.time() - start_time)
+            logging.info("Highlights command sent to the CSDM worker. CS2 should be launching.")
+            return launcher_pid
+        except CSDMWorkerError as e:
+            logging.error(f"CSDM worker failed ({e}). Launching highlights as a separate process instead.")
+
     command = ['node', 'out/cli.js', 'highlights', demo_path, steam_id_64]
     logging.info(f"Executing highlights command in '{csdm_project_path}': {' '.join(command)}")
     
     try:
         # We just need to launch the process and don't need to wait for it.
-        subprocess.Popen(
+        process = subprocess.Popen(
             command,
             cwd=csdm_project_path,
             shell=True
         )
         logging.info("Highlights command sent. CS2 should be launching.")
-        return True
+        return process.pid
     except Exception as e:
         logging.error(f"An unexpected error occurred while starting highlights: {e}")
-        return False
+        return None
 
-def wait_for_cs2_to_close(timeout=1800):
+def wait_for_cs2_to_close(tracker, timeout=1800, stop_event=None):
     """
-    Waits for the cs2.exe process to start and then for it to close.
+    Waits for the CS2 process to start and then for it to close.
 
     Args:
+        tracker (GameProcessTracker): Tracker created with the PID returned by start_highlights.
         timeout (int): The maximum time in seconds to wait for the process to close.
+        stop_event (threading.Event): Aborts the wait when set.
 
     Returns:
         bool: True if the process started and closed, False on timeout or if it never started.
     """
-    logging.info("Waiting for cs2.exe process to appear...")
-    start_time = time.time()
-    cs2_started = False
-    # Wait up to 60 seconds for the game to launch
-    while time.time() - start_time < 60:
-        if "cs2.exe" in (p.name() for p in psutil.process_iter()):
-            logging.info("cs2.exe process found. Now waiting for it to close.")
-            cs2_started = True
-            break
-        time.sleep(1)
-
-    if not cs2_started:
-        logging.error("cs2.exe process did not appear within 60 seconds.")
+    logging.info("Waiting for the CS2 process to appear...")
+    if tracker.find(timeout=60, stop_event=stop_event) is None:
+        logging.error("The CS2 process did not appear within 60 seconds.")
         return False
 
-    # Now that the game is running, wait for it to close
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-        if "cs2.exe" not in (p.name() for p in psutil.process_iter()):
-            logging.info("cs2.exe process has closed. Highlights finished.")
-            return True
-        time.sleep(2) # Check every 2 seconds
+    logging.info("CS2 process found. Now waiting for it to close.")
+    if tracker.wait(timeout=timeout, stop_event=stop_event):
+        logging.info(f"CS2 has closed after {tracker.exited_at - tracker.found_at:.1f} seconds. Highlights finished.")
+        return True
 
-    logging.error(f"Timed out after {timeout} seconds waiting for cs2.exe to close.")
+    if stop_event is not None and stop_event.is_set():
+        logging.warning("Stopped waiting for CS2 to close.")
+    else:
+        logging.error(f"Timed out after {timeout} seconds waiting for CS2 to close.")
     return False
 
-def force_close_cs2():
+def force_close_cs2(tracker=None):
     """
     Forcefully terminates the Counter-Strike 2 process.
+
+    Args:
+        tracker (GameProcessTracker): If given and it found the game, only that process tree is
+            closed, and nothing is done if it already exited. Otherwise every cs2.exe is killed.
     """
+    if tracker is not None and tracker.process is not None:
+        if tracker.kill():
+            logging.info(f"CS2 (PID {tracker.process.pid}) terminated successfully.")
+        return
+
     logging.info("Attempting to force-close Counter-Strike 2 (cs2.exe)...")
     try:
         result = subprocess.run(['taskkill', '/F', '/IM', 'cs2.exe', '/T'],
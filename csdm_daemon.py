@@ -0,0 +1,248 @@
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+from collections import deque
+
+# This module supervises long-lived CSDM CLI worker processes (csdm_worker.js).
+# Each kind of command (analyze, highlights) gets its own worker, so a highlights
+# session that runs for the length of a recording never blocks the next analysis.
+# The supervisor pings the workers on a heartbeat and restarts any that crashed or hung.
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'csdm_worker.js')
+
+class CSDMWorkerError(Exception):
+    """The worker process died, hung or could not be started."""
+
+class _Call:
+    def __init__(self, request_id):
+        self.id = request_id
+        self.started = threading.Event()
+        self.finished = threading.Event()
+        self.exit_code = None
+        self.error = None
+
+class CSDMWorker:
+    def __init__(self, csdm_project_path, kind, cli='out/cli.js'):
+        self.csdm_project_path = csdm_project_path
+        self.kind = kind
+        self.cli = cli
+        self.process = None
+        self.restarts = 0
+        self.stderr_tail = deque(maxlen=50)
+        self._calls = {}
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def start(self):
+        command = ['node', WORKER_SCRIPT, self.cli]
+        logging.info(f"Starting CSDM '{self.kind}' worker in '{self.csdm_project_path}': {' '.join(command)}")
+        try:
+            self.process = subprocess.Popen(
+                command,
+                cwd=self.csdm_project_path,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                encoding='utf-8',
+                bufsize=1
+            )
+        except OSError as e:
+            raise CSDMWorkerError(f"Could not start the CSDM worker: {e}")
+        process = self.process
+        threading.Thread(target=self._read_stdout, args=(process,), name=f"CSDM{self.kind.capitalize()}Reader", daemon=True).start()
+        threading.Thread(target=self._read_stderr, args=(process,), name=f"CSDM{self.kind.capitalize()}Stderr", daemon=True).start()
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def is_busy(self):
+        with self._lock:
+            return bool(self._calls)
+
+    @property
+    def pid(self):
+        return self.process.pid if self.process else None
+
+    def stop(self):
+        if not self.process:
+            return
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=5)
+        except Exception:
+            self.process.kill()
+        self._fail_pending("The CSDM worker was stopped.")
+
+    def restart(self):
+        self.stop()
+        self.restarts += 1
+        self.start()
+
+    def send(self, command, args=()):
+        """Sends a request and returns its _Call, which is updated as responses arrive."""
+        if not self.is_alive():
+            raise CSDMWorkerError(f"The CSDM '{self.kind}' worker is not running.")
+        with self._lock:
+            call = _Call(self._next_id)
+            self._next_id += 1
+            self._calls[call.id] = call
+        try:
+            self.process.stdin.write(json.dumps({"id": call.id, "command": command, "args": list(args)}) + '\n')
+            self.process.stdin.flush()
+        except OSError as e:
+            with self._lock:
+                self._calls.pop(call.id, None)
+            raise CSDMWorkerError(f"Could not send the request to the CSDM worker: {e}")
+        return call
+
+    def ping(self, timeout=5):
+        try:
+            call = self.send('ping')
+        except CSDMWorkerError:
+            return False
+        return call.finished.wait(timeout) and call.error is None
+
+    def _read_stdout(self, process):
+        for line in process.stdout:
+            try:
+                message = json.loads(line)
+            except ValueError:
+                logging.debug(f"CSDM worker: {line.rstrip()}")
+                continue
+            with self._lock:
+                call = self._calls.get(message.get('id'))
+                if call and (message.get('event') != 'started'):
+                    del self._calls[call.id]
+            if not call:
+                continue
+            if message.get('event') == 'started':
+                call.started.set()
+                continue
+            call.exit_code = message.get('exit_code', 0)
+            call.error = message.get('error')
+            call.started.set()
+            call.finished.set()
+        # stdout closed: the worker exited. Reap it first, so is_alive() stops reporting it as
+        # running before the pending calls fail (a request sent in between would never be answered).
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        if process is self.process:
+            self._fail_pending(f"The CSDM '{self.kind}' worker exited with code {process.poll()}.")
+
+    def _read_stderr(self, process):
+        for line in process.stderr:
+            self.stderr_tail.append(line.rstrip())
+            logging.debug(f"CSDM {self.kind}: {line.rstrip()}")
+
+    def _fail_pending(self, reason):
+        with self._lock:
+            calls = list(self._calls.values())
+            self._calls.clear()
+        for call in calls:
+            call.error = reason
+            call.started.set()
+            call.finished.set()
+
+class CSDMSupervisor:
+    def __init__(self, csdm_project_path, cli='out/cli.js', health_check_interval=30, command_timeout=1800):
+        """
+        Args:
+            csdm_project_path (str): The CSDM project folder.
+            cli (str): CLI entry point, relative to the project folder. Tests can point this at a fake CLI.
+            health_check_interval (float): Seconds between pings of each worker.
+            command_timeout (float): Seconds before a command is considered hung and its worker restarted.
+        """
+        self.csdm_project_path = csdm_project_path
+        self.cli = cli
+        self.health_check_interval = health_check_interval
+        self.command_timeout = command_timeout
+        self._workers = {}
+        self._lock = threading.Lock()
+        self._running = True
+        threading.Thread(target=self._health_loop, name="CSDMSupervisor", daemon=True).start()
+
+    def _worker(self, kind):
+        with self._lock:
+            worker = self._workers.get(kind)
+            if worker is None:
+                worker = self._workers[kind] = CSDMWorker(self.csdm_project_path, kind, self.cli)
+                worker.start()
+            elif not worker.is_alive():
+                logging.warning(f"CSDM '{kind}' worker is not running. Restarting it.")
+                worker.restart()
+            return worker
+
+    def run(self, command, args=(), timeout=None):
+        """
+        Runs a command to completion.
+
+        Returns:
+            int: The command's exit code. Raises CSDMWorkerError if the worker failed.
+        """
+        worker = self._worker(command)
+        call = worker.send(command, args)
+        if not call.finished.wait(timeout or self.command_timeout):
+            logging.error(f"CSDM '{command}' did not finish in time. Restarting the worker.")
+            self._restart(worker)
+            raise CSDMWorkerError(f"CSDM '{command}' timed out.")
+        if call.error and call.exit_code is None:
+            raise CSDMWorkerError(call.error)
+        if call.error:
+            logging.error(f"CSDM '{command}' failed: {call.error}")
+        return call.exit_code
+
+    def launch(self, command, args=(), timeout=30):
+        """
+        Starts a command without waiting for it to finish (e.g. highlights, which runs until CS2 closes).
+
+        Returns:
+            int: The PID of the worker process running the command, which will be CS2's parent.
+        """
+        worker = self._worker(command)
+        call = worker.send(command, args)
+        if not call.started.wait(timeout):
+            raise CSDMWorkerError(f"CSDM '{command}' did not start within {timeout} seconds.")
+        if call.finished.is_set() and call.error and call.exit_code is None:
+            raise CSDMWorkerError(call.error)
+        return worker.pid
+
+    def _restart(self, worker):
+        with self._lock:
+            worker.restart()
+
+    def _health_loop(self):
+        while self._running:
+            time.sleep(self.health_check_interval)
+            with self._lock:
+                workers = list(self._workers.values())
+            for worker in workers:
+                # A worker busy with a long analysis may not answer pings quickly;
+                # hung commands are caught by command_timeout instead.
+                if worker.is_alive() and worker.is_busy():
+                    continue
+                if not worker.is_alive() or not worker.ping():
+                    logging.warning(f"CSDM '{worker.kind}' worker failed its health check. Restarting it.")
+                    try:
+                        self._restart(worker)
+                    except CSDMWorkerError as e:
+                        logging.error(f"Failed to restart the CSDM '{worker.kind}' worker: {e}")
+
+    def shutdown(self):
+        self._running = False
+        with self._lock:
+            for worker in self._workers.values():
+                worker.stop()
+
+    def stats(self):
+        with self._lock:
+            return {
+                kind: {"pid": worker.pid, "alive": worker.is_alive(), "restarts": worker.restarts}
+                for kind, worker in self._workers.items()
+            }
@@ -0,0 +1,154 @@
+// Long-lived CSDM CLI worker, managed by csdm_daemon.py.
+//
+// Runs CSDM CLI commands inside one Node process, so Node start-up and the loading of
+// CSDM's dependencies are paid once instead of for every command. It reads one JSON
+// request per line on stdin and writes one JSON response per line on stdout:
+//
+//   -> {"id": 1, "command": "analyze", "args": ["C:\\demos\\match.dem"]}
+//   <- {"id": 1, "event": "started"}
+//   <- {"id": 1, "exit_code": 0, "duration_ms": 5321}
+//
+//   -> {"id": 2, "command": "ping"}
+//   <- {"id": 2, "pong": true}
+//
+// The CLI signals that a command is done by calling process.exit(), which is intercepted.
+// A command that returns without calling it is done once the event loop holds nothing but
+// the worker's own handles, i.e. when `node cli.js` on its own would have exited.
+// Anything the CLI prints goes to stderr, because stdout carries the protocol.
+//
+// Usage: node csdm_worker.js <path to out/cli.js>
+
+const path = require('path');
+const readline = require('readline');
+
+const cliPath = path.resolve(process.argv[2] || 'out/cli.js');
+const protocolWrite = process.stdout.write.bind(process.stdout);
+const realExit = process.exit.bind(process);
+const COMMAND_FINISHED = Symbol('csdm-worker-command-finished');
+// How often a running command is checked for having returned without calling process.exit().
+const IDLE_CHECK_MS = 250;
+
+process.stdout.write = (chunk, encoding, callback) => process.stderr.write(chunk, encoding, callback);
+
+let current = null;
+const queue = [];
+
+function send(message) {
+    protocolWrite(JSON.stringify(message) + '\n');
+}
+
+function finish(exitCode, error) {
+    if (!current) {
+        return;
+    }
+    clearInterval(current.idleCheck);
+    const response = { id: current.id, exit_code: exitCode, duration_ms: Date.now() - current.startedAt };
+    if (error) {
+        response.error = String(error && error.stack ? error.stack : error);
+    }
+    current = null;
+    send(response);
+    setImmediate(runNext);
+}
+
+process.exit = (code) => {
+    if (!current) {
+        realExit(code);
+    }
+    finish(code === undefined ? (process.exitCode || 0) : code);
+    process.exitCode = 0;
+    // Stop the rest of the command's synchronous code, like a real exit would.
+    throw COMMAND_FINISHED;
+};
+
+function isFinishedSignal(error) {
+    return error === COMMAND_FINISHED;
+}
+
+process.on('uncaughtException', (error) => {
+    if (!isFinishedSignal(error)) {
+        finish(1, error);
+    }
+});
+
+process.on('unhandledRejection', (error) => {
+    if (!isFinishedSignal(error)) {
+        finish(1, error);
+    }
+});
+
+// Counts the event loop's active resources (handles, requests, timers) by type.
+function activeResources() {
+    const names = process.getActiveResourcesInfo
+        ? process.getActiveResourcesInfo()
+        : [...process._getActiveHandles(), ...process._getActiveRequests()].map((resource) => resource.constructor.name);
+    const counts = {};
+    for (const name of names) {
+        counts[name] = (counts[name] || 0) + 1;
+    }
+    return counts;
+}
+
+// True if the command holds no resources beyond those the worker had before it started.
+// `own` are resources the worker added since (its idle check timer).
+function holdsNothing(baseline, own) {
+    const counts = activeResources();
+    return Object.keys(counts).every((name) => counts[name] - (own[name] || 0) <= (baseline[name] || 0));
+}
+
+function watchForReturn(command, baseline) {
+    let idleChecks = 0;
+    command.idleCheck = setInterval(() => {
+        // Two checks in a row, so a write or callback in flight between them is not mistaken for idle.
+        idleChecks = holdsNothing(baseline, { Timeout: 1 }) ? idleChecks + 1 : 0;
+        if (idleChecks >= 2 && current === command) {
+            finish(process.exitCode || 0);
+            process.exitCode = 0;
+        }
+    }, IDLE_CHECK_MS);
+}
+
+function runNext() {
+    if (current || queue.length === 0) {
+        return;
+    }
+    const request = queue.shift();
+    const baseline = activeResources();
+    const command = current = { id: request.id, startedAt: Date.now() };
+    send({ id: request.id, event: 'started' });
+
+    process.argv = [process.argv[0], cliPath, request.command, ...(request.args || [])];
+    try {
+        // Only the CLI entry point is reloaded; CSDM's dependencies stay cached.
+        delete require.cache[require.resolve(cliPath)];
+        require(cliPath);
+    } catch (error) {
+        if (!isFinishedSignal(error)) {
+            finish(1, error);
+        }
+    }
+    if (current === command) {
+        watchForReturn(command, baseline);
+    }
+}
+
+const input = readline.createInterface({ input: process.stdin });
+
+input.on('line', (line) => {
+    let request;
+    try {
+        request = JSON.parse(line);
+    } catch (error) {
+        process.stderr.write(`Ignoring malformed request: ${line}\n`);
+        return;
+    }
+    if (request.command === 'ping') {
+        send({ id: request.id, pong: true, busy: current !== null });
+        return;
+    }
+    queue.push(request);
+    runNext();
+});
+
+// The supervisor closed stdin: it is shutting down or restarting us.
+input.on('close', () => realExit(0));
@@ -0,0 +1,20 @@
+import sqlite3
+from contextlib import contextmanager
+
+# This module holds the SQLite connection settings shared by the local state databases.
+
+@contextmanager
+def connect(path):
+    """
+    Opens a short-lived connection in WAL mode, so readers never block the writer.
+    Commits on success, rolls back on error and always closes the connection.
+    """
+    conn = sqlite3.connect(path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with conn:
+            yield conn
+    finally:
+        conn.close()
@@ -1,9 +1,15 @@
 import requests
-import bz2
-import shutil
 import os
 import logging
 import re
+import threading
+import time
+from requests.adapters import HTTPAdapter
+
+import bz2_parallel
+import metrics
+from mirror_client import MirrorPool
+from share_code_cache import ShareCodeCache
 
 # This module handles downloading and extracting CS2 demos from share codes.
 
@@ -13,6 +19,38 @@ API_URLS = [
     "https://appeared-cite-reach-fy.trycloudflare.com"
 ]
 
+# Demos are a few hundred MB, so read the HTTP stream and write the .dem in large blocks.
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+WRITE_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Connection settings for demo downloads. A dropped connection is resumed from the
+# last received byte with a Range request, after an exponential backoff.
+DOWNLOAD_TIMEOUT = (10, 60)     # (connect, read) in seconds
+DOWNLOAD_RETRIES = 5
+RETRY_BACKOFF = 1.0             # Seconds before the first retry, doubled for each further retry
+MAX_RETRY_BACKOFF = 30.0
+PROGRESS_INTERVAL = 1.0         # Seconds between progress reports
+
+# One pooled session for all HTTP requests, so connections to the replay servers and APIs are reused.
+session = requests.Session()
+session.mount('http://', HTTPAdapter(pool_connections=10, pool_maxsize=10))
+session.mount('https://', HTTPAdapter(pool_connections=10, pool_maxsize=10))
+
+# Hedged, health-scored client for the decode APIs above.
+mirror_pool = MirrorPool(API_URLS, session=session)
+
+# Share code -> download URL lookups that were already resolved by the APIs above.
+url_cache = ShareCodeCache()
+
+# Downloads in progress, keyed by download URL, so concurrent jobs for the same demo share one download.
+_downloads_in_flight = {}
+_downloads_lock = threading.Lock()
+
+class _DownloadFlight:
+    def __init__(self):
+        self.finished = threading.Event()
+        self.result = None
+
 def parse_share_code(share_link_or_code):
     """Extracts the match share code from a full steam link or just the code."""
     match = re.search(r'(CSGO(-[A-Za-z0-9]{5}){5})', share_link_or_code)
@@ -32,18 +70,236 @@ def is_demo_url(input_string):
         return True
     return False
 
-def download_demo(share_code_or_url, download_folder):
+class DownloadProgress:
+    """Turns byte counts into throughput and ETA and reports them at most once per PROGRESS_INTERVAL."""
+
+    def __init__(self, callback, start=0):
+        self.callback = callback
+        self.total = None
+        self._samples = [(time.time(), start)]
+        self._last_report = 0.0
+
+    def update(self, downloaded, force=False):
+        if not self.callback:
+            return
+        now = time.time()
+        if not force and now - self._last_report < PROGRESS_INTERVAL:
+            return
+        self._last_report = now
+        # Throughput over roughly the last 10 seconds, so it follows speed changes.
+        self._samples.append((now, downloaded))
+        while len(self._samples) > 2 and now - self._samples[0][0] > 10:
+            self._samples.pop(0)
+        elapsed = now - self._samples[0][0]
+        rate = (downloaded - self._samples[0][1]) / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - downloaded) / rate if self.total and rate > 0 else None
+        try:
+            self.callback({
+                "downloaded_bytes": downloaded,
+                "total_bytes": self.total,
+                "bytes_per_sec": rate,
+                "eta_seconds": eta
+            })
+        except Exception as e:
+            logging.error(f"Download progress callback failed: {e}")
+
+def iter_download(download_url, start=0, progress_callback=None):
+    """
+    Yields the body of `download_url` from byte `start` in DOWNLOAD_CHUNK_SIZE chunks.
+    If the connection drops, it reconnects with a Range request and continues where it
+    stopped, backing off exponentially between attempts. Raises once DOWNLOAD_RETRIES
+    attempts in a row made no progress.
+    """
+    position = start
+    total = None
+    attempt = 0
+    progress = DownloadProgress(progress_callback, start)
+
+    while True:
+        headers = {'Range': f'bytes={position}-'} if position else {}
+        try:
+            with session.get(download_url, stream=True, headers=headers, timeout=DOWNLOAD_TIMEOUT) as r:
+                r.raise_for_status()
+                skip = 0
+                if r.status_code == 206:
+                    # Content-Range: bytes 1000-1999/2000
+                    content_range = r.headers.get('Content-Range', '')
+                    if '/' in content_range and content_range.rsplit('/', 1)[1].isdigit():
+                        total = int(content_range.rsplit('/', 1)[1])
+                else:
+                    if position:
+                        logging.warning("Server does not support resuming. Skipping the bytes already received.")
+                        skip = position
+                    if r.headers.get('Content-Length', '').isdigit():
+                        total = int(r.headers['Content-Length'])
+                progress.total = total
+
+                for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    if skip:
+                        if len(chunk) <= skip:
+                            skip -= len(chunk)
+                            continue
+                        chunk = chunk[skip:]
+                        skip = 0
+                    position += len(chunk)
+                    attempt = 0
+                    progress.update(position)
+                    metrics.download_bytes.inc(len(chunk))
+                    yield chunk
+
+            if total is None or position >= total:
+                progress.update(position, force=True)
+                return
+            raise requests.exceptions.ChunkedEncodingError(f"Connection closed after {position} of {total} bytes.")
+
+        except (requests.exceptions.ChunkedEncodingError, requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout, requests.exceptions.HTTPError) as e:
+            response = getattr(e, 'response', None)
+            if isinstance(e, requests.exceptions.HTTPError) and response is not None and response.status_code < 500:
+                raise
+            attempt += 1
+            if attempt > DOWNLOAD_RETRIES:
+                raise
+            delay = min(MAX_RETRY_BACKOFF, RETRY_BACKOFF * 2 ** (attempt - 1))
+            logging.warning(f"Download interrupted at {position} bytes ({e}). "
+                            f"Resuming in {delay:.0f}s (attempt {attempt}/{DOWNLOAD_RETRIES})...")
+            time.sleep(delay)
+
+def stream_decompress(download_url, dem_filename, decompress_workers=1, progress_callback=None):
+    """
+    Downloads a .dem.bz2 and decompresses it on the fly, so only the .dem is written to disk.
+    Dropped connections are resumed by iter_download, so the decompressor keeps its state.
+
+    Returns:
+        bool: True if the complete demo was written, False if the stream ended before the
+              end of the bz2 data (the partial .dem is removed).
+    """
+    decompressor = bz2_parallel.create_decompressor(decompress_workers)
+    # Decompression is interleaved with the download; only the time spent in it is counted.
+    decompress_seconds = 0.0
+    try:
+        with open(dem_filename, 'wb', buffering=WRITE_BUFFER_SIZE) as f_out:
+            for chunk in iter_download(download_url, progress_callback=progress_callback):
+                started = time.perf_counter()
+                data = decompressor.feed(chunk)
+                decompress_seconds += time.perf_counter() - started
+                f_out.write(data)
+            started = time.perf_counter()
+            f_out.write(decompressor.flush())
+            decompress_seconds += time.perf_counter() - started
+        metrics.stage_seconds.observe(decompress_seconds, stage='decompress')
+        return True
+
+    except EOFError:
+        logging.warning("Download stream ended before the end of the compressed demo.")
+        os.remove(dem_filename)
+        return False
+
+    except ValueError as e:
+        logging.warning(f"Could not split the demo for parallel decompression: {e}")
+        os.remove(dem_filename)
+        return False
+
+    except (requests.exceptions.ChunkedEncodingError, requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout) as e:
+        logging.warning(f"Download stream was interrupted: {e}")
+        if os.path.exists(dem_filename):
+            os.remove(dem_filename)
+        return False
+
+    except Exception:
+        if os.path.exists(dem_filename):
+            os.remove(dem_filename)
+        raise
+
+def download_then_extract(download_url, bz2_filename, dem_filename, decompress_workers=1, progress_callback=None):
+    """
+    Downloads the whole .dem.bz2 to disk, then extracts it in a second pass.
+    A partial .bz2 left by an earlier attempt is resumed instead of downloaded again.
+    """
+    start = os.path.getsize(bz2_filename) if os.path.exists(bz2_filename) else 0
+    if start:
+        logging.info(f"Resuming partial download at {start} bytes.")
+    try:
+        with open(bz2_filename, 'ab') as f:
+            for chunk in iter_download(download_url, start, progress_callback):
+                f.write(chunk)
+    except requests.exceptions.HTTPError as e:
+        if not start or e.response is None or e.response.status_code != 416:
+            raise
+        # The partial file does not match what the server has; start over.
+        logging.warning("Partial download could not be resumed. Downloading from the start.")
+        os.remove(bz2_filename)
+        return download_then_extract(download_url, bz2_filename, dem_filename, decompress_workers, progress_callback)
+    
+    logging.info("Download complete. Extracting demo...")
+    try:
+        started = time.perf_counter()
+        bz2_parallel.decompress_file(bz2_filename, dem_filename, decompress_workers, WRITE_BUFFER_SIZE)
+        metrics.stage_seconds.observe(time.perf_counter() - started, stage='decompress')
+    except Exception:
+        # A corrupt partial download must not be resumed again.
+        os.remove(bz2_filename)
+        raise
+    os.remove(bz2_filename)
+
+def fetch_demo(download_url, bz2_filename, dem_filename, stream=True, decompress_workers=1, progress_callback=None):
+    """
+    Downloads and extracts a demo to `dem_filename`, unless it already exists.
+    The demo is written under a temporary name and renamed once complete, so a
+    half-written file is never visible under the final name.
+
+    Returns:
+        str: The path of the .dem file. Raises on failure.
+    """
+    # Check if demo file already exists
+    if os.path.exists(dem_filename):
+        logging.info(f"Demo file already exists: {dem_filename}")
+        return dem_filename
+    
+    logging.info(f"Downloading demo from: {download_url}")
+    logging.info(f"Original filename: {os.path.basename(dem_filename)}")
+    partial_filename = dem_filename + '.part'
+
+    if stream:
+        if stream_decompress(download_url, partial_filename, decompress_workers, progress_callback):
+            os.replace(partial_filename, dem_filename)
+            logging.info(f"Download and extraction complete. Demo saved to: {dem_filename}")
+            return dem_filename
+        logging.info("Retrying with a full download before extracting...")
+
+    download_then_extract(download_url, bz2_filename + '.part', partial_filename, decompress_workers, progress_callback)
+    os.replace(partial_filename, dem_filename)
+    logging.info(f"Extraction complete. Demo saved to: {dem_filename}")
+    return dem_filename
+
+def resolve_share_code(share_code):
+    """
+    Asks the share code decode APIs for the demo download URL.
+
+    Returns:
+        str: The download URL, or None if no API returned one.
+    """
+    return mirror_pool.resolve(share_code)
+
+def download_demo(share_code_or_url, download_folder, stream=True, decompress_workers=1, progress_callback=None):
     """
     Downloads a demo using either a share code (via CSReplay API) or a direct demo URL.
     
     Args:
         share_code_or_url: Either a CS2 share code or a direct demo download URL
         download_folder: The folder where the demo should be saved
+        stream: Decompress while downloading instead of writing the .bz2 to disk first.
+            Falls back to the two-pass download if the stream is cut short.
+        decompress_workers: Number of processes used to decompress the demo (1 = single-threaded).
+        progress_callback: Called about once a second with a dict of downloaded_bytes,
+            total_bytes, bytes_per_sec and eta_seconds (None when unknown).
     
     Returns:
         str: The full path to the downloaded .dem file, or None on failure.
     """
     download_url = None
+    from_cache = False
     
     # Check if input is a direct demo URL
     if is_demo_url(share_code_or_url):
@@ -51,36 +307,18 @@ def download_demo(share_code_or_url, download_folder):
         download_url = share_code_or_url
         share_code = None  # No share code available for fallback filename
     else:
-        # Treat as share code and get download URL from API
+        # Treat as share code and get download URL from the cache or the API
         share_code = share_code_or_url
-        api_response_data = None
-        headers = {'Content-Type': 'application/json'}
-        payload = {'shareCode': share_code}
-
-        for api_url in API_URLS:
-            try:
-                # UPDATED: Changed from GET to POST request
-                logging.info(f"Attempting to get download link from: {api_url} with POST request.")
-                
-                response = requests.post(api_url, headers=headers, json=payload)
-                response.raise_for_status()
-
-                api_response_data = response.json()
-                download_url = api_response_data.get("downloadLink")
-
-                if download_url:
-                    logging.info("Successfully retrieved download link.")
-                    break
-                else:
-                    logging.warning(f"API at {api_url} did not return a download URL.")
-
-            except requests.exceptions.RequestException as e:
-                logging.error(f"Failed to connect to API at {api_url}: {e}")
-                continue
-        
-        if not download_url:
-            logging.error("Failed to get a download URL from all available APIs.")
-            return None
+        download_url = url_cache.get(share_code)
+        from_cache = download_url is not None
+        if from_cache:
+            logging.info(f"Using cached download link for {share_code}.")
+        else:
+            download_url = resolve_share_code(share_code)
+            if not download_url:
+                logging.error("Failed to get a download URL from all available APIs.")
+                return None
+            url_cache.put(share_code, download_url)
 
     # Extract original filename from download URL
     try:
@@ -104,31 +342,31 @@ def download_demo(share_code_or_url, download_folder):
         bz2_filename = os.path.join(download_folder, original_filename)
         dem_filename = os.path.join(download_folder, dem_filename_only)
         
-        # Check if demo file already exists
-        if os.path.exists(dem_filename):
-            logging.info(f"Demo file already exists: {dem_filename}")
-            return dem_filename
-        
-        logging.info(f"Downloading demo from: {download_url}")
-        logging.info(f"Original filename: {dem_filename_only}")
-
-        with requests.get(download_url, stream=True) as r:
-            r.raise_for_status()
-            with open(bz2_filename, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
-        
-        logging.info("Download complete. Extracting demo...")
+        # Only one download per URL at a time; other jobs wait for it and share the result.
+        with _downloads_lock:
+            flight = _downloads_in_flight.get(download_url)
+            is_leader = flight is None
+            if is_leader:
+                flight = _downloads_in_flight[download_url] = _DownloadFlight()
 
-        with bz2.open(bz2_filename, 'rb') as f_in:
-            with open(dem_filename, 'wb') as f_out:
-                shutil.copyfileobj(f_in, f_out)
+        if not is_leader:
+            logging.info(f"Demo is already being downloaded by another job. Waiting for: {download_url}")
+            flight.finished.wait()
+            if not flight.result:
+                raise RuntimeError("The shared download of this demo failed.")
+            return flight.result
 
-        logging.info(f"Extraction complete. Demo saved to: {dem_filename}")
-        os.remove(bz2_filename)
-        
-        return dem_filename
+        try:
+            flight.result = fetch_demo(download_url, bz2_filename, dem_filename, stream, decompress_workers, progress_callback)
+        finally:
+            with _downloads_lock:
+                del _downloads_in_flight[download_url]
+            flight.finished.set()
+        return flight.result
 
     except Exception as e:
         logging.error(f"An error occurred during download/extraction: {e}")
+        if from_cache:
+            # The replay may have expired; resolve the share code again next time.
+            url_cache.invalidate(share_code)
         return None
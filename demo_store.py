@@ -0,0 +1,235 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+
+import db
+
+# This module keeps track of the demos in the demos folder. Each demo is indexed by
+# content hash and by match ID (the demo file name without extension), together with
+# its size and when it was last used. When the folder grows beyond the configured disk
+# budget, the least recently used demos are deleted. Demos referenced by queued or
+# in-flight jobs are never deleted.
+
+STORE_DB = 'demo_store.db'
+HASH_BLOCK_SIZE = 4 * 1024 * 1024
+
+def file_sha256(path):
+    """Returns the SHA-256 of a file, read in large blocks."""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def match_id_from_path(path):
+    """e.g. 'replays/003768214888862712028_0847912006.dem' -> '003768214888862712028_0847912006'"""
+    name = os.path.basename(path)
+    for extension in ('.dem.bz2', '.dem'):
+        if name.endswith(extension):
+            return name[:-len(extension)]
+    return name
+
+class DemoStore:
+    def __init__(self, path=STORE_DB, budget_bytes=0):
+        """
+        Args:
+            path (str): SQLite database file holding the index.
+            budget_bytes (int): Maximum total size of indexed demos (0 = unlimited).
+        """
+        self.path = path
+        self.budget_bytes = budget_bytes
+        self._references = {}       # Demo path -> number of jobs using it
+        self._lock = threading.Lock()
+        # Registrations run one at a time, so a copy is never deleted while another job registers it.
+        self._register_lock = threading.Lock()
+        self._replaced = {}         # Path of a deleted duplicate -> path of the copy that was kept
+        with db.connect(self.path) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS demos ("
+                " path TEXT PRIMARY KEY,"
+                " sha256 TEXT,"
+                " match_id TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " added_at REAL NOT NULL,"
+                " last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_demos_sha256 ON demos (sha256)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_demos_match_id ON demos (match_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_demos_last_used ON demos (last_used)")
+
+    def sync(self, folder):
+        """
+        Indexes .dem files that are in the folder but not in the index (e.g. from before the
+        store existed), and forgets indexed demos that were deleted by hand. Existing files
+        are hashed lazily, the first time a job uses them.
+        """
+        now = time.time()
+        on_disk = {}
+        if os.path.isdir(folder):
+            for name in os.listdir(folder):
+                if name.endswith('.dem'):
+                    path = os.path.abspath(os.path.join(folder, name))
+                    on_disk[path] = os.path.getsize(path)
+
+        folder = os.path.abspath(folder)
+        with db.connect(self.path) as conn:
+            indexed = {row['path'] for row in conn.execute("SELECT path FROM demos")}
+            for path in indexed:
+                if os.path.dirname(path) == folder and path not in on_disk:
+                    conn.execute("DELETE FROM demos WHERE path = ?", (path,))
+            for path, size in on_disk.items():
+                if path not in indexed:
+                    # Use the file time so untouched old demos are evicted first.
+                    last_used = min(now, os.path.getmtime(path))
+                    conn.execute(
+                        "INSERT INTO demos (path, sha256, match_id, size, added_at, last_used) VALUES (?, NULL, ?, ?, ?, ?)",
+                        (path, match_id_from_path(path), size, now, last_used)
+                    )
+        logging.info(f"Demo store indexed {len(on_disk)} demos in {folder}.")
+
+    def register(self, path, acquire=False):
+        """
+        Adds a demo to the index (or refreshes it) and marks it as used.
+        If the same content is already stored under another name, the new copy is deleted.
+
+        Args:
+            path (str): The demo file.
+            acquire (bool): Also acquire the returned path for the calling job, before any
+                other registration can delete it as a duplicate.
+
+        Returns:
+            str: The path to use for this demo.
+        """
+        with self._register_lock:
+            path = self._register(os.path.abspath(path))
+            if acquire:
+                self.acquire(path)
+        return path
+
+    def _register(self, path):
+        if not os.path.exists(path) and path in self._replaced:
+            # Another job downloaded the same demo and its copy was already deduplicated.
+            path = self._replaced[path]
+        now = time.time()
+        with db.connect(self.path) as conn:
+            row = conn.execute("SELECT sha256, size FROM demos WHERE path = ?", (path,)).fetchone()
+            size = os.path.getsize(path)
+            sha256 = row['sha256'] if row and row['size'] == size else None
+
+        if sha256 is None:
+            sha256 = file_sha256(path)
+
+        with db.connect(self.path) as conn:
+            duplicate = conn.execute(
+                "SELECT path FROM demos WHERE sha256 = ? AND path != ?", (sha256, path)
+            ).fetchone()
+            if duplicate and os.path.exists(duplicate['path']) and not self.is_referenced(path):
+                logging.info(f"{path} has the same content as {duplicate['path']}. Keeping only one copy.")
+                os.remove(path)
+                self._replaced[path] = duplicate['path']
+                conn.execute("DELETE FROM demos WHERE path = ?", (path,))
+                conn.execute("UPDATE demos SET last_used = ? WHERE path = ?", (now, duplicate['path']))
+                return duplicate['path']
+
+            conn.execute(
+                "INSERT INTO demos (path, sha256, match_id, size, added_at, last_used) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(path) DO UPDATE SET sha256 = excluded.sha256, size = excluded.size, last_used = excluded.last_used",
+                (path, sha256, match_id_from_path(path), size, now, now)
+            )
+        return path
+
+    def lookup(self, match_id=None, sha256=None):
+        """Returns the path of a stored demo by match ID or content hash, or None."""
+        with db.connect(self.path) as conn:
+            if sha256:
+                row = conn.execute("SELECT path FROM demos WHERE sha256 = ? ORDER BY last_used DESC", (sha256,)).fetchone()
+            else:
+                row = conn.execute("SELECT path FROM demos WHERE match_id = ? ORDER BY last_used DESC", (match_id,)).fetchone()
+            if row and not os.path.exists(row['path']):
+                conn.execute("DELETE FROM demos WHERE path = ?", (row['path'],))
+                return None
+        return row['path'] if row else None
+
+    def content_hash(self, path):
+        """Returns the SHA-256 of a stored demo, hashing and indexing it if needed."""
+        path = os.path.abspath(path)
+        with db.connect(self.path) as conn:
+            row = conn.execute("SELECT sha256 FROM demos WHERE path = ?", (path,)).fetchone()
+        if row and row['sha256']:
+            return row['sha256']
+        self.register(path)
+        with db.connect(self.path) as conn:
+            row = conn.execute("SELECT sha256 FROM demos WHERE path = ?", (path,)).fetchone()
+        return row['sha256'] if row else file_sha256(path)
+
+    def acquire(self, path):
+        """Marks a demo as in use by a job, so it cannot be evicted."""
+        path = os.path.abspath(path)
+        with self._lock:
+            self._references[path] = self._references.get(path, 0) + 1
+
+    def release(self, path):
+        path = os.path.abspath(path)
+        with self._lock:
+            count = self._references.get(path, 0) - 1
+            if count > 0:
+                self._references[path] = count
+            else:
+                self._references.pop(path, None)
+
+    def is_referenced(self, path):
+        with self._lock:
+            return self._references.get(os.path.abspath(path), 0) > 0
+
+    def evict(self, protected_match_ids=()):
+        """
+        Deletes least recently used demos until the total size fits the disk budget.
+
+        Args:
+            protected_match_ids: Match IDs of queued jobs, whose demos must be kept.
+
+        Returns:
+            int: The number of bytes freed.
+        """
+        if not self.budget_bytes:
+            return 0
+
+        protected_match_ids = set(protected_match_ids)
+        freed = 0
+        with db.connect(self.path) as conn:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM demos").fetchone()[0]
+            if total <= self.budget_bytes:
+                return 0
+
+            for row in conn.execute("SELECT path, match_id, size FROM demos ORDER BY last_used ASC").fetchall():
+                if total - freed <= self.budget_bytes:
+                    break
+                if row['match_id'] in protected_match_ids or self.is_referenced(row['path']):
+                    continue
+                try:
+                    if os.path.exists(row['path']):
+                        os.remove(row['path'])
+                except OSError as e:
+                    logging.error(f"Failed to evict demo {row['path']}: {e}")
+                    continue
+                conn.execute("DELETE FROM demos WHERE path = ?", (row['path'],))
+                freed += row['size']
+                logging.info(f"Evicted demo {row['path']} ({row['size'] / 1024 / 1024:.0f} MB) to stay within the disk budget.")
+
+        if total - freed > self.budget_bytes:
+            logging.warning("Demo store is over its disk budget, but every remaining demo is in use.")
+        return freed
+
+    def stats(self):
+        with db.connect(self.path) as conn:
+            row = conn.execute("SELECT COUNT(*) AS demos, COALESCE(SUM(size), 0) AS size FROM demos").fetchone()
+        with self._lock:
+            in_use = len(self._references)
+        return {
+            "demos": row['demos'],
+            "size_bytes": row['size'],
+            "budget_bytes": self.budget_bytes,
+            "in_use": in_use
+        }
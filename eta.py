@@ -0,0 +1,153 @@
+import heapq
+import statistics
+import threading
+import time
+from collections import deque
+
+# This module predicts when queued jobs will start and finish. The pipeline records how
+# long each stage took for every job (job['timings']); a rolling window of those durations
+# per stage gives the expected time of each stage, scaled by the demo size for the stages
+# that depend on it. The queue is then played forward over the recording slots (one per
+# recording host), since recording is the stage every job waits for.
+
+STAGE_ORDER = ('download', 'analyze', 'record', 'postprocess', 'upload')
+# Stages whose duration grows with the demo file.
+SIZE_STAGES = ('download', 'analyze')
+# Samples with a demo size needed before estimates are scaled by size.
+MIN_SIZE_SAMPLES = 5
+
+def stages_for(job):
+    """The stages that do work for a job: a YouTube upload skips the local rename, and vice versa."""
+    skipped = 'postprocess' if job.get('youtube_upload') else 'upload'
+    return [stage for stage in STAGE_ORDER if stage != skipped]
+
+class StageTimings:
+    def __init__(self, window=200, seed=None):
+        """
+        Args:
+            window (int): Number of recent durations kept per stage.
+            seed (callable): Returns finished jobs (or results) with 'timings' to fill the window
+                from, called on first use (e.g. the latest results after a restart).
+        """
+        self.window = window
+        self.seed = seed
+        self._samples = {stage: deque(maxlen=window) for stage in STAGE_ORDER}
+        self._lock = threading.Lock()
+        self._seeded = seed is None
+
+    def _ensure_seeded(self):
+        if self._seeded:
+            return
+        self._seeded = True
+        for job in self.seed():
+            self.add_job(job)
+
+    def add_job(self, job):
+        """Records the stage durations of a finished job."""
+        stages = stages_for(job)
+        with self._lock:
+            for stage, seconds in (job.get('timings') or {}).items():
+                if stage in stages and stage in self._samples:
+                    self._samples[stage].append((seconds, job.get('demo_bytes')))
+
+    def estimate(self, stage, demo_bytes=None):
+        """
+        Returns the expected seconds of a stage, or None if no job has gone through it yet.
+        Size-dependent stages use the median seconds per byte when the demo size is known.
+        """
+        self._ensure_seeded()
+        with self._lock:
+            samples = list(self._samples[stage])
+        if not samples:
+            return None
+        if demo_bytes and stage in SIZE_STAGES:
+            rates = [seconds / size for seconds, size in samples if size]
+            if len(rates) >= MIN_SIZE_SAMPLES:
+                return statistics.median(rates) * demo_bytes
+        return statistics.median(seconds for seconds, _ in samples)
+
+    def stats(self):
+        self._ensure_seeded()
+        stats = {}
+        with self._lock:
+            for stage, samples in self._samples.items():
+                durations = sorted(seconds for seconds, _ in samples)
+                stats[stage] = {
+                    "samples": len(durations),
+                    "median_seconds": round(statistics.median(durations), 1) if durations else None,
+                    "p90_seconds": round(durations[int(len(durations) * 0.9)], 1) if durations else None
+                }
+        return stats
+
+    def remaining(self, job, now):
+        """
+        Expected seconds of work left for a job, split around the recording stage.
+
+        Returns:
+            tuple: (before_record, record, after_record). record is None if the job is past
+                recording; before/after are None if a stage they include has no history yet.
+        """
+        stages = stages_for(job)
+        running = bool(job.get('stage_started_at'))
+        if job.get('stage') in stages:
+            # A job waiting between stages has finished its current one.
+            first = stages.index(job['stage']) + (0 if running else 1)
+        else:
+            first = 0
+        record_index = stages.index('record')
+        before, record, after = 0.0, None, 0.0
+        for index in range(first, len(stages)):
+            seconds = self.estimate(stages[index], job.get('demo_bytes'))
+            if seconds is not None and index == first and running:
+                seconds = max(seconds - (now - job['stage_started_at']), 0)
+            if index < record_index:
+                before = None if before is None or seconds is None else before + seconds
+            elif index == record_index:
+                record = seconds
+            else:
+                after = None if after is None or seconds is None else after + seconds
+        return before, record, after
+
+def estimate_queue(in_pipeline, queued, timings, record_slots, now=None):
+    """
+    Plays the queue forward and predicts when each job starts and finishes.
+
+    Args:
+        in_pipeline (list): Jobs in progress, in the order they entered the pipeline.
+        queued (list): Waiting jobs in the order they will be claimed.
+        timings (StageTimings): Rolling stage durations.
+        record_slots (int): Number of jobs that can be recorded at the same time.
+        now (float): Current time (for tests).
+
+    Returns:
+        dict: job_id -> {"position", "eta_start", "eta_finish"}. Position 0 means in progress.
+            Times are Unix timestamps, or None while there is not enough history (or nothing
+            that can record).
+    """
+    now = time.time() if now is None else now
+    can_estimate = record_slots > 0 and timings.estimate('record') is not None
+    slots = [now] * record_slots
+    estimates = {}
+
+    def finish_time(job, claimed_at=None):
+        """Returns (claimed_at, finish). A queued job is claimed early enough to be ready when a recorder frees up."""
+        before, record, after = timings.remaining(job, now)
+        if record is None:
+            return claimed_at, None if after is None else now + after
+        slot_free = heapq.heappop(slots)
+        if claimed_at is None:
+            claimed_at = max(now, slot_free - (before or 0))
+        record_end = max(slot_free, claimed_at + (before or 0)) + record
+        heapq.heappush(slots, record_end)
+        if before is None or after is None:
+            return claimed_at, None
+        return claimed_at, record_end + after
+
+    # Jobs being recorded hold their slot first; the others follow in pipeline order.
+    for job in sorted(in_pipeline, key=lambda job: job.get('stage') != 'record'):
+        _, finish = finish_time(job, claimed_at=now) if can_estimate else (None, None)
+        estimates[job.get('job_id')] = {"position": 0, "eta_start": None, "eta_finish": finish}
+    for position, job in enumerate(queued, start=1):
+        start, finish = finish_time(job) if can_estimate else (None, None)
+        estimates[job.get('job_id')] = {"position": position, "eta_start": start, "eta_finish": finish}
+    return estimates
@@ -0,0 +1,467 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+import db
+
+# This module keeps the job queue in SQLite, so queued and in-flight jobs survive a crash
+# or restart. Every job is a row holding the job dict as JSON and its state:
+#   queued -> downloading -> analyzing -> recording -> postprocessing -> uploading -> done / failed
+# A worker claims a queued job with a lease that is renewed while the job is in the
+# pipeline. Jobs whose lease expired (the process died) are put back in the queue.
+# Leases are held either by this process or by a remote recording agent ('agent:<id>'),
+# which claims and reports jobs over HTTP (see agent_client.py).
+
+QUEUE_DB = 'job_queue.db'
+
+STAGE_STATES = {
+    'download': 'downloading',
+    'analyze': 'analyzing',
+    'record': 'recording',
+    'postprocess': 'postprocessing',
+    'upload': 'uploading',
+}
+ACTIVE_STATES = tuple(STAGE_STATES.values())
+FINAL_STATES = ('done', 'failed')
+
+# Per-run fields that must not survive a re-queue.
+TRANSIENT_FIELDS = ('stage', 'step', 'download_progress', 'demo_acquired', 'stage_started_at')
+# Outcome of a failed attempt, cleared when the job is retried.
+FAILURE_FIELDS = ('error', 'failed_stage', 'task_status', 'abort_reason')
+
+AGENT_OWNER_PREFIX = 'agent:'
+
+def _encode(job):
+    return json.dumps(job, default=str)
+
+class JobQueue:
+    def __init__(self, path=QUEUE_DB, lease_seconds=120, group_key=None, on_change=None, dedup_key=None):
+        """
+        Args:
+            path (str): SQLite database file.
+            lease_seconds (float): How long a claimed job stays reserved without a renewal.
+            group_key (callable): Returns a grouping key for a job (e.g. its demo). After a job is
+                claimed, queued jobs with the same key are claimed first.
+            on_change (callable): Called with a job, its new state and whether it was just added,
+                whenever a job is added or changes state (e.g. to push updates to the dashboard).
+            dedup_key (callable): Returns the identity of a job's work (e.g. demo and suspect).
+                put_many skips jobs whose identity is already queued, in progress or done.
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.group_key = group_key
+        self.on_change = on_change
+        self.dedup_key = dedup_key
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._last_group = {}      # Lease owner -> group key of the job it claimed last
+        self._available = threading.Condition()
+        self._lease_thread = None
+        with db.connect(self.path) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " state TEXT NOT NULL,"
+                " data TEXT NOT NULL,"
+                " group_key TEXT,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " error TEXT,"
+                " lease_owner TEXT,"
+                " lease_expires REAL,"
+                " created_at REAL NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            columns = {row['name'] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if 'not_before' not in columns:
+                # Retries wait until this time before they can be claimed.
+                conn.execute("ALTER TABLE jobs ADD COLUMN not_before REAL NOT NULL DEFAULT 0")
+            if 'dedup_key' not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN dedup_key TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_dedup ON jobs (dedup_key) WHERE dedup_key IS NOT NULL")
+            if self.dedup_key:
+                # Jobs added before dedup keys were stored ('' when a job has no key).
+                for row in conn.execute("SELECT id, data FROM jobs WHERE dedup_key IS NULL").fetchall():
+                    conn.execute("UPDATE jobs SET dedup_key = ? WHERE id = ?",
+                                 (self.dedup_key(json.loads(row['data'])) or '', row['id']))
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_lease ON jobs (lease_expires) WHERE lease_owner IS NOT NULL")
+
+    # --- queue.Queue-compatible interface, used by the pipeline's first stage ---
+
+    def put(self, job):
+        """Adds a job to the queue. Stores its ID in job['job_id']."""
+        with db.connect(self.path) as conn:
+            self._insert(conn, job, time.time())
+        with self._available:
+            self._available.notify()
+        self._changed(job, 'queued', added=True)
+        return job['job_id']
+
+    def _insert(self, conn, job, now):
+        group = self.group_key(job) if self.group_key else None
+        dedup = (self.dedup_key(job) or '') if self.dedup_key else None
+        cursor = conn.execute(
+            "INSERT INTO jobs (state, data, group_key, dedup_key, created_at, updated_at) VALUES ('queued', '{}', ?, ?, ?, ?)",
+            (group, dedup, now, now)
+        )
+        job['job_id'] = cursor.lastrowid
+        conn.execute("UPDATE jobs SET data = ? WHERE id = ?", (_encode(job), job['job_id']))
+
+    def put_many(self, jobs):
+        """
+        Adds several jobs in one transaction. Jobs whose dedup key matches a job that is queued,
+        in progress or done (or an earlier job of the same batch) are skipped; failed jobs may
+        be submitted again.
+
+        Returns:
+            list: For each job, its new ID, or None if it was skipped as a duplicate.
+        """
+        now = time.time()
+        ids = []
+        added = []
+        with db.connect(self.path) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for job in jobs:
+                key = self.dedup_key(job) if self.dedup_key else None
+                if key and conn.execute(
+                    "SELECT 1 FROM jobs WHERE dedup_key = ? AND state != 'failed' LIMIT 1", (key,)
+                ).fetchone():
+                    ids.append(None)
+                    continue
+                self._insert(conn, job, now)
+                ids.append(job['job_id'])
+                added.append(job)
+        if added:
+            with self._available:
+                self._available.notify_all()
+        for job in added:
+            self._changed(job, 'queued', added=True)
+        return ids
+
+    def _changed(self, job, state, added=False):
+        if self.on_change:
+            try:
+                self.on_change(job, state, added)
+            except Exception as e:
+                logging.error(f"Job change listener failed for job {job.get('job_id')}: {e}")
+
+    def get(self, poll_interval=2.0):
+        """Blocks until a queued job can be claimed, and returns it."""
+        while True:
+            job = self.claim()
+            if job is not None:
+                return job
+            with self._available:
+                # Also poll, because other processes or the lease reaper can re-queue jobs.
+                self._available.wait(poll_interval)
+
+    def task_done(self):
+        pass
+
+    def wait_for_job(self, owner, timeout):
+        """Claims a job for `owner`, waiting up to `timeout` seconds for one. Returns None if none came."""
+        deadline = time.time() + timeout
+        while True:
+            job = self.claim(owner)
+            remaining = deadline - time.time()
+            if job is not None or remaining <= 0:
+                return job
+            with self._available:
+                self._available.wait(min(remaining, 2.0))
+
+    def claim(self, owner=None):
+        """
+        Claims the next queued job for `owner` (this process by default) and leases it.
+
+        Returns:
+            dict: The job, or None if nothing is ready.
+        """
+        owner = owner or self.owner
+        now = time.time()
+        with db.connect(self.path) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id, data, group_key FROM jobs WHERE state = 'queued' AND not_before <= ? "
+                "ORDER BY (group_key IS ? AND group_key IS NOT NULL) DESC, id LIMIT 1",
+                (now, self._last_group.get(owner))
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET state = ?, lease_owner = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ? "
+                "WHERE id = ?",
+                (STAGE_STATES['download'], owner, now + self.lease_seconds, now, row['id'])
+            )
+        self._last_group[owner] = row['group_key']
+        job = json.loads(row['data'])
+        job['job_id'] = row['id']
+        self._changed(job, STAGE_STATES['download'])
+        return job
+
+    # --- state transitions of jobs in the pipeline ---
+
+    # The methods below take an optional lease owner. When given (a remote agent), the change
+    # is only applied if that owner still holds the job's lease, and False is returned otherwise.
+
+    def transition(self, job, stage_name, owner=None):
+        """Records that a job entered a stage, with a snapshot of the job."""
+        state = STAGE_STATES.get(stage_name, stage_name)
+        return self._update(job, state, owner=owner)
+
+    def complete(self, job, owner=None):
+        """Records that a job left the pipeline, as done or failed."""
+        state = 'failed' if job.get('error') else 'done'
+        return self._update(job, state, error=job.get('error'), owner=owner)
+
+    def _update(self, job, state, error=None, owner=None):
+        if job.get('job_id') is None:
+            return False
+        now = time.time()
+        final = state in FINAL_STATES
+        with db.connect(self.path) as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET state = ?, data = ?, error = ?, updated_at = ?, "
+                "lease_owner = CASE WHEN ? THEN NULL ELSE ? END, lease_expires = CASE WHEN ? THEN NULL ELSE ? END "
+                "WHERE id = ? AND (? IS NULL OR lease_owner = ?)",
+                (state, _encode(job), error, now, final, owner or self.owner, final, now + self.lease_seconds,
+                 job['job_id'], owner, owner)
+            )
+        if cursor.rowcount:
+            self._changed(job, state)
+        return cursor.rowcount > 0
+
+    def schedule_retry(self, job, delay, owner=None):
+        """
+        Puts a failed job back in the queue, to be claimed again after `delay` seconds.
+        The job dict is left as it is, so it can still be completed as failed if this returns False.
+        """
+        queued = {key: value for key, value in job.items() if key not in TRANSIENT_FIELDS + FAILURE_FIELDS}
+        now = time.time()
+        with db.connect(self.path) as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET state = 'queued', data = ?, error = NULL, not_before = ?, "
+                "lease_owner = NULL, lease_expires = NULL, updated_at = ? "
+                "WHERE id = ? AND (? IS NULL OR lease_owner = ?)",
+                (_encode(queued), now + delay, now, job['job_id'], owner, owner)
+            )
+        if cursor.rowcount:
+            self._changed(queued, 'queued')
+        return cursor.rowcount > 0
+
+    def retry(self, job_id):
+        """
+        Re-queues a failed job on request. It resumes at the stage that failed.
+
+        Returns:
+            bool: False if there is no failed job with this ID.
+        """
+        now = time.time()
+        with db.connect(self.path) as conn:
+            row = conn.execute("SELECT data FROM jobs WHERE id = ? AND state = 'failed'", (job_id,)).fetchone()
+            if row is None:
+                return False
+            job = json.loads(row['data'])
+            for field in TRANSIENT_FIELDS + FAILURE_FIELDS:
+                job.pop(field, None)
+            # A manual retry gets a fresh set of automatic retries.
+            job.pop('retries', None)
+            conn.execute(
+                "UPDATE jobs SET state = 'queued', data = ?, error = NULL, not_before = 0, updated_at = ? WHERE id = ?",
+                (_encode(job), now, job_id)
+            )
+        with self._available:
+            self._available.notify()
+        job['job_id'] = job_id
+        self._changed(job, 'queued', added=True)
+        return True
+
+    def get_job(self, job_id):
+        """Returns a job's state, error, attempts and data (including checkpoints), or None."""
+        with db.connect(self.path) as conn:
+            row = conn.execute(
+                "SELECT id, state, data, attempts, error, not_before, created_at, updated_at FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "job_id": row['id'],
+            "state": row['state'],
+            "attempts": row['attempts'],
+            "error": row['error'],
+            "retry_at": row['not_before'] or None,
+            "created_at": row['created_at'],
+            "updated_at": row['updated_at'],
+            "job": json.loads(row['data'])
+        }
+
+    # --- leases ---
+
+    def start_lease_keeper(self):
+        """Renews this process's leases and re-queues jobs whose lease expired, in the background."""
+        if self._lease_thread is None:
+            self._lease_thread = threading.Thread(target=self._lease_loop, name="JobLeaseKeeper", daemon=True)
+            self._lease_thread.start()
+
+    def _lease_loop(self):
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            try:
+                self.renew_leases()
+                self.requeue_expired()
+            except Exception as e:
+                logging.error(f"Failed to maintain job leases: {e}")
+
+    def renew_leases(self, owner=None, job_ids=None):
+        """
+        Extends the leases held by `owner` (this process by default), optionally only for `job_ids`.
+
+        Returns:
+            list: IDs of the jobs whose lease was renewed.
+        """
+        owner = owner or self.owner
+        now = time.time()
+        query = "UPDATE jobs SET lease_expires = ? WHERE lease_owner = ?"
+        params = [now + self.lease_seconds, owner]
+        if job_ids is not None:
+            if not job_ids:
+                return []
+            query += f" AND id IN ({', '.join('?' * len(job_ids))})"
+            params += list(job_ids)
+        with db.connect(self.path) as conn:
+            conn.execute(query, params)
+            rows = conn.execute("SELECT id FROM jobs WHERE lease_owner = ?", (owner,)).fetchall()
+        return [row['id'] for row in rows]
+
+    def requeue_expired(self):
+        """
+        Puts jobs whose lease expired back in the queue (e.g. the process died mid-job).
+
+        Returns:
+            int: The number of jobs re-queued.
+        """
+        now = time.time()
+        requeued = []
+        with db.connect(self.path) as conn:
+            rows = conn.execute(
+                f"SELECT id, data FROM jobs WHERE state IN ({', '.join('?' * len(ACTIVE_STATES))}) "
+                "AND lease_owner IS NOT NULL AND lease_expires < ?",
+                ACTIVE_STATES + (now,)
+            ).fetchall()
+            for row in rows:
+                job = json.loads(row['data'])
+                for field in TRANSIENT_FIELDS:
+                    job.pop(field, None)
+                conn.execute(
+                    "UPDATE jobs SET state = 'queued', data = ?, lease_owner = NULL, lease_expires = NULL, updated_at = ? "
+                    "WHERE id = ?",
+                    (_encode(job), now, row['id'])
+                )
+                job['job_id'] = row['id']
+                requeued.append(job)
+        if rows:
+            logging.warning(f"Re-queued {len(rows)} job(s) whose lease expired.")
+            with self._available:
+                self._available.notify_all()
+        for job in requeued:
+            self._changed(job, 'queued')
+        return len(rows)
+
+    def recover(self):
+        """
+        Called at start-up. Jobs in flight when the previous run stopped hold leases of a process
+        that no longer exists; they are expired now instead of waiting out the lease. Leases of
+        remote agents are left alone, since the agents may still be working on them.
+        """
+        with db.connect(self.path) as conn:
+            conn.execute(
+                "UPDATE jobs SET lease_expires = 0 WHERE lease_owner IS NOT NULL AND lease_owner != ? "
+                "AND lease_owner NOT LIKE ?",
+                (self.owner, AGENT_OWNER_PREFIX + '%')
+            )
+        return self.requeue_expired()
+
+    # --- inspection ---
+
+    def snapshot(self, limit=None):
+        """
+        Returns the queued jobs in the order claim() will hand them to this process (at most
+        `limit`): jobs that are ready, each followed by the rest of its group, then the jobs
+        waiting for a retry by retry time. Agents claiming at the same time follow their own
+        groups, so for them the order is an approximation.
+        """
+        now = time.time()
+        with db.connect(self.path) as conn:
+            rows = conn.execute(
+                "SELECT id, group_key, not_before FROM jobs WHERE state = 'queued' ORDER BY id"
+            ).fetchall()
+        ready = [row for row in rows if row['not_before'] <= now]
+        delayed = sorted((row for row in rows if row['not_before'] > now), key=lambda row: (row['not_before'], row['id']))
+
+        # Play claim() forward: after a job, queued jobs of its group come first.
+        groups = {}
+        for row in ready:
+            if row['group_key'] is not None:
+                groups.setdefault(row['group_key'], deque()).append(row['id'])
+        order, claimed, index = [], set(), 0
+        last_group = self._last_group.get(self.owner)
+        while len(order) < len(ready) and (limit is None or len(order) < limit):
+            if groups.get(last_group):
+                job_id = groups[last_group].popleft()
+            else:
+                while ready[index]['id'] in claimed:
+                    index += 1
+                job_id, last_group = ready[index]['id'], ready[index]['group_key']
+                if last_group is not None:
+                    groups[last_group].popleft()
+            claimed.add(job_id)
+            order.append(job_id)
+        order += [row['id'] for row in delayed]
+        if limit is not None:
+            order = order[:limit]
+
+        with db.connect(self.path) as conn:
+            data = {}
+            # Stay well below SQLite's limit on query parameters.
+            for start in range(0, len(order), 500):
+                batch = order[start:start + 500]
+                rows = conn.execute(f"SELECT id, data FROM jobs WHERE id IN ({','.join('?' * len(batch))})", batch)
+                data.update((row['id'], row['data']) for row in rows)
+        jobs = []
+        for job_id in order:
+            if job_id not in data:
+                continue    # Claimed in the meantime
+            job = json.loads(data[job_id])
+            job['job_id'] = job_id
+            job['state'] = 'queued'
+            jobs.append(job)
+        return jobs
+
+    def active(self, exclude_owner=None):
+        """Returns the jobs currently leased (in the pipeline of this process or of an agent)."""
+        with db.connect(self.path) as conn:
+            rows = conn.execute(
+                "SELECT id, state, data, lease_owner FROM jobs WHERE lease_owner IS NOT NULL AND lease_owner IS NOT ? ORDER BY id",
+                (exclude_owner,)
+            ).fetchall()
+        jobs = []
+        for row in rows:
+            job = json.loads(row['data'])
+            job['job_id'] = row['id']
+            job['state'] = row['state']
+            if row['lease_owner'].startswith(AGENT_OWNER_PREFIX):
+                job['agent'] = row['lease_owner'][len(AGENT_OWNER_PREFIX):]
+            jobs.append(job)
+        return jobs
+
+    def qsize(self):
+        with db.connect(self.path) as conn:
+            return conn.execute("SELECT COUNT(*) FROM jobs WHERE state = 'queued'").fetchone()[0]
+
+    def counts(self):
+        """Number of jobs per state."""
+        with db.connect(self.path) as conn:
+            return {row['state']: row['n'] for row in conn.execute("SELECT state, COUNT(*) AS n FROM jobs GROUP BY state")}
@@ -9,10 +9,28 @@ import shutil
 import re
 
 import csdm_cli_handler
+import metrics
 import youtube_uploader
 import demo_downloader
+import pipeline
+import readiness
+import socket
+from agent_client import RemoteJobQueue
+from cs2_tracker import GameProcessTracker
+from demo_store import DemoStore, match_id_from_path
 from obs_recorder import OBSRecorder
-from web_server import demo_queue, current_status, completed_jobs, run_web_server, save_results
+from recording_watchdog import RecordingWatchdog
+import web_server
+from web_server import demo_queue, pipeline_jobs, current_status, run_web_server, add_result
+
+# Index of downloaded demos with disk-budget eviction. Created at start-up.
+demo_store = None
+
+# Connection to OBS shared by every job. Created at start-up.
+obs = None
+
+# Where the pipeline takes its jobs from: the local queue, or a coordinator's queue in agent mode.
+job_queue = demo_queue
 
 def setup_logging():
     log_dir = 'logs'
@@ -79,175 +97,407 @@ def rename_video_with_suspect_info(source_file, steam64_id, demo_name):
         logging.error(f"Failed to rename video file: {e}")
         return source_file  # Return original path if rename fails
 
-def processing_worker():
-    """The main worker thread that processes demos from the queue."""
-    logging.info("Processing worker started.")
-    
+def load_worker_config():
+    """Reads the worker settings from config.ini."""
     config = configparser.ConfigParser()
     config.read('config.ini')
     try:
-        csdm_project_path = config['Paths']['csdm_project_path']
-        demos_folder = config['Paths']['demos_folder']
-        output_folder = config['Paths']['output_folder']
-        obs_host = config['OBS']['host']
-        obs_port = int(config['OBS']['port'])
-        video_generate_only = config['Video'].getboolean('video_generate_only', True)
+        return {
+            "csdm_project_path": config['Paths']['csdm_project_path'],
+            "demos_folder": config['Paths']['demos_folder'],
+            "output_folder": config['Paths']['output_folder'],
+            "obs_host": config['OBS']['host'],
+            "obs_port": int(config['OBS']['port']),
+            "obs_heartbeat_interval": config.getfloat('OBS', 'heartbeat_interval', fallback=10),
+            "video_generate_only": config['Video'].getboolean('video_generate_only', True),
+            "prefetch_depth": config.getint('Pipeline', 'prefetch_depth', fallback=2),
+            "download_workers": config.getint('Pipeline', 'download_workers', fallback=2),
+            "analyze_workers": config.getint('Pipeline', 'analyze_workers', fallback=1),
+            "postprocess_workers": config.getint('Pipeline', 'postprocess_workers', fallback=1),
+            "upload_workers": config.getint('Pipeline', 'upload_workers', fallback=1),
+            "decompress_workers": config.getint('Pipeline', 'decompress_workers', fallback=4),
+            "share_code_ttl_hours": config.getfloat('Cache', 'share_code_ttl_hours', fallback=24 * 7),
+            "share_code_max_entries": config.getint('Cache', 'share_code_max_entries', fallback=5000),
+            "mirror_timeout": config.getfloat('Mirrors', 'request_timeout', fallback=15),
+            "mirror_hedge_delay": config.getfloat('Mirrors', 'hedge_delay', fallback=3),
+            "mirror_failure_threshold": config.getint('Mirrors', 'failure_threshold', fallback=3),
+            "mirror_cooldown": config.getfloat('Mirrors', 'cooldown', fallback=300),
+            "demos_budget_gb": config.getfloat('Storage', 'demos_budget_gb', fallback=0),
+            "readiness_probes": [name.strip() for name in config.get('Recording', 'readiness_probes', fallback='process').split(',') if name.strip()],
+            "readiness_timeout": config.getfloat('Recording', 'readiness_timeout', fallback=60),
+            "cs2_console_log": config.get('Recording', 'cs2_console_log', fallback=''),
+            "ready_pattern": config.get('Recording', 'ready_pattern', fallback=readiness.DEFAULT_READY_PATTERN),
+            "process_ready_seconds": config.getfloat('Recording', 'process_ready_seconds', fallback=20),
+            "process_cpu_percent": config.getfloat('Recording', 'process_cpu_percent', fallback=0) or None,
+            "watchdog_interval": config.getfloat('Recording', 'watchdog_interval', fallback=5),
+            "watchdog_stall_seconds": config.getfloat('Recording', 'stall_seconds', fallback=30),
+            "watchdog_max_drop_rate": config.getfloat('Recording', 'max_frame_drop_rate', fallback=0.25),
+            "job_lease_seconds": config.getfloat('Queue', 'lease_seconds', fallback=120),
+            "retries": {
+                stage: config.getint('Retry', f'{stage}_retries', fallback=default)
+                for stage, default in (('download', 3), ('analyze', 1), ('record', 1), ('postprocess', 0), ('upload', 3))
+            },
+            "retry_backoff": config.getfloat('Retry', 'backoff_seconds', fallback=30),
+            "max_retry_backoff": config.getfloat('Retry', 'max_backoff_seconds', fallback=900),
+            "csdm_use_daemon": config.getboolean('CSDM', 'use_daemon', fallback=False),
+            "csdm_health_check_interval": config.getfloat('CSDM', 'health_check_interval', fallback=30),
+            "mode": config.get('Agent', 'mode', fallback='standalone').strip().lower(),
+            "coordinator_url": config.get('Agent', 'coordinator_url', fallback=''),
+            "agent_id": config.get('Agent', 'agent_id', fallback='') or socket.gethostname(),
+            "agent_token": config.get('Agent', 'token', fallback=''),
+            "agent_heartbeat_interval": config.getfloat('Agent', 'heartbeat_interval', fallback=30),
+        }
     except KeyError as e:
         logging.error(f"Configuration error: Missing key {e} in config.ini.")
-        return
+        return None
+
+def format_download_progress(progress):
+    """e.g. 'Downloading demo... 45% of 312 MB (12.3 MB/s, ETA 21s)'"""
+    mb = 1024 * 1024
+    text = f"Downloading demo... {progress['downloaded_bytes'] / mb:.0f} MB"
+    if progress['total_bytes']:
+        percent = progress['downloaded_bytes'] * 100 // progress['total_bytes']
+        text = f"Downloading demo... {percent}% of {progress['total_bytes'] / mb:.0f} MB"
+    text += f" ({progress['bytes_per_sec'] / mb:.1f} MB/s"
+    if progress['eta_seconds'] is not None:
+        text += f", ETA {progress['eta_seconds']:.0f}s"
+    return text + ")"
+
+def download_stage(job, settings):
+    """Step 1: Download Demo."""
+    suspect_steam_id = job['suspect_steam_id']
+    user_input = job['share_code']
+    job['youtube_upload'] = job.get('youtube_upload', not settings['video_generate_only'])
+
+    def report_progress(progress):
+        job['download_progress'] = progress
+        job['step'] = format_download_progress(progress)
+
+    # Check if input is a direct demo URL or a share code
+    if demo_downloader.is_demo_url(user_input):
+        job['step'] = "Downloading demo..."
+        logging.info(f"Direct demo URL detected for {suspect_steam_id}, downloading...")
+        demo_path = demo_downloader.download_demo(user_input, settings['demos_folder'], decompress_workers=settings['decompress_workers'],
+                                                   progress_callback=report_progress)
+    else:
+        share_code = demo_downloader.parse_share_code(user_input)
+        if not share_code:
+            raise ValueError("Invalid share code provided.")
+
+        job['step'] = "Downloading demo..."
+        logging.info(f"Downloading demo for {share_code} (Suspect: {suspect_steam_id})...")
+        demo_path = demo_downloader.download_demo(share_code, settings['demos_folder'], decompress_workers=settings['decompress_workers'],
+                                                   progress_callback=report_progress)
+    if not demo_path:
+        raise RuntimeError("Failed to download demo.")
+
+    demo_path = demo_store.register(demo_path, acquire=True)
+    job['demo_path'] = demo_path
+    job['demo_bytes'] = os.path.getsize(demo_path)
+    job['demo_acquired'] = True
+    demo_store.evict(protected_match_ids=queued_match_ids())
+
+def queued_match_ids():
+    """
+    Match IDs of the demos of queued jobs (including those waiting for a retry) and of jobs in
+    the pipeline, as far as they are known.
+    """
+    match_ids = set()
+    for job in job_queue.snapshot() + list(pipeline_jobs):
+        if job.get('demo_path'):
+            match_ids.add(match_id_from_path(job['demo_path']))
+            continue
+        user_input = job['share_code']
+        if demo_downloader.is_demo_url(user_input):
+            match_ids.add(match_id_from_path(user_input))
+        else:
+            share_code = demo_downloader.parse_share_code(user_input)
+            download_url = share_code and demo_downloader.url_cache.peek(share_code)
+            if download_url:
+                match_ids.add(match_id_from_path(download_url))
+    return match_ids
+
+def analyze_stage(job, settings):
+    """Step 2: Analyze Demo."""
+    job['step'] = "Analyzing demo..."
+    logging.info(f"Analyzing demo {job['demo_path']} (Suspect: {job['suspect_steam_id']})...")
+    demo_hash = demo_store.content_hash(job['demo_path'])
+    if not csdm_cli_handler.analyze_demo(settings['csdm_project_path'], job['demo_path'], demo_hash):
+        raise RuntimeError("Demo analysis failed.")
 
-    while True:
-        try:
-            job = demo_queue.get()
-            suspect_steam_id = job['suspect_steam_id']
-            user_input = job['share_code']
-            
-            # Check if YouTube upload is requested (overrides default setting)
-            youtube_upload = job.get('youtube_upload', not video_generate_only)
-            
-            update_status("Processing", "Starting new job...", suspect_steam_id)
-
-            workflow_successful = False
-            youtube_link = None
-            task_status = None
-            final_video_path = None
-            obs = OBSRecorder(host=obs_host, port=obs_port)
+def record_stage(job, settings):
+    """Steps 3 and 4: Connect to OBS, play the highlights and record them. Runs in a single slot."""
+    suspect_steam_id = job['suspect_steam_id']
+    output_folder = settings['output_folder']
+    workflow_successful = False
+    tracker = None
+    watchdog = None
+    recording_started = None
+    abort_recording = threading.Event()
 
+    try:
+        # Step 3: Make sure the shared OBS connection is up
+        job['step'] = "Recording..."
+        update_status("Processing", "Connecting to OBS...", suspect_steam_id)
+        obs.connect()
+        if not obs.is_connected:
+            raise RuntimeError("Could not connect to OBS.")
+
+        # Step 4: Start Highlights and Recording
+        update_status("Recording", "Launching CS2 for highlights...", suspect_steam_id)
+        launcher_pid = csdm_cli_handler.start_highlights(settings['csdm_project_path'], job['demo_path'], suspect_steam_id)
+        if launcher_pid is None:
+            raise RuntimeError("Failed to launch highlights.")
+        tracker = GameProcessTracker(launcher_pid)
+
+        update_status("Recording", "Waiting for the highlights to start playing...", suspect_steam_id)
+        if tracker.find(timeout=60) is None:
+            raise RuntimeError("The CS2 process did not appear within 60 seconds.")
+        probes = readiness.build_probes(
+            settings['readiness_probes'], tracker,
+            console_log_path=settings['cs2_console_log'],
+            ready_pattern=settings['ready_pattern'],
+            process_ready_seconds=settings['process_ready_seconds'],
+            process_cpu_percent=settings['process_cpu_percent']
+        )
+        ready_probe = readiness.wait_until_ready(probes, timeout=settings['readiness_timeout'], tracker=tracker)
+        job_metrics = job.setdefault('metrics', {})
+        job_metrics['launch_to_ready_seconds'] = round(time.time() - tracker.launched_at, 1)
+        job_metrics['ready_probe'] = ready_probe or "timeout"
+        metrics.stage_seconds.observe(time.time() - tracker.launched_at, stage='cs2_launch')
+        if ready_probe:
+            logging.info(f"Highlights are playing ('{ready_probe}' probe) {job_metrics['launch_to_ready_seconds']} seconds after launch.")
+        else:
+            logging.warning(f"No readiness signal within {settings['readiness_timeout']} seconds. Recording anyway.")
+
+        update_status("Recording", "Starting OBS recording...", suspect_steam_id)
+        obs.start_recording()
+        recording_started = time.time()
+        watchdog = RecordingWatchdog(
+            obs, abort_recording,
+            interval=settings['watchdog_interval'],
+            stall_seconds=settings['watchdog_stall_seconds'],
+            max_drop_rate=settings['watchdog_max_drop_rate']
+        )
+        watchdog.start()
+
+        update_status("Recording", "Waiting for highlights to finish...", suspect_steam_id)
+        
+        if not csdm_cli_handler.wait_for_cs2_to_close(tracker, stop_event=abort_recording):
+            if watchdog.abort_reason:
+                job['abort_reason'] = watchdog.abort_reason
+                raise RuntimeError(f"Recording aborted: {watchdog.abort_reason}")
+            raise RuntimeError("Timed out waiting for CS2 process to close.")
+        job.setdefault('metrics', {})['highlights_seconds'] = round(tracker.exited_at - tracker.found_at, 1)
+
+        workflow_successful = True
+
+    except Exception as e:
+        update_status("Error", f"Workflow failed: {e}", suspect_steam_id)
+        raise
+
+    finally:
+        # --- Cleanup ---
+        if watchdog:
+            watchdog.stop()
+        recording_path = None
+        if recording_started:
+            metrics.stage_seconds.observe(time.time() - recording_started, stage='recording')
+        if obs.is_recording:
+            update_status("Processing", "Waiting for OBS to save the video file...", suspect_steam_id)
+            finalize_started = time.time()
+            recording_path = obs.stop_recording()
+            metrics.stage_seconds.observe(time.time() - finalize_started, stage='obs_finalize')
+        
+        # This is now just a backup in case the process hangs.
+        csdm_cli_handler.force_close_cs2(tracker)
+
+        if workflow_successful and recording_path and os.path.exists(recording_path):
+            job['recording_path'] = recording_path
+            logging.info(f"Recording saved to {recording_path}")
+        # Older OBS versions do not report the path. The newest file must then be
+        # picked before the next recording starts.
+        elif workflow_successful:
+            update_status("Processing", "Finding latest recording...", suspect_steam_id)
             try:
-                # Step 1: Download Demo
-                # Check if input is a direct demo URL or a share code
-                if demo_downloader.is_demo_url(user_input):
-                    update_status("Processing", "Direct demo URL detected, downloading...", suspect_steam_id)
-                    demo_path = demo_downloader.download_demo(user_input, demos_folder)
-                else:
-                    update_status("Processing", "Parsing share code...", suspect_steam_id)
-                    share_code = demo_downloader.parse_share_code(user_input)
-                    if not share_code:
-                        raise ValueError("Invalid share code provided.")
-                    
-                    update_status("Processing", f"Downloading demo for {share_code}...", suspect_steam_id)
-                    demo_path = demo_downloader.download_demo(share_code, demos_folder)
-                if not demo_path:
-                    raise RuntimeError("Failed to download demo.")
-
-                # Step 2: Analyze Demo
-                update_status("Processing", "Analyzing demo...", suspect_steam_id)
-                if not csdm_cli_handler.analyze_demo(csdm_project_path, demo_path):
-                    raise RuntimeError("Demo analysis failed.")
-
-                # Step 3: Connect to OBS
-                update_status("Processing", "Connecting to OBS...", suspect_steam_id)
-                obs.connect()
-                if not obs.is_connected:
-                    raise RuntimeError("Could not connect to OBS.")
-
-                # Step 4: Start Highlights and Recording
-                update_status("Recording", "Launching CS2 for highlights...", suspect_steam_id)
-                if not csdm_cli_handler.start_highlights(csdm_project_path, demo_path, suspect_steam_id):
-                    raise RuntimeError("Failed to launch highlights.")
-
-                logging.info("Waiting 20 seconds for CS2 to load...")
-                time.sleep(20)
+                files = [os.path.join(output_folder, f) for f in os.listdir(output_folder) if f.endswith('.mp4')]
+                if not files:
+                    raise FileNotFoundError("No .mp4 files found in the OBS output folder.")
                 
-                update_status("Recording", "Starting OBS recording...", suspect_steam_id)
-                obs.start_recording()
+                job['recording_path'] = max(files, key=os.path.getctime)
+                logging.info(f"Latest recording found: {job['recording_path']}")
+            except Exception as e:
+                job['task_status'] = "Upload Failed" if job['youtube_upload'] else "Failed to Save"
+                update_status("Error", f"Could not find the recording: {e}", suspect_steam_id)
+                raise
 
-                update_status("Recording", "Waiting for highlights to finish...", suspect_steam_id)
-                
-                if not csdm_cli_handler.wait_for_cs2_to_close():
-                    raise RuntimeError("Timed out waiting for CS2 process to close.")
+        update_status("Idle", "Waiting for a new demo to be submitted.")
 
-                workflow_successful = True
+def postprocess_stage(job, settings):
+    """Save locally with proper naming. YouTube uploads keep OBS's file name."""
+    if job['youtube_upload']:
+        return
 
-            except Exception as e:
-                logging.error(f"A critical error occurred for {suspect_steam_id}: {e}")
-                update_status("Error", f"Workflow failed: {e}", suspect_steam_id)
-
-            finally:
-                # --- Cleanup ---
-                if obs.is_recording:
-                    obs.stop_recording()
-                    logging.info("Waiting 10 seconds for OBS to save the video file...")
-                    time.sleep(10)
-                if obs.is_connected:
-                    obs.disconnect()
-                
-                # This is now just a backup in case the process hangs.
-                csdm_cli_handler.force_close_cs2()
-
-                # --- Upload/Save Step ---
-                if workflow_successful:
-                    update_status("Processing", "Finding latest recording...", suspect_steam_id)
-                    try:
-                        files = [os.path.join(output_folder, f) for f in os.listdir(output_folder) if f.endswith('.mp4')]
-                        if not files:
-                            raise FileNotFoundError("No .mp4 files found in the OBS output folder.")
-                        
-                        latest_file = max(files, key=os.path.getctime)
-                        logging.info(f"Latest recording found: {latest_file}")
-                        
-                        if youtube_upload:
-                            # Upload to YouTube
-                            update_status("Uploading", f"Uploading {os.path.basename(latest_file)}...", suspect_steam_id)
-                            video_title = f"Suspected Cheater: {suspect_steam_id} - Highlights"
-                            youtube_link = youtube_uploader.upload_video(latest_file, video_title)
-                            
-                            if youtube_link:
-                                task_status = "Uploaded"
-                                update_status("Finished", "Upload complete!", suspect_steam_id)
-                            else:
-                                task_status = "Upload Failed"
-                                raise RuntimeError("Upload failed to return a URL.")
-                        else:
-                            # Save locally with proper naming
-                            update_status("Processing", "Renaming video file...", suspect_steam_id)
-                            demo_name = extract_demo_name_from_url(user_input)
-                            final_video_path = rename_video_with_suspect_info(latest_file, suspect_steam_id, demo_name)
-                            
-                            task_status = "Saved Locally"
-                            youtube_link = f"file://{final_video_path}"  # Local file reference
-                            update_status("Finished", "Video saved locally!", suspect_steam_id)
-
-                    except Exception as e:
-                        if youtube_upload:
-                            logging.error(f"Failed to upload the recording: {e}")
-                            task_status = "Upload Failed"
-                            update_status("Error", f"Upload failed: {e}", suspect_steam_id)
-                        else:
-                            logging.error(f"Failed to save the recording: {e}")
-                            task_status = "Failed to Save"
-                            update_status("Error", f"Save failed: {e}", suspect_steam_id)
-                else:
-                    logging.warning("Workflow did not complete successfully. Skipping upload/save.")
-                    task_status = "Processing Failed"
-
-            # Add the completed job to the results list
-            completed_jobs.append({
-                "suspect_steam_id": suspect_steam_id,
-                "share_code": job['share_code'],
-                "youtube_link": youtube_link or "Processing Failed",
-                "task_status": task_status or "Processing Failed",
-                "final_video_path": final_video_path,
-                "youtube_upload": youtube_upload,
-                "submitted_by": job.get('submitted_by', 'N/A')
-            })
-            save_results()
-
-            demo_queue.task_done()
-            time.sleep(5)
-            update_status("Idle", "Waiting for a new demo to be submitted.")
-
-        except queue.Empty:
-            time.sleep(1)
+    suspect_steam_id = job['suspect_steam_id']
+    job['step'] = "Renaming video file..."
+    try:
+        demo_name = extract_demo_name_from_url(job['share_code'])
+        job['final_video_path'] = rename_video_with_suspect_info(job['recording_path'], suspect_steam_id, demo_name)
+        job['task_status'] = "Saved Locally"
+        job['youtube_link'] = f"file://{job['final_video_path']}"  # Local file reference
+        logging.info(f"Video saved locally for {suspect_steam_id}.")
+    except Exception as e:
+        logging.error(f"Failed to save the recording: {e}")
+        job['task_status'] = "Failed to Save"
+        raise
+
+def upload_stage(job, settings):
+    """Upload to YouTube."""
+    if not job['youtube_upload']:
+        return
+
+    suspect_steam_id = job['suspect_steam_id']
+    recording_path = job['recording_path']
+    job['step'] = f"Uploading {os.path.basename(recording_path)}..."
+    video_title = f"Suspected Cheater: {suspect_steam_id} - Highlights"
+    youtube_link = youtube_uploader.upload_video(recording_path, video_title)
+    
+    if youtube_link:
+        job['task_status'] = "Uploaded"
+        job['youtube_link'] = youtube_link
+        logging.info(f"Upload complete for {suspect_steam_id}.")
+    else:
+        job['task_status'] = "Upload Failed"
+        raise RuntimeError("Upload failed to return a URL.")
+
+def acquire_job(job):
+    """Holds the demo of a job that resumes past the download stage, which would have acquired it."""
+    if job.get('resume_from', 'download') == 'download' or job.get('demo_acquired'):
+        return
+    if job.get('demo_path') and os.path.exists(job['demo_path']):
+        demo_store.acquire(job['demo_path'])
+        job['demo_acquired'] = True
+
+def release_job(job):
+    """Releases the demo a job holds when it leaves the pipeline (finished, or waiting for a retry)."""
+    if job.pop('demo_acquired', False):
+        demo_store.release(job['demo_path'])
+
+def finish_job(job):
+    """Adds a job that left the pipeline to the results list."""
+    if job.get('error') and not job.get('task_status'):
+        logging.warning("Workflow did not complete successfully. Skipping upload/save.")
+    # An agent's results are added by the coordinator when the job is reported complete.
+    if job_queue is demo_queue:
+        add_result(job)
+
+def demo_key(job):
+    """Identifies a job's demo, so jobs for different suspects in the same match can be grouped."""
+    if job.get('demo_path'):
+        return os.path.abspath(job['demo_path'])
+    return (job.get('share_code') or '').strip() or None
+
+def build_pipeline(settings):
+    """
+    Creates the job pipeline. Each step has its own queue and worker pool, so downloads,
+    analysis, renaming and uploads run in parallel while recording stays a single slot.
+    """
+    def bind(handler):
+        return lambda job: handler(job, settings)
+
+    def retry_policy(stage_name):
+        return {
+            "retries": settings['retries'][stage_name],
+            "retry_backoff": settings['retry_backoff'],
+            "max_retry_backoff": settings['max_retry_backoff']
+        }
+
+    def file_exists(key):
+        return lambda job: bool(job.get(key)) and os.path.exists(job[key])
+
+    stages = [
+        # Jobs for the same demo are grouped (by the job queue and the record queue), so it is
+        # downloaded and analyzed once and its suspects are recorded back to back.
+        pipeline.Stage('download', bind(download_stage), workers=settings['download_workers'], input_queue=job_queue,
+                       produces=('demo_path',), checkpoint_valid=file_exists('demo_path'), **retry_policy('download')),
+        # The analysis lives in the CSDM database, but recording also needs the demo file.
+        # At most `prefetch_depth` downloaded jobs wait for analysis. The full queue blocks the
+        # download workers, so they stop claiming jobs instead of downloading the whole backlog.
+        pipeline.Stage('analyze', bind(analyze_stage), workers=settings['analyze_workers'],
+                       queue_size=max(1, settings['prefetch_depth']),
+                       checkpoint_valid=file_exists('demo_path'), **retry_policy('analyze')),
+        # At most `prefetch_depth` prepared jobs wait for the recorder.
+        pipeline.Stage('record', bind(record_stage), workers=1, queue_size=max(1, settings['prefetch_depth']),
+                       group_key=demo_key, produces=('recording_path', 'metrics'),
+                       checkpoint_valid=file_exists('recording_path'), **retry_policy('record')),
+        pipeline.Stage('postprocess', bind(postprocess_stage), workers=settings['postprocess_workers'],
+                       produces=('final_video_path',), **retry_policy('postprocess')),
+        pipeline.Stage('upload', bind(upload_stage), workers=settings['upload_workers'],
+                       produces=('youtube_link',), **retry_policy('upload')),
+    ]
+    return pipeline.Pipeline(stages, finish_job, tracked_jobs=pipeline_jobs, job_store=job_queue,
+                             on_job_entered=acquire_job, on_job_left=release_job)
 
 
 if __name__ == '__main__':
     setup_logging()
     
-    # Start the processing worker in a separate thread
-    worker_thread = threading.Thread(target=processing_worker, name="ProcessingWorker")
-    worker_thread.daemon = True
-    worker_thread.start()
+    settings = load_worker_config()
+    # standalone: web server, job queue and pipeline in this process.
+    # coordinator: web server and job queue only; recording agents on other machines do the work.
+    # agent: pipeline only, working off the coordinator's queue.
+    mode = settings['mode'] if settings else 'standalone'
+    if settings and mode == 'agent' and not settings['coordinator_url']:
+        logging.error("Configuration error: agent mode needs [Agent] coordinator_url.")
+        sys.exit(1)
+
+    if mode == 'coordinator':
+        # Nothing records here; queue ETAs only count the agents.
+        web_server.local_record_slots = 0
+
+    if settings and mode != 'agent':
+        # Jobs that were in flight when the last run stopped go back in the queue.
+        demo_queue.lease_seconds = settings['job_lease_seconds']
+        demo_queue.group_key = demo_key
+        demo_queue.recover()
+        demo_queue.start_lease_keeper()
+
+    if settings and mode != 'coordinator':
+        demo_downloader.url_cache.ttl_hours = settings['share_code_ttl_hours']
+        demo_downloader.url_cache.max_entries = settings['share_code_max_entries']
+        demo_downloader.mirror_pool.timeout = settings['mirror_timeout']
+        demo_downloader.mirror_pool.hedge_delay = settings['mirror_hedge_delay']
+        demo_downloader.mirror_pool.failure_threshold = settings['mirror_failure_threshold']
+        demo_downloader.mirror_pool.cooldown = settings['mirror_cooldown']
+
+        if settings['csdm_use_daemon']:
+            csdm_cli_handler.enable_daemon(settings['csdm_project_path'], settings['csdm_health_check_interval'])
+
+        obs = OBSRecorder(host=settings['obs_host'], port=settings['obs_port'],
+                          heartbeat_interval=settings['obs_heartbeat_interval'])
+        obs.start()
+
+        if mode == 'agent':
+            job_queue = RemoteJobQueue(settings['coordinator_url'], settings['agent_id'], token=settings['agent_token'],
+                                       jobs=pipeline_jobs, status=current_status,
+                                       heartbeat_interval=settings['agent_heartbeat_interval'])
+            job_queue.start_heartbeat()
+
+        demo_store = DemoStore(budget_bytes=int(settings['demos_budget_gb'] * 1024 ** 3))
+        demo_store.sync(settings['demos_folder'])
+        metrics.registry.gauge('demo2video_demo_store_bytes', 'Disk space used by downloaded demos.',
+                               lambda: demo_store.stats()['size_bytes'])
+        metrics.registry.gauge('demo2video_disk_free_bytes', 'Free disk space of the demos and video folders.',
+                               lambda: {folder: shutil.disk_usage(settings[f'{folder}_folder']).free for folder in ('demos', 'output')},
+                               label='folder')
+        demo_store.evict(protected_match_ids=queued_match_ids())
+
+        # Start the processing stages in background threads
+        build_pipeline(settings).start()
+
+    if mode == 'agent':
+        logging.info(f"Recording agent '{settings['agent_id']}' is working for {settings['coordinator_url']}")
+        threading.Event().wait()
 
     # Start the Flask web server in the main thread
     logging.info("Starting web server on http://localhost:5001")
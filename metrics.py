@@ -0,0 +1,138 @@
+import bisect
+import logging
+import threading
+
+# This module collects the process's metrics and renders them in the Prometheus text
+# format for /metrics. Counters and histograms are updated in place under one small lock
+# of their own, so recording a value never waits on the queue, the results store or the
+# web server. Gauges are read from callbacks when the metrics are collected. A snapshot
+# is plain JSON, so recording agents can send theirs to the coordinator with a heartbeat.
+
+# Stage durations range from a second (renaming) to half an hour (recording highlights).
+DURATION_BUCKETS = (1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = []
+        self._gauges = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help_text, callback, label=None):
+        """
+        Adds a gauge whose value is read from `callback` on collection. The callback returns a
+        number, or a dict of label value -> number when `label` is given (e.g. jobs per state).
+        """
+        self._gauges.append((name, help_text, callback, label))
+
+    def snapshot(self):
+        """Returns every metric family as {"name", "type", "help", "samples": [[name, labels, value]]}."""
+        with self._lock:
+            families = [metric.collect() for metric in self._metrics]
+        for name, help_text, callback, label in self._gauges:
+            try:
+                value = callback()
+            except Exception as e:
+                logging.warning(f"Could not read the {name} gauge: {e}")
+                continue
+            if value is None:
+                continue
+            if label:
+                samples = [[name, {label: str(key)}, number] for key, number in value.items()]
+            else:
+                samples = [[name, {}, value]]
+            families.append({"name": name, "type": "gauge", "help": help_text, "samples": samples})
+        return families
+
+class Counter:
+    def __init__(self, registry, name, help_text, labels=()):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        # A counter without labels is exported as 0 before its first increment.
+        self._values = {} if labels else {(): 0}
+        registry.register(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(label, '')) for label in self.labels)
+        with self.registry._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        samples = [[self.name, dict(zip(self.labels, key)), value] for key, value in self._values.items()]
+        return {"name": self.name, "type": "counter", "help": self.help, "samples": samples}
+
+class Histogram:
+    def __init__(self, registry, name, help_text, labels=(), buckets=DURATION_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._values = {}     # label values -> [per-bucket counts..., +Inf count, sum]
+        registry.register(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(label, '')) for label in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.registry._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def collect(self):
+        samples = []
+        for key, counts in self._values.items():
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                samples.append([self.name + '_bucket', dict(labels, le=str(bound)), cumulative])
+            samples.append([self.name + '_sum', labels, counts[-1]])
+            samples.append([self.name + '_count', labels, cumulative])
+        return {"name": self.name, "type": "histogram", "help": self.help, "samples": samples}
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def render(sources):
+    """
+    Renders snapshots in the Prometheus text format.
+
+    Args:
+        sources (list): (snapshot, extra_labels) pairs, e.g. this process's snapshot and those
+            of the recording agents labelled with agent=<id>. Families with the same name are merged.
+    """
+    families = {}
+    for snapshot, extra_labels in sources:
+        for family in snapshot:
+            merged = families.setdefault(family['name'], {"type": family['type'], "help": family['help'], "samples": []})
+            for name, labels, value in family['samples']:
+                merged['samples'].append((name, dict(labels, **extra_labels), value))
+    lines = []
+    for name, family in families.items():
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['type']}")
+        for sample_name, labels, value in family['samples']:
+            label_text = ','.join(f'{key}="{_escape(label)}"' for key, label in labels.items())
+            lines.append(f"{sample_name}{{{label_text}}} {value}" if label_text else f"{sample_name} {value}")
+    return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+# Durations of the pipeline stages (download, analyze, record, postprocess, upload) and of the
+# steps inside them (decompress, cs2_launch, recording, obs_finalize).
+stage_seconds = Histogram(registry, 'demo2video_stage_duration_seconds',
+                          'Duration of pipeline stages and steps in seconds.', labels=('stage',))
+stage_successes = Counter(registry, 'demo2video_stage_success_total',
+                          'Jobs that completed a pipeline stage.', labels=('stage',))
+stage_failures = Counter(registry, 'demo2video_stage_failures_total',
+                         'Jobs that failed in a pipeline stage, by exception type.', labels=('stage', 'error_type'))
+download_bytes = Counter(registry, 'demo2video_download_bytes_total', 'Demo bytes downloaded.')
+upload_bytes = Counter(registry, 'demo2video_upload_bytes_total', 'Video bytes uploaded to YouTube.')
@@ -0,0 +1,144 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+
+# This module resolves share codes through several decode API mirrors at once.
+# Requests are hedged: the healthiest mirror is asked first, and if it has not answered
+# within `hedge_delay` seconds the next one is asked too. The first download link wins.
+# Each mirror keeps a rolling latency and error score, and a mirror that keeps failing
+# is skipped (circuit-broken) for `cooldown` seconds.
+
+class MirrorHealth:
+    def __init__(self, url):
+        self.url = url
+        self.latency = None         # Rolling average response time in seconds
+        self.error_rate = 0.0       # Rolling share of failed requests
+        self.consecutive_failures = 0
+        self.open_until = 0.0       # Circuit is open (mirror skipped) until this time
+        self.requests = 0
+        self.failures = 0
+
+    def score(self, default_latency):
+        """Lower is better. Errors weigh heavily so a fast but flaky mirror is not preferred."""
+        latency = self.latency if self.latency is not None else default_latency
+        return latency * (1 + 4 * self.error_rate)
+
+    def to_dict(self, now):
+        return {
+            "url": self.url,
+            "latency_ms": round(self.latency * 1000) if self.latency is not None else None,
+            "error_rate": round(self.error_rate, 3),
+            "consecutive_failures": self.consecutive_failures,
+            "circuit_open": self.open_until > now,
+            "requests": self.requests,
+            "failures": self.failures
+        }
+
+class MirrorPool:
+    def __init__(self, urls, timeout=15, hedge_delay=3.0, failure_threshold=3, cooldown=300, smoothing=0.3, session=None):
+        """
+        Args:
+            urls (list): Decode API endpoints, in order of preference until they have a track record.
+            timeout (float): Per-request timeout in seconds.
+            hedge_delay (float): How long to wait for a mirror before also asking the next one.
+            failure_threshold (int): Consecutive failures before a mirror's circuit opens.
+            cooldown (float): Seconds a mirror is skipped once its circuit is open.
+            smoothing (float): Weight of the newest sample in the rolling averages.
+            session (requests.Session): Shared session for connection pooling.
+        """
+        self.timeout = timeout
+        self.hedge_delay = hedge_delay
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.smoothing = smoothing
+        self.session = session or requests.Session()
+        self.mirrors = [MirrorHealth(url) for url in urls]
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, len(urls)) * 2, thread_name_prefix="MirrorRequest")
+
+    def ranked(self):
+        """Returns the mirrors to try, best first. Open circuits are skipped unless all are open."""
+        now = time.time()
+        with self._lock:
+            order = sorted(self.mirrors, key=lambda m: m.score(self.hedge_delay))
+            available = [m for m in order if m.open_until <= now]
+        if not available:
+            # Every mirror is circuit-broken; probing the least bad one beats failing outright.
+            return order[:1]
+        return available
+
+    def resolve(self, share_code):
+        """
+        Asks the mirrors for the download link of a share code.
+
+        Returns:
+            str: The download URL, or None if no mirror returned one.
+        """
+        remaining = self.ranked()
+        pending = set()
+
+        while remaining or pending:
+            if remaining:
+                mirror = remaining.pop(0)
+                logging.info(f"Attempting to get download link from: {mirror.url} with POST request.")
+                pending.add(self._executor.submit(self._request, mirror, share_code))
+
+            # Wait for an answer, but also ask the next mirror if this one is slow.
+            hedge = self.hedge_delay if remaining else None
+            done, pending = wait(pending, timeout=hedge, return_when=FIRST_COMPLETED)
+            for future in done:
+                download_url = future.result()
+                if download_url:
+                    logging.info("Successfully retrieved download link.")
+                    return download_url
+
+        return None
+
+    def _request(self, mirror, share_code):
+        headers = {'Content-Type': 'application/json'}
+        payload = {'shareCode': share_code}
+        start = time.time()
+        try:
+            response = self.session.post(mirror.url, headers=headers, json=payload, timeout=self.timeout)
+            response.raise_for_status()
+            data = response.json()
+            if not isinstance(data, dict):
+                raise ValueError(f"Expected a JSON object, got {type(data).__name__}.")
+            download_url = data.get("downloadLink")
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logging.error(f"Failed to connect to API at {mirror.url}: {e}")
+            self._record(mirror, time.time() - start, failed=True)
+            return None
+
+        self._record(mirror, time.time() - start, failed=False)
+        if not download_url:
+            logging.warning(f"API at {mirror.url} did not return a download URL.")
+        return download_url
+
+    def _record(self, mirror, elapsed, failed):
+        alpha = self.smoothing
+        with self._lock:
+            mirror.requests += 1
+            if mirror.latency is None:
+                mirror.latency = elapsed
+            else:
+                mirror.latency = alpha * elapsed + (1 - alpha) * mirror.latency
+            mirror.error_rate = alpha * (1.0 if failed else 0.0) + (1 - alpha) * mirror.error_rate
+            if failed:
+                mirror.failures += 1
+                mirror.consecutive_failures += 1
+                if mirror.consecutive_failures >= self.failure_threshold:
+                    mirror.open_until = time.time() + self.cooldown
+                    logging.warning(f"Mirror {mirror.url} failed {mirror.consecutive_failures} times in a row. "
+                                    f"Skipping it for {self.cooldown} seconds.")
+            else:
+                mirror.consecutive_failures = 0
+                mirror.open_until = 0.0
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            return [m.to_dict(now) for m in sorted(self.mirrors, key=lambda m: m.score(self.hedge_delay))]
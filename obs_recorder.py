@@ -1,67 +1,220 @@
 import logging
+import threading
+import time
 import obsws_python as obsws
+from obsws_python.error import OBSSDKTimeoutError
+from websocket import WebSocketException
 
 # This module handles all recording interactions with OBS via the obs-websocket plugin.
+# One OBSRecorder is shared by the whole process: it holds a request client and an event
+# client, pings OBS on a heartbeat and reconnects when the connection drops. The recording
+# state is kept in sync from RecordStateChanged events, so we know the moment OBS has
+# finished writing the recording instead of guessing with a sleep.
+
+RECORD_STARTED = 'OBS_WEBSOCKET_OUTPUT_STARTED'
+RECORD_STOPPED = 'OBS_WEBSOCKET_OUTPUT_STOPPED'
+
+# Errors that mean the connection is gone, as opposed to OBS rejecting a request.
+CONNECTION_ERRORS = (OSError, WebSocketException, OBSSDKTimeoutError)
 
 class OBSRecorder:
-    def __init__(self, host='localhost', port=4455):
+    def __init__(self, host='localhost', port=4455, heartbeat_interval=10, request_timeout=10):
+        """
+        Args:
+            host (str): OBS WebSocket host.
+            port (int): OBS WebSocket port.
+            heartbeat_interval (float): Seconds between pings. A failed ping triggers a reconnect.
+            request_timeout (float): Seconds to wait for OBS to answer a request.
+        """
         self.host = host
         self.port = port
+        self.heartbeat_interval = heartbeat_interval
+        self.request_timeout = request_timeout
         self.ws = None
+        self.events = None
         self.is_connected = False
         self.is_recording = False
+        self.output_path = None
+        self.reconnects = 0
+        self._record_stopped = threading.Event()
+        self._lock = threading.RLock()     # The request client is not thread-safe.
+        self._heartbeat = None
 
     def connect(self):
-        """Connects to the OBS WebSocket server."""
-        try:
-            self.ws = obsws.ReqClient(host=self.host, port=self.port)
-            self.is_connected = True
-            logging.info(f"Successfully connected to OBS at {self.host}:{self.port}")
-        except Exception as e:
-            logging.error(f"Failed to connect to OBS WebSocket: {e}")
-            logging.error("Please ensure OBS is running and the obs-websocket plugin is enabled and configured correctly.")
-            self.is_connected = False
+        """Connects to the OBS WebSocket server. Does nothing if already connected."""
+        with self._lock:
+            if self.is_connected:
+                return
+            try:
+                self.ws = obsws.ReqClient(host=self.host, port=self.port, timeout=self.request_timeout)
+                self.is_connected = True
+                logging.info(f"Successfully connected to OBS at {self.host}:{self.port}")
+            except Exception as e:
+                logging.error(f"Failed to connect to OBS WebSocket: {e}")
+                logging.error("Please ensure OBS is running and the obs-websocket plugin is enabled and configured correctly.")
+                self.is_connected = False
+                return
+
+            try:
+                self.events = obsws.EventClient(host=self.host, port=self.port, subs=obsws.Subs.OUTPUTS)
+                self.events.callback.register(self.on_record_state_changed)
+            except Exception as e:
+                logging.warning(f"Could not subscribe to OBS events ({e}). Falling back to a fixed wait after recording.")
+                self.events = None
+
+            # Events may have been missed while we were disconnected.
+            try:
+                self.is_recording = self.ws.get_record_status().output_active
+            except Exception as e:
+                logging.warning(f"Could not read the OBS recording status: {e}")
+
+    def start(self):
+        """Connects and starts the heartbeat thread that keeps the connection alive."""
+        self.connect()
+        if self._heartbeat is None:
+            self._heartbeat = threading.Thread(target=self._heartbeat_loop, name="OBSHeartbeat", daemon=True)
+            self._heartbeat.start()
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(self.heartbeat_interval)
+            if not self.ping():
+                logging.warning("Lost the connection to OBS. Reconnecting...")
+                self.reconnect()
+
+    def ping(self):
+        """Returns True if OBS answers and the event listener is still running."""
+        with self._lock:
+            if not self.is_connected:
+                return False
+            try:
+                self.ws.get_version()
+            except CONNECTION_ERRORS:
+                return False
+            return self.events is None or self.events.worker.is_alive()
+
+    def reconnect(self):
+        with self._lock:
+            was_recording = self.is_recording
+            self._close()
+            self.connect()
+            if self.is_connected:
+                self.reconnects += 1
+                logging.info("Reconnected to OBS.")
+                if was_recording and not self.is_recording:
+                    logging.error("OBS stopped recording while the connection was down.")
+                    self._record_stopped.set()
+
+    def _request(self, name, *args):
+        """Sends a request, reconnecting and retrying once if the connection dropped."""
+        with self._lock:
+            if not self.is_connected:
+                self.connect()
+                if not self.is_connected:
+                    raise ConnectionError("Not connected to OBS.")
+            try:
+                return getattr(self.ws, name)(*args)
+            except CONNECTION_ERRORS as e:
+                logging.warning(f"OBS request {name} failed ({e}). Reconnecting and retrying...")
+                self.reconnect()
+                if not self.is_connected:
+                    raise
+                return getattr(self.ws, name)(*args)
+
+    def on_record_state_changed(self, data):
+        """Event callback. The name must match the OBS event (RecordStateChanged)."""
+        logging.info(f"OBS recording state: {data.output_state}")
+        if data.output_state == RECORD_STARTED:
+            self.is_recording = True
+        elif data.output_state == RECORD_STOPPED:
+            self.is_recording = False
+            # obs-websocket 5.1+ sends the path of the finished file with the stopped event.
+            self.output_path = getattr(data, 'output_path', None) or self.output_path
+            self._record_stopped.set()
 
     def start_recording(self):
         """Sends the command to OBS to start recording."""
-        if not self.is_connected:
-            logging.error("Cannot start recording, not connected to OBS.")
+        if self.is_recording:
+            logging.warning("OBS is already recording.")
             return
         try:
-            # Check if already recording
-            status = self.ws.get_record_status()
-            if not status.output_active:
-                self.ws.start_record()
-                self.is_recording = True
-                logging.info("OBS recording started.")
-            else:
-                logging.warning("OBS is already recording.")
-                self.is_recording = True # Assume we are controlling this recording
+            self._record_stopped.clear()
+            self.output_path = None
+            self._request('start_record')
+            self.is_recording = True
+            logging.info("OBS recording started.")
         except Exception as e:
             logging.error(f"Failed to start OBS recording: {e}")
             self.is_recording = False
 
-    def stop_recording(self):
-        """Sends the command to OBS to stop recording."""
-        if not self.is_connected:
-            logging.error("Cannot stop recording, not connected to OBS.")
-            return
+    def stop_recording(self, timeout=60):
+        """
+        Sends the command to OBS to stop recording and waits until the file is finalized.
+
+        Args:
+            timeout (float): Maximum seconds to wait for OBS to finish writing the file.
+
+        Returns:
+            str: The path of the recording, or None if OBS did not report it.
+        """
+        if not self.is_recording:
+            logging.warning("OBS was not recording.")
+            return self.output_path
         try:
-            # Check if we think we are recording
-            status = self.ws.get_record_status()
-            if status.output_active:
-                self.ws.stop_record()
-                self.is_recording = False
-                logging.info("OBS recording stopped.")
-            else:
-                logging.warning("OBS was not recording.")
-                self.is_recording = False
+            response = self._request('stop_record')
+            self.output_path = getattr(response, 'output_path', None) or self.output_path
+            logging.info("OBS recording stopped.")
         except Exception as e:
             logging.error(f"Failed to stop OBS recording: {e}")
+            return None
+
+        if self.events is None:
+            self.is_recording = False
+            logging.info("Waiting 10 seconds for OBS to save the video file...")
+            time.sleep(10)
+        elif not self._record_stopped.wait(timeout):
+            logging.warning(f"OBS did not report the recording as stopped within {timeout} seconds.")
+            self.is_recording = False
+        else:
+            logging.info(f"OBS finished writing {self.output_path}")
+        return self.output_path
+
+    def record_stats(self):
+        """Returns the size of the current recording and OBS's frame counters."""
+        status = self._request('get_record_status')
+        stats = self._request('get_stats')
+        return {
+            "active": status.output_active,
+            "output_bytes": status.output_bytes,
+            "total_frames": stats.render_total_frames,
+            # Frames lost to rendering lag plus frames the encoder could not keep up with.
+            "skipped_frames": stats.render_skipped_frames + stats.output_skipped_frames
+        }
+
+    def _close(self):
+        if self.ws:
+            try:
+                self.ws.base_client.ws.close()
+            except Exception:
+                pass
+        if self.events:
+            try:
+                self.events.disconnect()
+            except Exception:
+                pass
+            self.events = None
+        self.is_connected = False
 
     def disconnect(self):
         """Disconnects from the OBS WebSocket server."""
-        if self.is_connected and self.ws:
-            self.ws.base_client.ws.close()
-            self.is_connected = False
-            logging.info("Disconnected from OBS.")
+        with self._lock:
+            if self.is_connected and self.ws:
+                self._close()
+                logging.info("Disconnected from OBS.")
+
+    def stats(self):
+        return {
+            "connected": self.is_connected,
+            "recording": self.is_recording,
+            "reconnects": self.reconnects
+        }
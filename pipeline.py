@@ -0,0 +1,252 @@
+import logging
+import queue
+import threading
+import time
+
+import metrics
+
+# This module runs jobs through a chain of stages, each with its own queue and worker pool.
+# A job is a plain dict that is handed from one stage to the next. Stage handlers
+# store their results on the job and raise an exception to fail it.
+# Each finished stage leaves a checkpoint on the job (job['checkpoints']), so a retried job
+# skips the stages whose results are still usable and resumes at the one that failed:
+# the first stage hands it straight to that stage's queue.
+# The time each stage's handler took is kept in job['timings'] (used for queue ETAs).
+
+# Errors that will not go away by trying again (e.g. an invalid share code).
+PERMANENT_ERRORS = (ValueError,)
+
+class Stage:
+    def __init__(self, name, handler, workers=1, queue_size=0, input_queue=None, group_key=None,
+                 produces=(), checkpoint_valid=None, retries=0, retry_backoff=30, max_retry_backoff=900):
+        """
+        Args:
+            name (str): Short stage name, e.g. 'download'. Stored on the job while it is in this stage.
+            handler (callable): Called with the job dict. Raises to fail the job.
+            workers (int): Number of threads processing this stage in parallel.
+            queue_size (int): Maximum number of jobs waiting for this stage (0 = unbounded).
+                A full queue blocks the previous stage, which bounds how far ahead it can run.
+            input_queue (queue.Queue): Use an existing queue instead of creating one.
+            group_key (callable): Returns a grouping key for a job (e.g. its demo). When a worker
+                takes a job, waiting jobs with the same key are moved to the front of the queue,
+                so they are processed back to back.
+            produces (tuple): Job keys this stage fills in (e.g. 'demo_path'), saved in its checkpoint.
+            checkpoint_valid (callable): Called with a job that has this stage's checkpoint. Returns
+                False if the stage's results are gone (e.g. the file was deleted) and it must run again.
+            retries (int): How many times a job that failed in this stage is retried automatically.
+            retry_backoff (float): Delay before the first retry in seconds; doubles with each retry.
+            max_retry_backoff (float): Upper limit of the retry delay.
+        """
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.queue = input_queue if input_queue is not None else queue.Queue(maxsize=queue_size)
+        self.group_key = group_key
+        self.produces = produces
+        self.checkpoint_valid = checkpoint_valid
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.max_retry_backoff = max_retry_backoff
+        self.active_jobs = []
+        self.next_stage = None
+        self.pipeline = None
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"{self.name.capitalize()}Worker-{i + 1}")
+            thread.daemon = True
+            thread.start()
+        logging.info(f"Started {self.workers} worker(s) for the '{self.name}' stage.")
+
+    def _pull_group_forward(self, job):
+        key = self.group_key(job)
+        # Persistent queues (job_queue.JobQueue) do their own grouping.
+        if key is None or not isinstance(self.queue, queue.Queue):
+            return
+        with self.queue.mutex:
+            waiting = self.queue.queue
+            same = [other for other in waiting if self.group_key(other) == key]
+            if not same or list(waiting)[:len(same)] == same:
+                return
+            for other in same:
+                waiting.remove(other)
+            waiting.extendleft(reversed(same))
+        logging.info(f"Moved {len(same)} more job(s) for the same demo to the front of the '{self.name}' queue.")
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            if self.group_key:
+                self._pull_group_forward(job)
+            if self is self.pipeline.stages[0]:
+                self.pipeline.enter(job)
+            job['stage'] = self.name
+            self.pipeline.track(job)
+            self.active_jobs.append(job)
+            next_stage = self.next_stage
+            retry_delay = None
+            try:
+                if job.get('resume_from', self.name) != self.name:
+                    # Not queued behind the stages in between (e.g. a job retried at upload
+                    # does not wait for the recorder).
+                    next_stage = self.pipeline.stage(job.pop('resume_from'))
+                else:
+                    job.pop('resume_from', None)
+                    started = job['stage_started_at'] = time.time()
+                    try:
+                        self.handler(job)
+                    finally:
+                        job.pop('stage_started_at', None)
+                    job.setdefault('timings', {})[self.name] = round(time.time() - started, 2)
+                    metrics.stage_seconds.observe(time.time() - started, stage=self.name)
+                    metrics.stage_successes.inc(stage=self.name)
+                    self.record_checkpoint(job)
+            except Exception as e:
+                logging.error(f"The '{self.name}' stage failed for {job.get('suspect_steam_id')}: {e}")
+                metrics.stage_failures.inc(stage=self.name, error_type=type(e).__name__)
+                job['error'] = str(e)
+                job['failed_stage'] = self.name
+                if not isinstance(e, PERMANENT_ERRORS):
+                    retry_delay = self.retry_delay(job)
+
+            try:
+                if retry_delay is not None and self.pipeline.retry_later(job, retry_delay):
+                    pass  # Back in the job store; a worker picks it up again after the delay.
+                elif job.get('error') or next_stage is None:
+                    self.pipeline.finish(job)
+                else:
+                    job['step'] = f"Waiting for {next_stage.name}..."
+                    # Blocks while the next stage's queue is full.
+                    next_stage.queue.put(job)
+            finally:
+                self.active_jobs.remove(job)
+                self.queue.task_done()
+
+    def record_checkpoint(self, job):
+        job.setdefault('checkpoints', {})[self.name] = {
+            "finished_at": time.time(),
+            "outputs": {key: job.get(key) for key in self.produces}
+        }
+
+    def has_valid_checkpoint(self, job):
+        if self.name not in job.get('checkpoints', {}):
+            return False
+        return self.checkpoint_valid is None or self.checkpoint_valid(job)
+
+    def retry_delay(self, job):
+        """Returns the delay before the next automatic retry, or None if the retries are used up."""
+        attempts = job.setdefault('retries', {})
+        done = attempts.get(self.name, 0)
+        if done >= self.retries:
+            return None
+        attempts[self.name] = done + 1
+        return min(self.max_retry_backoff, self.retry_backoff * 2 ** done)
+
+class Pipeline:
+    def __init__(self, stages, on_job_finished, tracked_jobs=None, job_store=None, on_job_entered=None, on_job_left=None):
+        """
+        Args:
+            stages (list): The stages in processing order. Each job visits them all unless it fails.
+            on_job_finished (callable): Called with the job once it leaves the pipeline,
+                whether it succeeded or failed.
+            tracked_jobs (list): Optional list kept up to date with every job currently in the
+                pipeline, in the order they entered it.
+            job_store (job_queue.JobQueue): Optional persistent store that records each job's
+                stage transitions and final state. Failed jobs are retried through it.
+            on_job_entered (callable): Called with the job when the first stage takes it, once it is
+                known where the job resumes (e.g. to hold resources a skipped stage would have taken).
+            on_job_left (callable): Called with the job whenever it leaves the pipeline, including
+                when it is handed back for a retry (e.g. to release resources it holds).
+        """
+        self.stages = stages
+        self.on_job_finished = on_job_finished
+        self.tracked_jobs = tracked_jobs if tracked_jobs is not None else []
+        self.job_store = job_store
+        self.on_job_entered = on_job_entered
+        self.on_job_left = on_job_left
+        self._lock = threading.Lock()
+        for stage, next_stage in zip(stages, stages[1:] + [None]):
+            stage.pipeline = self
+            stage.next_stage = next_stage
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    def track(self, job):
+        with self._lock:
+            if not any(tracked is job for tracked in self.tracked_jobs):
+                self.tracked_jobs.append(job)
+        if self.job_store:
+            try:
+                self.job_store.transition(job, job['stage'])
+            except Exception as e:
+                logging.error(f"Failed to persist the state of job {job.get('job_id')}: {e}")
+
+    def enter(self, job):
+        """Called when the first stage takes a job."""
+        self.plan_resume(job)
+        if self.on_job_entered:
+            try:
+                self.on_job_entered(job)
+            except Exception as e:
+                logging.error(f"Failed to prepare job for {job.get('suspect_steam_id')}: {e}")
+
+    def stage(self, name):
+        """Returns the stage with this name, or None."""
+        return next((stage for stage in self.stages if stage.name == name), None)
+
+    def plan_resume(self, job):
+        """
+        Decides where a job that has checkpoints resumes: right after the last stage whose
+        results are still valid (job['resume_from'], None if every stage is done). Earlier
+        stages are skipped, since their results were used up.
+        """
+        job.pop('resume_from', None)
+        for index in range(len(self.stages) - 1, -1, -1):
+            if self.stages[index].has_valid_checkpoint(job):
+                if index + 1 < len(self.stages):
+                    job['resume_from'] = self.stages[index + 1].name
+                    logging.info(f"Resuming job for {job.get('suspect_steam_id')} at the '{job['resume_from']}' stage.")
+                else:
+                    job['resume_from'] = None  # Everything is done; only finish the job.
+                return
+
+    def retry_later(self, job, delay):
+        """
+        Hands a failed job back to the job store, to be retried after `delay` seconds.
+
+        Returns:
+            bool: False if there is no job store to retry through, or it did not take the job
+                back (the job is then finished as failed).
+        """
+        if not self.job_store:
+            return False
+        logging.warning(f"Retrying job for {job.get('suspect_steam_id')} in {delay:.0f} seconds "
+                        f"(attempt {job['retries'][job['failed_stage']]} for the '{job['failed_stage']}' stage).")
+        try:
+            if self.on_job_left:
+                self.on_job_left(job)
+            if not self.job_store.schedule_retry(job, delay):
+                logging.error(f"The job store did not take back job {job.get('job_id')} for a retry.")
+                return False
+        except Exception as e:
+            logging.error(f"Failed to schedule a retry for {job.get('suspect_steam_id')}: {e}")
+            return False
+        # Only untracked once the job store has it, so its lease is kept alive until then.
+        with self._lock:
+            self.tracked_jobs[:] = [tracked for tracked in self.tracked_jobs if tracked is not job]
+        return True
+
+    def finish(self, job):
+        try:
+            if self.on_job_left:
+                self.on_job_left(job)
+            self.on_job_finished(job)
+            if self.job_store:
+                self.job_store.complete(job)
+        except Exception as e:
+            logging.error(f"Failed to finalize job for {job.get('suspect_steam_id')}: {e}")
+        finally:
+            with self._lock:
+                self.tracked_jobs[:] = [tracked for tracked in self.tracked_jobs if tracked is not job]
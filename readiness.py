@@ -0,0 +1,123 @@
+import logging
+import os
+import re
+import time
+
+import psutil
+
+# This module decides when CS2 has actually started playing the highlights, so OBS
+# starts recording then instead of after a fixed delay. Each probe looks at one signal;
+# wait_until_ready polls them all and the first one that reports ready wins.
+
+DEFAULT_READY_PATTERN = r'(?i)playing demo|demo playback'
+
+class ConsoleLogProbe:
+    """Ready when the game console log (CS2 started with -condebug) prints a line matching the pattern."""
+    name = 'console'
+
+    def __init__(self, log_path, pattern=DEFAULT_READY_PATTERN):
+        self.log_path = log_path
+        self.pattern = re.compile(pattern)
+        # Only lines written after the launch count; the log may be left over from the last session.
+        self.offset = os.path.getsize(log_path) if os.path.exists(log_path) else 0
+        self._partial = ''
+
+    def check(self):
+        try:
+            size = os.path.getsize(self.log_path)
+        except OSError:
+            return False
+        if size < self.offset:
+            # The game truncated or recreated the log on start-up.
+            self.offset = 0
+            self._partial = ''
+        if size == self.offset:
+            return False
+        with open(self.log_path, 'r', encoding='utf-8', errors='replace') as f:
+            f.seek(self.offset)
+            text = self._partial + f.read()
+            self.offset = f.tell()
+        lines = text.split('\n')
+        self._partial = lines.pop()
+        return any(self.pattern.search(line) for line in lines)
+
+class ProcessProbe:
+    """
+    Ready when the game process has been running for `min_seconds` and, if a threshold is
+    set, is using at least `cpu_percent` CPU (the map is loaded and the demo is playing).
+    """
+    name = 'process'
+
+    def __init__(self, tracker, min_seconds=20, cpu_percent=None):
+        self.tracker = tracker
+        self.min_seconds = min_seconds
+        self.cpu_percent = cpu_percent
+        self._primed = False
+
+    def check(self):
+        process = self.tracker.process
+        if process is None or self.tracker.found_at is None:
+            return False
+        if time.time() - self.tracker.found_at < self.min_seconds:
+            return False
+        if self.cpu_percent is None:
+            return True
+        try:
+            usage = process.cpu_percent(None)
+        except psutil.NoSuchProcess:
+            return False
+        if not self._primed:
+            # The first cpu_percent(None) call only starts the measurement.
+            self._primed = True
+            return False
+        return usage >= self.cpu_percent
+
+def build_probes(names, tracker, console_log_path='', ready_pattern=DEFAULT_READY_PATTERN,
+                 process_ready_seconds=20, process_cpu_percent=None):
+    """
+    Creates the probes listed in `names` (e.g. ['console', 'process']).
+    The console probe is skipped when no log path is configured.
+    """
+    probes = []
+    for name in names:
+        if name == 'console':
+            if console_log_path:
+                probes.append(ConsoleLogProbe(console_log_path, ready_pattern))
+            else:
+                logging.warning("The 'console' readiness probe needs cs2_console_log to be set. Skipping it.")
+        elif name == 'process':
+            probes.append(ProcessProbe(tracker, process_ready_seconds, process_cpu_percent))
+        else:
+            logging.warning(f"Unknown readiness probe '{name}'. Skipping it.")
+    return probes
+
+def wait_until_ready(probes, timeout=60, poll_interval=0.25, stop_event=None, tracker=None):
+    """
+    Polls the probes until one reports that playback has started.
+
+    Args:
+        probes (list): Probes with a name and a check() method.
+        timeout (float): Maximum seconds to wait.
+        poll_interval (float): Seconds between polls.
+        stop_event (threading.Event): Aborts the wait when set.
+        tracker (GameProcessTracker): The game being waited for.
+
+    Returns:
+        str: The name of the probe that fired, or None on timeout or abort.
+             Raises RuntimeError if the tracked game exits before any probe fires.
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if tracker is not None and not tracker.is_running():
+            # Recording now would only capture an empty screen.
+            raise RuntimeError("CS2 exited before the highlights started playing.")
+        for probe in probes:
+            try:
+                if probe.check():
+                    return probe.name
+            except Exception as e:
+                logging.warning(f"Readiness probe '{probe.name}' failed: {e}")
+        if stop_event is not None and stop_event.is_set():
+            return None
+        time.sleep(poll_interval)
+    return None
@@ -0,0 +1,78 @@
+import logging
+import threading
+import time
+
+# This module watches a recording while it runs. It samples OBS's record status and
+# stats, and aborts the session early when the recording file stops growing, when too
+# many frames are being dropped, or when OBS stops recording on its own. Without it a
+# frozen encoder only ends when the 30-minute highlights timeout fires.
+
+class RecordingWatchdog:
+    def __init__(self, obs, stop_event, interval=5, stall_seconds=30, max_drop_rate=0.25, min_frames=60):
+        """
+        Args:
+            obs (OBSRecorder): The shared OBS connection.
+            stop_event (threading.Event): Set to abort the session (the highlights wait watches it).
+            interval (float): Seconds between samples.
+            stall_seconds (float): Abort when the output has not grown for this long.
+            max_drop_rate (float): Abort when this share of frames in a sample window was skipped.
+            min_frames (int): Minimum frames in a window before the drop rate is judged.
+        """
+        self.obs = obs
+        self.stop_event = stop_event
+        self.interval = interval
+        self.stall_seconds = stall_seconds
+        self.max_drop_rate = max_drop_rate
+        self.min_frames = min_frames
+        self.abort_reason = None
+        self.samples = 0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="RecordingWatchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval + 5)
+
+    def _abort(self, reason):
+        self.abort_reason = reason
+        logging.error(f"Recording watchdog: {reason}. Aborting the recording.")
+        self.stop_event.set()
+
+    def _run(self):
+        last_bytes = None
+        last_growth = time.time()
+        last_frames = None
+        while not self._stopped.wait(self.interval):
+            try:
+                sample = self.obs.record_stats()
+            except Exception as e:
+                # The connection is handled by the OBS heartbeat; just skip this sample.
+                logging.warning(f"Recording watchdog could not sample OBS: {e}")
+                continue
+            self.samples += 1
+            now = time.time()
+
+            if not sample['active']:
+                self._abort("OBS stopped recording unexpectedly")
+                return
+
+            if last_bytes is None or sample['output_bytes'] > last_bytes:
+                last_bytes = sample['output_bytes']
+                last_growth = now
+            elif now - last_growth >= self.stall_seconds:
+                self._abort(f"the recording has not grown for {now - last_growth:.0f} seconds")
+                return
+
+            frames = (sample['total_frames'], sample['skipped_frames'])
+            if last_frames is not None:
+                total = frames[0] - last_frames[0]
+                skipped = frames[1] - last_frames[1]
+                if total >= self.min_frames and skipped / total > self.max_drop_rate:
+                    self._abort(f"{skipped} of {total} frames were dropped in the last {self.interval:g} seconds")
+                    return
+            last_frames = frames
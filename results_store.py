@@ -0,0 +1,126 @@
+import json
+import logging
+import os
+import time
+
+import db
+
+# This module keeps the results of finished jobs. Every result is appended to an SQLite
+# table with indexes on the fields reviewers search by (suspect, submitter, share code,
+# status), so the full history is kept and queried a page at a time instead of a JSON
+# file of the last 50 results being rewritten after every job.
+
+RESULTS_DB = 'results.db'
+
+# Query parameter -> indexed column.
+FILTERS = ('suspect_steam_id', 'submitted_by', 'share_code', 'task_status')
+
+class ResultStore:
+    def __init__(self, path=RESULTS_DB):
+        self.path = path
+        with db.connect(self.path) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " job_id INTEGER,"
+                " suspect_steam_id TEXT,"
+                " submitted_by TEXT,"
+                " share_code TEXT,"
+                " task_status TEXT,"
+                " finished_at REAL,"
+                " data TEXT NOT NULL)"
+            )
+            # Each index ends with id, so a filtered page is read in order straight from the index.
+            for column in FILTERS:
+                conn.execute(f"CREATE INDEX IF NOT EXISTS results_{column} ON results ({column}, id)")
+
+    def add(self, entry):
+        """
+        Appends a result. Stores its ID and time in entry['result_id'] and entry['finished_at'].
+
+        Returns:
+            int: The result ID.
+        """
+        entry.setdefault('finished_at', time.time())
+        with db.connect(self.path) as conn:
+            cursor = conn.execute(
+                "INSERT INTO results (job_id, suspect_steam_id, submitted_by, share_code, task_status, finished_at, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (entry.get('job_id'), *(entry.get(column) for column in FILTERS), entry['finished_at'],
+                 json.dumps(entry, default=str))
+            )
+        entry['result_id'] = cursor.lastrowid
+        return entry['result_id']
+
+    def _where(self, filters, before=None):
+        clauses, params = [], []
+        for column in FILTERS:
+            if filters.get(column):
+                clauses.append(f"{column} = ?")
+                params.append(filters[column])
+        if before is not None:
+            clauses.append("id < ?")
+            params.append(before)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def query(self, before=None, limit=50, **filters):
+        """
+        Returns a page of results, newest first, matching the given field values exactly.
+
+        Args:
+            before (int): Only results older than this result ID (the previous page's `next_before`).
+            limit (int): Page size.
+            **filters: Values for any of suspect_steam_id, submitted_by, share_code, task_status.
+
+        Returns:
+            tuple: (results, next_before). next_before is None on the last page.
+        """
+        where, params = self._where(filters, before)
+        with db.connect(self.path) as conn:
+            rows = conn.execute(
+                f"SELECT id, data FROM results{where} ORDER BY id DESC LIMIT ?", params + [limit + 1]
+            ).fetchall()
+        results = [self._decode(row) for row in rows[:limit]]
+        next_before = results[-1]['result_id'] if len(rows) > limit else None
+        return results, next_before
+
+    def count(self, **filters):
+        where, params = self._where(filters)
+        with db.connect(self.path) as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM results{where}", params).fetchone()[0]
+
+    def recent(self, limit=50):
+        """Returns the latest results, oldest first (the order the dashboard adds them in)."""
+        results, _ = self.query(limit=limit)
+        return results[::-1]
+
+    @staticmethod
+    def _decode(row):
+        entry = json.loads(row['data'])
+        entry['result_id'] = row['id']
+        return entry
+
+    def import_json(self, json_path):
+        """
+        Moves the results of a results.json file (kept by earlier versions) into the store once.
+        The file is renamed afterwards so it is not imported again.
+
+        Returns:
+            int: The number of results imported.
+        """
+        if not os.path.exists(json_path):
+            return 0
+        try:
+            with open(json_path, 'r') as f:
+                content = f.read()
+            entries = json.loads(content) if content else []
+        except (OSError, ValueError) as e:
+            logging.error(f"Could not import results from {json_path}: {e}")
+            return 0
+        for entry in entries:
+            # The old file has no timestamps; keep them unknown rather than pretending they are new.
+            entry.setdefault('finished_at', None)
+            self.add(entry)
+        os.replace(json_path, json_path + '.imported')
+        logging.info(f"Imported {len(entries)} results from {json_path} into {self.path}.")
+        return len(entries)
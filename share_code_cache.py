@@ -0,0 +1,126 @@
+import logging
+import threading
+import time
+
+import db
+
+# This module caches share code -> demo download URL lookups on disk, so resubmitting
+# a match skips the round-trip to the share code decode APIs.
+
+CACHE_DB = 'share_code_cache.db'
+
+class ShareCodeCache:
+    def __init__(self, path=CACHE_DB, ttl_hours=24 * 7, max_entries=5000):
+        """
+        Args:
+            path (str): SQLite database file.
+            ttl_hours (float): How long a resolved URL is trusted. Valve removes old replays,
+                so entries should not outlive the demo on the replay server.
+            max_entries (int): Least recently used entries beyond this are removed.
+        """
+        self.path = path
+        self.ttl_hours = ttl_hours
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _ensure_schema(self, conn):
+        if self._initialized:
+            return
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS share_codes ("
+            " share_code TEXT PRIMARY KEY,"
+            " download_url TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_share_codes_last_used ON share_codes (last_used)")
+        self._initialized = True
+
+    def get(self, share_code):
+        """Returns the cached download URL for a share code, or None if unknown or expired."""
+        now = time.time()
+        try:
+            with db.connect(self.path) as conn:
+                self._ensure_schema(conn)
+                row = conn.execute(
+                    "SELECT download_url FROM share_codes WHERE share_code = ? AND created_at >= ?",
+                    (share_code, now - self.ttl_hours * 3600)
+                ).fetchone()
+                if row:
+                    conn.execute("UPDATE share_codes SET last_used = ? WHERE share_code = ?", (now, share_code))
+        except Exception as e:
+            logging.error(f"Share code cache lookup failed: {e}")
+            row = None
+
+        with self._lock:
+            if row:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return row['download_url'] if row else None
+
+    def peek(self, share_code):
+        """Like get(), but does not count as a lookup or refresh the entry's last use."""
+        try:
+            with db.connect(self.path) as conn:
+                self._ensure_schema(conn)
+                row = conn.execute(
+                    "SELECT download_url FROM share_codes WHERE share_code = ? AND created_at >= ?",
+                    (share_code, time.time() - self.ttl_hours * 3600)
+                ).fetchone()
+        except Exception as e:
+            logging.error(f"Share code cache lookup failed: {e}")
+            return None
+        return row['download_url'] if row else None
+
+    def put(self, share_code, download_url):
+        """Stores a resolved download URL and trims expired and excess entries."""
+        now = time.time()
+        try:
+            with db.connect(self.path) as conn:
+                self._ensure_schema(conn)
+                conn.execute(
+                    "INSERT OR REPLACE INTO share_codes (share_code, download_url, created_at, last_used) VALUES (?, ?, ?, ?)",
+                    (share_code, download_url, now, now)
+                )
+                conn.execute("DELETE FROM share_codes WHERE created_at < ?", (now - self.ttl_hours * 3600,))
+                conn.execute(
+                    "DELETE FROM share_codes WHERE share_code NOT IN "
+                    "(SELECT share_code FROM share_codes ORDER BY last_used DESC LIMIT ?)",
+                    (self.max_entries,)
+                )
+        except Exception as e:
+            logging.error(f"Failed to store share code in cache: {e}")
+
+    def invalidate(self, share_code):
+        """Removes a share code, e.g. because its download URL no longer works."""
+        try:
+            with db.connect(self.path) as conn:
+                self._ensure_schema(conn)
+                conn.execute("DELETE FROM share_codes WHERE share_code = ?", (share_code,))
+        except Exception as e:
+            logging.error(f"Failed to remove share code from cache: {e}")
+
+    def stats(self):
+        """Returns hit/miss counters since start-up and the number of stored entries."""
+        try:
+            with db.connect(self.path) as conn:
+                self._ensure_schema(conn)
+                entries = conn.execute("SELECT COUNT(*) FROM share_codes").fetchone()[0]
+        except Exception as e:
+            logging.error(f"Failed to read share code cache size: {e}")
+            entries = None
+
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "entries": entries,
+                "ttl_hours": self.ttl_hours,
+                "max_entries": self.max_entries
+            }
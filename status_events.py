@@ -0,0 +1,82 @@
+import json
+import threading
+import time
+import uuid
+from collections import deque
+
+# This module pushes dashboard updates to the browser with Server-Sent Events, so open
+# tabs no longer have to poll /status. Every change (status, job enqueued, job moved to
+# another stage, job finished) is published once as a numbered, pre-serialized event;
+# each connected client reads the events after the last one it saw. The event number is
+# also the version of the /status data, which makes it the base of that route's ETag.
+
+class EventBus:
+    def __init__(self, history=500):
+        """
+        Args:
+            history (int): Number of recent events kept, so a client that reconnects
+                (sending Last-Event-ID) gets what it missed instead of reloading everything.
+        """
+        # Distinguishes event numbers of this run from those of a previous one.
+        self.run_id = uuid.uuid4().hex[:8]
+        self.last_id = 0
+        self._events = deque(maxlen=history)
+        self._changed = threading.Condition()
+
+    @property
+    def version(self):
+        return f"{self.run_id}-{self.last_id}"
+
+    def publish(self, event, data):
+        """Sends an event with JSON data to every connected client."""
+        payload = json.dumps(data, default=str)
+        with self._changed:
+            self.last_id += 1
+            self._events.append((self.last_id, event, payload))
+            self._changed.notify_all()
+
+    def read(self, after, timeout=15):
+        """
+        Waits up to `timeout` seconds for events newer than `after`.
+
+        Returns:
+            list: (id, event, payload) tuples; empty on timeout. None if events after `after`
+                are no longer in the history (the client must reload the full status).
+        """
+        deadline = time.time() + timeout
+        with self._changed:
+            while self.last_id <= after:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return []
+                self._changed.wait(remaining)
+            if not self._events or self._events[0][0] > after + 1:
+                return None
+            return [event for event in self._events if event[0] > after]
+
+    def parse_event_id(self, event_id):
+        """Returns the event number of a Last-Event-ID header, or None if it is from another run."""
+        run_id, _, number = (event_id or '').partition('-')
+        if run_id != self.run_id or not number.isdigit():
+            return None
+        return int(number)
+
+    def stream(self, after=None, keepalive=15):
+        """
+        Yields the text/event-stream of events after event number `after` (None: from now on).
+        A comment line is sent every `keepalive` seconds so proxies keep the connection open.
+        """
+        if after is None:
+            after = self.last_id
+            yield f"id: {self.run_id}-{after}\nevent: hello\ndata: {{}}\n\n"
+        while True:
+            events = self.read(after, timeout=keepalive)
+            if events is None:
+                after = self.last_id
+                yield f"id: {self.run_id}-{after}\nevent: reset\ndata: {{}}\n\n"
+            elif not events:
+                yield ": keepalive\n\n"
+            else:
+                for event_id, event, payload in events:
+                    yield f"id: {self.run_id}-{event_id}\nevent: {event}\ndata: {payload}\n\n"
+                after = events[-1][0]
@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# The modules live at the top level of the repository, and several of them create their
+# SQLite files (job queue, results, caches) in the working directory when imported.
+# Tests import them from here and run in a scratch directory, so no state is left behind.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(tempfile.mkdtemp(prefix='demo2video-tests-'))
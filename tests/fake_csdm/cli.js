@@ -0,0 +1,36 @@
+// Stand-in for CSDM's out/cli.js, run by csdm_worker.js in the tests.
+//
+//   analyze <demo>   prints a line and exits with 1 if the demo name contains "corrupt", else 0.
+//                    A demo name containing "crash" kills the worker process.
+//   return <code>    finishes some async work, sets process.exitCode and returns without exiting
+//   throw            throws an error
+//   hang             never finishes
+
+const fs = require('fs');
+
+const [command, ...args] = process.argv.slice(2);
+
+switch (command) {
+    case 'analyze':
+        console.log(`Analyzing ${args[0]}`);
+        if (args[0].includes('crash')) {
+            process.kill(process.pid, 'SIGKILL');
+        }
+        setTimeout(() => process.exit(args[0].includes('corrupt') ? 1 : 0), 50);
+        break;
+    case 'return':
+        fs.readFile(__filename, () => {
+            setTimeout(() => {
+                process.exitCode = Number(args[0] || 0);
+            }, 100);
+        });
+        break;
+    case 'throw':
+        throw new Error('The fake CLI failed.');
+    case 'hang':
+        setInterval(() => {}, 1000);
+        break;
+    default:
+        console.error(`Unknown command: ${command}`);
+        process.exit(2);
+}
@@ -0,0 +1,200 @@
+import base64
+import hashlib
+import json
+import socket
+import struct
+import threading
+import time
+
+# A local stand-in for the obs-websocket (v5) server, for testing obs_recorder.py and the
+# recording watchdog without OBS. It speaks just enough of the WebSocket protocol and of
+# obs-websocket's Hello/Identify handshake, answers the requests the recorder sends, and
+# emits RecordStateChanged events to clients that subscribed to output events. Tests
+# steer it through its attributes, e.g. to delay or drop the stopped event, freeze the
+# recording's size or drop every client connection.
+
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+OUTPUT_EVENTS = 1 << 6
+
+class OBSStub:
+    def __init__(self):
+        self.recording = False
+        self.output_path = '/videos/recording.mp4'
+        # Seconds between the StopRecord answer and the OUTPUT_STOPPED event (None: never sent).
+        self.stop_event_delay = 0.2
+        self.path_in_stop_response = True
+        self.path_in_stop_event = True
+        self.stalled = False            # The recording stops growing
+        self.drop_rate = 0.0            # Share of frames reported as skipped
+        self.requests = []              # Request types in the order they arrived
+        self.connections = 0
+        self._output_bytes = 0
+        self._frames = 0
+        self._skipped = 0
+        self._clients = []              # (socket, event subscriptions)
+        self._lock = threading.Lock()
+        self._server = socket.create_server(('127.0.0.1', 0))
+        self.port = self._server.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self):
+        self._server.close()
+        self.drop_connections()
+
+    def drop_connections(self):
+        """Closes every client connection, as if OBS restarted."""
+        with self._lock:
+            clients, self._clients = self._clients, []
+        for sock, _ in clients:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+
+    # --- WebSocket framing ---
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self._server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(sock,), daemon=True).start()
+
+    @staticmethod
+    def _recv_exactly(sock, size):
+        data = b''
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("Client disconnected.")
+            data += chunk
+        return data
+
+    def _handshake(self, sock):
+        request = b''
+        while b'\r\n\r\n' not in request:
+            chunk = sock.recv(4096)
+            if not chunk:
+                raise ConnectionError("Client disconnected.")
+            request += chunk
+        headers = dict(line.split(': ', 1) for line in request.decode().split('\r\n')[1:] if ': ' in line)
+        key = headers.get('Sec-WebSocket-Key') or headers.get('sec-websocket-key')
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode()).digest()).decode()
+        sock.sendall(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+
+    def _read_message(self, sock):
+        while True:
+            first, second = self._recv_exactly(sock, 2)
+            opcode = first & 0x0F
+            length = second & 0x7F
+            if length == 126:
+                length = struct.unpack('!H', self._recv_exactly(sock, 2))[0]
+            elif length == 127:
+                length = struct.unpack('!Q', self._recv_exactly(sock, 8))[0]
+            mask = self._recv_exactly(sock, 4) if second & 0x80 else b'\0\0\0\0'
+            payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(self._recv_exactly(sock, length)))
+            if opcode == 0x8:
+                raise ConnectionError("Client closed the connection.")
+            if opcode == 0x9:
+                self._send_frame(sock, 0xA, payload)
+            elif opcode == 0x1:
+                return json.loads(payload)
+
+    @staticmethod
+    def _send_frame(sock, opcode, payload):
+        header = bytes([0x80 | opcode])
+        if len(payload) < 126:
+            header += bytes([len(payload)])
+        elif len(payload) < 1 << 16:
+            header += bytes([126]) + struct.pack('!H', len(payload))
+        else:
+            header += bytes([127]) + struct.pack('!Q', len(payload))
+        sock.sendall(header + payload)
+
+    def _send(self, sock, op, data):
+        self._send_frame(sock, 0x1, json.dumps({"op": op, "d": data}).encode())
+
+    # --- obs-websocket protocol ---
+
+    def _serve(self, sock):
+        try:
+            self._handshake(sock)
+            self._send(sock, 0, {"obsWebSocketVersion": "5.1.0", "rpcVersion": 1})
+            identify = self._read_message(sock)
+            subscriptions = identify['d'].get('eventSubscriptions') or 0
+            with self._lock:
+                self._clients.append((sock, subscriptions))
+                self.connections += 1
+            self._send(sock, 2, {"negotiatedRpcVersion": 1})
+            while True:
+                message = self._read_message(sock)
+                if message['op'] == 6:
+                    self._answer(sock, message['d'])
+        except (ConnectionError, OSError, ValueError):
+            pass
+        finally:
+            with self._lock:
+                self._clients = [client for client in self._clients if client[0] is not sock]
+            sock.close()
+
+    def _answer(self, sock, request):
+        request_type = request['requestType']
+        self.requests.append(request_type)
+        result, data = True, {}
+        if request_type == 'GetVersion':
+            data = {"obsVersion": "30.0.0", "obsWebSocketVersion": "5.1.0", "rpcVersion": 1}
+        elif request_type == 'GetRecordStatus':
+            if self.recording and not self.stalled:
+                self._output_bytes += 100_000
+            data = {"outputActive": self.recording, "outputPaused": False, "outputBytes": self._output_bytes,
+                    "outputDuration": 0, "outputTimecode": "00:00:00.000"}
+        elif request_type == 'GetStats':
+            if self.recording:
+                self._frames += 100
+                self._skipped += int(100 * self.drop_rate)
+            data = {"renderTotalFrames": self._frames, "renderSkippedFrames": self._skipped,
+                    "outputTotalFrames": self._frames, "outputSkippedFrames": 0}
+        elif request_type == 'StartRecord':
+            result = not self.recording
+            if result:
+                self.recording = True
+                self._output_bytes = 0
+                self.emit_record_state('OBS_WEBSOCKET_OUTPUT_STARTED')
+        elif request_type == 'StopRecord':
+            result = self.recording
+            if result:
+                self.recording = False
+                if self.path_in_stop_response:
+                    data = {"outputPath": self.output_path}
+                if self.stop_event_delay is not None:
+                    threading.Timer(self.stop_event_delay, self.emit_record_state,
+                                    args=('OBS_WEBSOCKET_OUTPUT_STOPPED',)).start()
+        response = {"requestType": request_type, "requestId": request['requestId'],
+                    "requestStatus": {"result": result, "code": 100 if result else 501}}
+        if data:
+            response['responseData'] = data
+        self._send(sock, 7, response)
+
+    def emit_record_state(self, state):
+        """Sends a RecordStateChanged event to the clients subscribed to output events."""
+        data = {"outputActive": state == 'OBS_WEBSOCKET_OUTPUT_STARTED', "outputState": state}
+        if state == 'OBS_WEBSOCKET_OUTPUT_STOPPED' and self.path_in_stop_event:
+            data['outputPath'] = self.output_path
+        with self._lock:
+            clients = [sock for sock, subscriptions in self._clients if subscriptions & OUTPUT_EVENTS]
+        for sock in clients:
+            try:
+                self._send(sock, 5, {"eventType": "RecordStateChanged", "eventIntent": OUTPUT_EVENTS, "eventData": data})
+            except OSError:
+                pass
+
+def wait_until(condition, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return condition()
@@ -0,0 +1,195 @@
+import threading
+import time
+
+import pytest
+from werkzeug.serving import make_server
+
+import pipeline
+import web_server
+from agent_client import RemoteJobQueue
+from job_queue import JobQueue
+from results_store import ResultStore
+
+# Runs the coordinator's web server on localhost and several fake recording agents against
+# it. The agents use the real RemoteJobQueue and Pipeline; only their stages are fakes that
+# take a little time. The coordinator can be made to answer some routes with 503, as if it
+# were unreachable for those requests.
+
+# Nothing listens here; agents are pointed at it when a test ends.
+DEAD_URL = 'http://127.0.0.1:9'
+
+class Coordinator:
+    def __init__(self, tmp_path, monkeypatch, lease_seconds):
+        self.queue = JobQueue(path=str(tmp_path / 'job_queue.db'), lease_seconds=lease_seconds,
+                              dedup_key=web_server.job_dedup_key)
+        self.results = ResultStore(str(tmp_path / 'results.db'))
+        monkeypatch.setattr(web_server, 'demo_queue', self.queue)
+        monkeypatch.setattr(web_server, 'results_store', self.results)
+        monkeypatch.setattr(web_server, 'agents', {})
+        self.unavailable = set()        # Route suffixes answered with 503
+        self.queue.start_lease_keeper()
+        self._server = make_server('127.0.0.1', 0, self._app, threaded=True)
+        self.url = f"http://127.0.0.1:{self._server.server_port}"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def _app(self, environ, start_response):
+        if any(environ['PATH_INFO'].endswith(suffix) for suffix in self.unavailable):
+            start_response('503 Service Unavailable', [('Content-Type', 'text/plain')])
+            return [b'Unavailable']
+        return web_server.app(environ, start_response)
+
+    def submit(self, count):
+        return [self.queue.put({"share_code": f"https://replay.test/00{i:04d}_0001.dem.bz2",
+                                "suspect_steam_id": str(76561198000000000 + i)})
+                for i in range(count)]
+
+    def states(self):
+        return self.queue.counts()
+
+    def close(self):
+        self._server.shutdown()
+
+class FakeAgent:
+    def __init__(self, coordinator, agent_id, record_seconds=0.05, fail_first_upload=False):
+        self.agent_id = agent_id
+        self.record_seconds = record_seconds
+        self.fail_first_upload = fail_first_upload
+        self.recorded = []              # IDs of the jobs this agent recorded
+        self.recording = threading.Event()
+        self.hold_recording = threading.Event()
+        self.hold_recording.set()
+        self.jobs = []
+        self.queue = RemoteJobQueue(coordinator.url, agent_id, jobs=self.jobs, heartbeat_interval=0.2,
+                                    claim_wait=1, request_timeout=5, report_retry_interval=0.2,
+                                    max_report_retry_interval=0.5)
+        stages = [
+            pipeline.Stage('download', lambda job: None, input_queue=self.queue),
+            pipeline.Stage('record', self._record),
+            pipeline.Stage('upload', self._upload, retries=1, retry_backoff=0),
+        ]
+        self.pipeline = pipeline.Pipeline(stages, lambda job: None, tracked_jobs=self.jobs, job_store=self.queue)
+        self.queue.start_heartbeat()
+        self.pipeline.start()
+
+    def _record(self, job):
+        self.recording.set()
+        self.hold_recording.wait(30)
+        time.sleep(self.record_seconds)
+        self.recorded.append(job['job_id'])
+
+    def _upload(self, job):
+        if self.fail_first_upload and not job.get('retries'):
+            raise RuntimeError("Upload failed.")
+        job['task_status'] = "Uploaded"
+        job['youtube_link'] = f"https://youtu.be/{job['job_id']}"
+
+    def crash(self):
+        """Stops the heartbeat, as if the agent lost power mid-job."""
+        self.queue.heartbeat = lambda: []
+
+    def detach(self):
+        self.queue.heartbeat = lambda: []
+        self.queue.coordinator_url = DEAD_URL
+        self.hold_recording.set()
+
+def wait_until(condition, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return condition()
+
+@pytest.fixture
+def fleet(tmp_path, monkeypatch):
+    started = {"coordinator": None, "agents": []}
+
+    def start(lease_seconds=2, agents=1, **agent_kwargs):
+        coordinator = started['coordinator'] = started['coordinator'] or Coordinator(tmp_path, monkeypatch, lease_seconds)
+        new_agents = [FakeAgent(coordinator, f"agent-{len(started['agents']) + i + 1}", **agent_kwargs) for i in range(agents)]
+        started['agents'] += new_agents
+        return coordinator, new_agents
+
+    yield start
+    for agent in started['agents']:
+        agent.detach()
+    if started['coordinator']:
+        started['coordinator'].close()
+
+def test_agents_share_the_queue_and_record_each_job_once(fleet):
+    coordinator, agents = fleet(agents=3)
+    job_ids = coordinator.submit(12)
+
+    assert wait_until(lambda: coordinator.states() == {'done': 12})
+    recorded = [job_id for agent in agents for job_id in agent.recorded]
+    assert sorted(recorded) == sorted(job_ids)
+    assert sum(1 for agent in agents if agent.recorded) > 1
+    assert coordinator.results.count(task_status="Uploaded") == 12
+    assert sum(agent['finished'] for agent in web_server.agents.values()) == 12
+
+def test_job_of_a_crashed_agent_is_recorded_by_another(fleet):
+    coordinator, (crashed,) = fleet(lease_seconds=1)
+    crashed.hold_recording.clear()
+    (job_id,) = coordinator.submit(1)
+    assert crashed.recording.wait(10)
+    crashed.crash()
+
+    _, (other,) = fleet()
+    assert wait_until(lambda: coordinator.states() == {'done': 1})
+    assert other.recorded == [job_id]
+
+    # The crashed agent comes back and finishes; its late result is refused.
+    crashed.hold_recording.set()
+    assert wait_until(lambda: crashed.queue.lost_jobs >= 1)
+    assert coordinator.results.count() == 1
+
+def test_result_survives_a_coordinator_outage(fleet):
+    coordinator, (agent,) = fleet(lease_seconds=1)
+    coordinator.unavailable.add('/complete')
+    (job_id,) = coordinator.submit(1)
+    assert wait_until(lambda: agent.recorded == [job_id])
+    _, (idle,) = fleet()
+
+    # Several lease times pass while the result cannot be delivered. The heartbeat keeps the
+    # lease, so the job is neither re-queued nor recorded again by the idle agent.
+    time.sleep(3)
+    assert [job['agent'] for job in coordinator.queue.active()] == [agent.agent_id]
+    assert agent.jobs and idle.recorded == []
+
+    coordinator.unavailable.clear()
+    assert wait_until(lambda: coordinator.states() == {'done': 1})
+    assert coordinator.results.count() == 1
+    assert not agent.jobs and idle.recorded == []
+
+def test_retry_survives_a_coordinator_outage(fleet):
+    coordinator, (agent,) = fleet(lease_seconds=1, fail_first_upload=True)
+    coordinator.unavailable.add('/retry_later')
+    (job_id,) = coordinator.submit(1)
+    assert wait_until(lambda: agent.recorded == [job_id])
+
+    # The job stays with the agent until the coordinator takes it back; it is not given up
+    # on and left for its lease to expire.
+    time.sleep(5)
+    assert [job['agent'] for job in coordinator.queue.active()] == [agent.agent_id]
+    assert agent.jobs and web_server.agents[agent.agent_id]['claimed'] == 1
+
+    coordinator.unavailable.clear()
+    assert wait_until(lambda: coordinator.states() == {'done': 1})
+    # The retry resumed at the upload stage instead of recording again.
+    assert agent.recorded == [job_id]
+    assert web_server.agents[agent.agent_id]['claimed'] == 2
+    assert coordinator.results.count(task_status="Uploaded") == 1
+
+def test_status_etag_changes_when_an_agent_comes_online(fleet, monkeypatch):
+    # Keep the periodic ETA refresh out of the way.
+    monkeypatch.setattr(web_server, 'STATUS_ETA_REFRESH', 3600)
+    fleet(agents=0)
+    client = web_server.app.test_client()
+    etag = client.get('/status').headers['ETag']
+    assert client.get('/status', headers={'If-None-Match': etag}).status_code == 304
+
+    # A new recording slot moves the ETAs, although no event was published.
+    fleet(agents=1)
+    assert wait_until(lambda: len(web_server.agents) == 1)
+    response = client.get('/status', headers={'If-None-Match': etag})
+    assert response.status_code == 200 and response.headers['ETag'] != etag
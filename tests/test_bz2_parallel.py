@@ -0,0 +1,81 @@
+import bz2
+import random
+from concurrent.futures import Future
+
+import pytest
+
+import bz2_parallel
+from bz2_parallel import ParallelBZ2Decompressor, SerialBZ2Decompressor
+
+def sample(size, seed=0):
+    """Compressible but varied data, so each bz2 block compresses to a different size."""
+    rng = random.Random(seed)
+    words = [bytes(rng.choices(b'abcdefghijklmnopqrstuvwxyz', k=rng.randint(2, 9))) for _ in range(500)]
+    data = b' '.join(rng.choices(words, k=size // 5))
+    return data[:size]
+
+def decompress(compressed, feed_size, workers=2):
+    decompressor = ParallelBZ2Decompressor(workers) if workers > 1 else SerialBZ2Decompressor()
+    output = [decompressor.feed(compressed[i:i + feed_size]) for i in range(0, len(compressed), feed_size)]
+    output.append(decompressor.flush())
+    return b''.join(output)
+
+@pytest.mark.parametrize('level', [1, 9])
+def test_matches_bz2_for_several_blocks(level):
+    # Level 1 uses 100 kB blocks, so this is several blocks; level 9 fits it in one.
+    data = sample(350_000)
+    compressed = bz2.compress(data, level)
+
+    assert decompress(compressed, 64 * 1024) == bz2.decompress(compressed) == data
+
+@pytest.mark.parametrize('feed_size', [1, 7, 4096])
+def test_any_feed_size_gives_the_same_output(feed_size):
+    data = sample(250_000, seed=1)
+    compressed = bz2.compress(data, 1)
+
+    assert decompress(compressed, feed_size) == data
+
+def test_empty_input():
+    compressed = bz2.compress(b'')
+
+    assert decompress(compressed, 4096) == bz2.decompress(compressed) == b''
+
+def test_concatenated_streams():
+    parts = [sample(150_000, seed=2), b'', sample(20_000, seed=3)]
+    compressed = b''.join(bz2.compress(part, level) for part, level in zip(parts, (1, 9, 5)))
+
+    assert decompress(compressed, 10_000) == bz2.decompress(compressed) == b''.join(parts)
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_truncated_stream_raises_eof_error(workers):
+    compressed = bz2.compress(sample(250_000, seed=4), 1)
+
+    with pytest.raises(EOFError):
+        decompress(compressed[:len(compressed) * 2 // 3], 4096, workers)
+
+def test_block_that_fails_to_decompress_raises_value_error():
+    # As if the stream had been split at a false magic inside a block.
+    decompressor = ParallelBZ2Decompressor(2)
+    future = Future()
+    future.set_exception(OSError("Invalid data stream"))
+    decompressor._pending.append(future)
+
+    with pytest.raises(ValueError):
+        decompressor.flush()
+
+def test_decompress_file_falls_back_to_serial_when_the_split_fails(tmp_path, monkeypatch):
+    data = sample(250_000, seed=5)
+    source, dest = tmp_path / 'demo.dem.bz2', tmp_path / 'demo.dem'
+    source.write_bytes(bz2.compress(data, 1))
+
+    def broken_split(workers):
+        decompressor = ParallelBZ2Decompressor(workers)
+        future = Future()
+        future.set_exception(EOFError("Compressed file ended before the end-of-stream marker was reached"))
+        decompressor._pending.append(future)
+        return decompressor
+
+    monkeypatch.setattr(bz2_parallel, 'create_decompressor', broken_split)
+    bz2_parallel.decompress_file(str(source), str(dest), workers=2, chunk_size=64 * 1024)
+
+    assert dest.read_bytes() == data
@@ -0,0 +1,87 @@
+import subprocess
+import sys
+import time
+
+import psutil
+import pytest
+
+from cs2_tracker import GameProcessTracker
+
+# The fake game is a shell script: Linux names a script's process after the script, so it
+# shows up as FAKE_GAME like cs2 would. It runs for the number of seconds it is given.
+FAKE_GAME = 'fakecs2game'
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith('linux'), reason="The fake game relies on Linux process names.")
+
+@pytest.fixture
+def fake_game(tmp_path):
+    path = tmp_path / FAKE_GAME
+    path.write_text('#!/bin/sh\nsleep "${1:-60}"\n')
+    path.chmod(0o755)
+    return str(path)
+
+@pytest.fixture
+def processes():
+    started = []
+    yield started
+    for process in started:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+def launcher(processes, script, *args):
+    """Starts a Python launcher process running `script` with `args` in sys.argv."""
+    processes.append(subprocess.Popen([sys.executable, '-c', script, *args]))
+    return processes[-1]
+
+def tracker_for(pid, **kwargs):
+    return GameProcessTracker(pid, process_names=(FAKE_GAME,), poll_interval=0.1, **kwargs)
+
+def test_finds_the_game_in_the_launchers_child_tree_and_waits_for_it(processes, fake_game):
+    process = launcher(processes, "import subprocess, sys; subprocess.run([sys.argv[1], '1'])", fake_game)
+    tracker = tracker_for(process.pid)
+
+    game = tracker.find(timeout=10)
+    assert game is not None and game.name() == FAKE_GAME
+    assert process.pid in [parent.pid for parent in game.parents()]
+    assert tracker.wait(timeout=10)
+    assert tracker.exited_at is not None and not tracker.is_running()
+
+def test_finds_a_game_handed_off_by_a_launcher_that_exits(processes, fake_game):
+    process = launcher(processes, "import subprocess, sys; subprocess.Popen([sys.argv[1], '5'], start_new_session=True)", fake_game)
+    tracker = tracker_for(process.pid, handoff_grace=60)
+
+    game = tracker.find(timeout=10)
+    assert game is not None
+    assert tracker.launcher_pid is None
+    tracker.kill()
+
+def test_finds_a_game_outside_a_launcher_that_keeps_running(processes, fake_game):
+    # Like the CSDM worker, the launcher stays alive, and the game is not its child (e.g. started by Steam).
+    process = launcher(processes, "import time; time.sleep(60)")
+    tracker = tracker_for(process.pid, handoff_grace=1)
+    processes.append(subprocess.Popen([fake_game, '5']))
+
+    game = tracker.find(timeout=10)
+    assert game is not None and game.pid == processes[-1].pid
+    assert tracker.found_at - tracker.launched_at >= 1
+    tracker.kill()
+
+def test_ignores_a_game_that_was_running_before_the_launch(processes, fake_game):
+    processes.append(subprocess.Popen([fake_game, '10']))
+    time.sleep(1.5)
+    process = launcher(processes, "import time; time.sleep(60)")
+    tracker = tracker_for(process.pid, handoff_grace=0.2)
+
+    assert tracker.find(timeout=1) is None
+
+def test_kill_closes_the_game_and_its_children(processes, fake_game):
+    process = launcher(processes, "import subprocess, sys; subprocess.run([sys.argv[1], '60'])", fake_game)
+    tracker = tracker_for(process.pid)
+    game = tracker.find(timeout=10)
+    children = game.children(recursive=True)
+
+    assert tracker.kill()
+    assert not tracker.is_running()
+    assert not any(psutil.pid_exists(child.pid) and child.status() != psutil.STATUS_ZOMBIE for child in children)
+    assert not tracker.kill()
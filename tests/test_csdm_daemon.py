@@ -0,0 +1,43 @@
+import os
+import time
+
+import pytest
+
+from csdm_daemon import CSDMSupervisor, CSDMWorkerError
+
+FAKE_CSDM = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_csdm')
+
+@pytest.fixture
+def supervisor():
+    supervisor = CSDMSupervisor(FAKE_CSDM, cli='cli.js', health_check_interval=3600, command_timeout=20)
+    yield supervisor
+    supervisor.shutdown()
+
+def test_runs_commands_in_one_worker(supervisor):
+    assert supervisor.run('analyze', ['match.dem']) == 0
+    pid = supervisor.stats()['analyze']['pid']
+    assert supervisor.run('analyze', ['corrupt.dem']) == 1
+    assert supervisor.stats()['analyze'] == {"pid": pid, "alive": True, "restarts": 0}
+
+def test_command_that_returns_without_exiting_finishes(supervisor):
+    started = time.time()
+    assert supervisor.run('return', ['3']) == 3
+    assert time.time() - started < 5
+    # The worker is ready for the next command, and the exit code does not carry over.
+    assert supervisor.run('return') == 0
+
+def test_thrown_error_fails_the_command(supervisor):
+    assert supervisor.run('throw') == 1
+    assert supervisor.run('analyze', ['match.dem']) == 0
+
+def test_hung_command_restarts_the_worker(supervisor):
+    with pytest.raises(CSDMWorkerError):
+        supervisor.run('hang', timeout=1)
+    assert supervisor.stats()['hang']['restarts'] == 1
+    assert supervisor.stats()['hang']['alive']
+
+def test_crashed_worker_is_restarted(supervisor):
+    with pytest.raises(CSDMWorkerError):
+        supervisor.run('analyze', ['crash.dem'])
+    assert supervisor.run('analyze', ['match.dem']) == 0
+    assert supervisor.stats()['analyze']['restarts'] == 1
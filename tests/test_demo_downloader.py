@@ -0,0 +1,166 @@
+import bz2
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import demo_downloader
+
+# A local HTTP server that cuts connections on purpose. Each request is answered according to
+# the next entry of `cuts`: the number of body bytes to send before the connection is closed
+# (None sends the rest). Requests beyond the list get the full body.
+
+class FlakyServer:
+    def __init__(self, body, cuts=(), support_range=True, refuse_range=False):
+        """
+        Args:
+            body (bytes): The file served at every path.
+            cuts (list): Body bytes sent per request before the connection is dropped.
+            support_range (bool): Answer Range requests with 206. False ignores the header (200).
+            refuse_range (bool): Answer every Range request with 416.
+        """
+        self.body = body
+        self.cuts = list(cuts)
+        self.support_range = support_range
+        self.refuse_range = refuse_range
+        self.requests = []      # The Range header of each request (None without one)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}/003768214888862712028_0847912006.dem.bz2"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _next_cut(self, range_header):
+        with self._lock:
+            self.requests.append(range_header)
+            return self.cuts.pop(0) if self.cuts else None
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                range_header = self.headers.get('Range')
+                cut = server._next_cut(range_header)
+                start = 0
+                if range_header and server.refuse_range:
+                    self.send_response(416)
+                    self.send_header('Content-Range', f"bytes */{len(server.body)}")
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if range_header and server.support_range:
+                    start = int(range_header.split('=')[1].rstrip('-'))
+                    self.send_response(206)
+                    self.send_header('Content-Range', f"bytes {start}-{len(server.body) - 1}/{len(server.body)}")
+                else:
+                    self.send_response(200)
+                body = server.body[start:]
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if cut is None:
+                    self.wfile.write(body)
+                    return
+                self.wfile.write(body[:cut])
+                self.wfile.flush()
+                self.close_connection = True
+                self.connection.shutdown(2)
+
+        return Handler
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    # A cut loses the chunk being read, so the chunks must be smaller than the bytes sent before a cut.
+    monkeypatch.setattr(demo_downloader, 'DOWNLOAD_CHUNK_SIZE', 4096)
+    monkeypatch.setattr(demo_downloader, 'RETRY_BACKOFF', 0)
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(*args, **kwargs):
+        servers.append(FlakyServer(*args, **kwargs))
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.close()
+
+def download(url, start=0):
+    return b''.join(demo_downloader.iter_download(url, start))
+
+def test_resumes_with_range_requests_after_cuts(serve):
+    body = os.urandom(300_000)
+    # Cut at chunk boundaries, so each resume starts exactly where the last connection stopped.
+    server = serve(body, cuts=[24 * 4096, 12 * 4096])
+
+    assert download(server.url) == body
+    assert server.requests == [None, 'bytes=98304-', 'bytes=147456-']
+
+def test_skips_received_bytes_when_the_server_ignores_range(serve):
+    body = os.urandom(300_000)
+    server = serve(body, cuts=[30 * 4096], support_range=False)
+
+    assert download(server.url) == body
+    assert server.requests == [None, 'bytes=122880-']
+
+def test_gives_up_after_retries_without_progress(serve):
+    server = serve(os.urandom(10_000), cuts=[0] * (demo_downloader.DOWNLOAD_RETRIES + 5))
+
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        download(server.url)
+    assert len(server.requests) == demo_downloader.DOWNLOAD_RETRIES + 1
+
+def test_progress_resets_the_retry_count(serve):
+    body = os.urandom(100_000)
+    # More cuts than DOWNLOAD_RETRIES, but each one delivers some bytes.
+    server = serve(body, cuts=[10_000] * (demo_downloader.DOWNLOAD_RETRIES + 2))
+
+    assert download(server.url) == body
+
+def test_restarts_when_the_partial_file_cannot_be_resumed(serve, tmp_path):
+    demo = os.urandom(50_000)
+    server = serve(bz2.compress(demo), refuse_range=True)
+    bz2_path = tmp_path / 'demo.dem.bz2.part'
+    dem_path = tmp_path / 'demo.dem'
+    bz2_path.write_bytes(b'stale partial download')
+
+    demo_downloader.download_then_extract(server.url, str(bz2_path), str(dem_path))
+
+    assert dem_path.read_bytes() == demo
+    assert server.requests == [f"bytes={len(b'stale partial download')}-", None]
+    assert not bz2_path.exists()
+
+def test_stream_decompress_survives_cuts(serve, tmp_path):
+    demo = os.urandom(200_000)
+    compressed = bz2.compress(demo)
+    server = serve(compressed, cuts=[len(compressed) // 3, len(compressed) // 3])
+    dem_path = tmp_path / 'demo.dem'
+
+    assert demo_downloader.stream_decompress(server.url, str(dem_path))
+    assert dem_path.read_bytes() == demo
+    assert len(server.requests) == 3
+
+def test_fetch_demo_falls_back_to_a_full_download_when_streaming_fails(serve, tmp_path):
+    demo = os.urandom(200_000)
+    # The streaming attempt runs out of retries without progress; the next request is served in full.
+    server = serve(bz2.compress(demo), cuts=[0] * (demo_downloader.DOWNLOAD_RETRIES + 1))
+    dem_path = tmp_path / 'demo.dem'
+
+    path = demo_downloader.fetch_demo(server.url, str(tmp_path / 'demo.dem.bz2'), str(dem_path))
+
+    assert path == str(dem_path)
+    assert dem_path.read_bytes() == demo
+    assert len(server.requests) == demo_downloader.DOWNLOAD_RETRIES + 2
+    assert sorted(os.listdir(tmp_path)) == ['demo.dem']
@@ -0,0 +1,23 @@
+import os
+
+from demo_store import DemoStore
+
+def write_demo(folder, match_id, content):
+    path = folder / f"{match_id}.dem"
+    path.write_bytes(content)
+    return str(path)
+
+def test_jobs_sharing_a_download_of_a_duplicate_both_get_the_kept_copy(tmp_path):
+    store = DemoStore(str(tmp_path / 'demo_store.db'))
+    content = os.urandom(10_000)
+    kept = store.register(write_demo(tmp_path, 'older_0001', content))
+    # Two jobs waited for the same download, whose content is already stored under another name.
+    downloaded = write_demo(tmp_path, 'newer_0002', content)
+
+    first = store.register(downloaded, acquire=True)
+    second = store.register(downloaded, acquire=True)
+
+    assert first == second == kept
+    assert not os.path.exists(downloaded)
+    store.release(kept)
+    assert store.is_referenced(kept)
@@ -0,0 +1,29 @@
+from job_queue import JobQueue
+
+def queue_of(tmp_path, demos):
+    queue = JobQueue(path=str(tmp_path / 'job_queue.db'), group_key=lambda job: job['demo'])
+    ids = [queue.put({"demo": demo}) for demo in demos]
+    return queue, ids
+
+def claim_all(queue):
+    claimed = []
+    while (job := queue.claim()) is not None:
+        claimed.append(job['job_id'])
+    return claimed
+
+def test_snapshot_lists_jobs_in_the_order_they_are_claimed(tmp_path):
+    queue, ids = queue_of(tmp_path, ['a', 'b', 'a', None, 'b', 'c', 'a'])
+    first = queue.claim()
+    # Jobs waiting for a retry come after the ready ones, by retry time.
+    queue.schedule_retry(first, 60)
+    queue.schedule_retry(queue.claim(), 30)
+
+    snapshot = [job['job_id'] for job in queue.snapshot()]
+
+    assert snapshot[:-2] == claim_all(queue)
+    assert snapshot[-2:] == [ids[2], ids[0]]
+
+def test_snapshot_limit(tmp_path):
+    queue, ids = queue_of(tmp_path, ['a', 'b', 'a', 'b'])
+
+    assert [job['job_id'] for job in queue.snapshot(limit=3)] == [ids[0], ids[2], ids[1]]
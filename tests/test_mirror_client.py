@@ -0,0 +1,116 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from mirror_client import MirrorPool
+
+# Local stand-ins for the decode API mirrors. Each one answers every POST according to its
+# `mode`: 'healthy' returns a download link at once, 'slow' returns one after `delay` seconds,
+# 'failing' answers 500 and 'list' answers a JSON array instead of an object.
+
+class StubMirror:
+    def __init__(self, mode='healthy', delay=0):
+        self.mode = mode
+        self.delay = delay
+        self.requested_at = []      # When each request arrived
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}/decode"
+        self.download_link = f"http://127.0.0.1:{self._server.server_address[1]}/demo.dem.bz2"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        mirror = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                mirror.requested_at.append(time.time())
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if mirror.mode == 'slow':
+                    time.sleep(mirror.delay)
+                if mirror.mode == 'failing':
+                    self.send_response(500)
+                    body = b'Internal Server Error'
+                else:
+                    self.send_response(200)
+                    body = json.dumps([] if mirror.mode == 'list' else {"downloadLink": mirror.download_link}).encode()
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+@pytest.fixture
+def mirrors():
+    started = []
+
+    def start(mode='healthy', delay=0):
+        started.append(StubMirror(mode, delay))
+        return started[-1]
+
+    yield start
+    for mirror in started:
+        mirror.close()
+
+def test_slow_mirror_is_hedged_and_the_healthy_one_ranked_first(mirrors):
+    slow, healthy = mirrors('slow', delay=2), mirrors()
+    pool = MirrorPool([slow.url, healthy.url], timeout=5, hedge_delay=0.3)
+
+    started = time.time()
+    assert pool.resolve('CSGO-test') == healthy.download_link
+
+    # The healthy mirror was only asked once the hedge delay had passed.
+    assert 0.3 <= time.time() - started < 1.5
+    assert healthy.requested_at[0] - started >= 0.3
+
+    # Once the slow answer is in, the healthy mirror is asked first.
+    deadline = time.time() + 5
+    while pool.mirrors[0].requests == 0 and time.time() < deadline:
+        time.sleep(0.05)
+    assert pool.ranked()[0].url == healthy.url
+
+def test_circuit_opens_after_repeated_failures_and_closes_after_the_cooldown(mirrors):
+    flaky, healthy = mirrors('failing'), mirrors()
+    pool = MirrorPool([flaky.url, healthy.url], timeout=5, hedge_delay=5, failure_threshold=2, cooldown=0.5)
+    # Only the flaky mirror is tried until its circuit opens.
+    pool.mirrors[1].latency = 10
+
+    for _ in range(2):
+        assert pool.resolve('CSGO-test') == healthy.download_link
+    assert [mirror.url for mirror in pool.ranked()] == [healthy.url]
+    assert len(flaky.requested_at) == 2
+
+    pool.resolve('CSGO-test')
+    assert len(flaky.requested_at) == 2
+
+    time.sleep(0.6)
+    assert flaky.url in [mirror.url for mirror in pool.ranked()]
+    flaky.mode = 'healthy'
+    pool.mirrors[1].latency = 10
+    assert pool.resolve('CSGO-test') == flaky.download_link
+    assert pool.mirrors[0].consecutive_failures == 0 and pool.mirrors[0].open_until == 0
+
+def test_one_mirror_is_still_tried_when_every_circuit_is_open(mirrors):
+    first, second = mirrors('failing'), mirrors('failing')
+    pool = MirrorPool([first.url, second.url], timeout=5, failure_threshold=1, cooldown=60)
+
+    assert pool.resolve('CSGO-test') is None
+    assert all(stats['circuit_open'] for stats in pool.stats())
+    assert len(pool.ranked()) == 1
+
+def test_non_object_answer_counts_as_a_failure(mirrors):
+    mirror = mirrors('list')
+    pool = MirrorPool([mirror.url], timeout=5)
+
+    assert pool.resolve('CSGO-test') is None
+    assert pool.mirrors[0].failures == 1
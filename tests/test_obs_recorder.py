@@ -0,0 +1,131 @@
+import threading
+import time
+
+import pytest
+
+from obs_recorder import OBSRecorder
+from obs_stub import OBSStub, wait_until
+from recording_watchdog import RecordingWatchdog
+
+@pytest.fixture
+def stub():
+    stub = OBSStub()
+    yield stub
+    stub.close()
+
+@pytest.fixture
+def obs(stub):
+    obs = OBSRecorder(host='127.0.0.1', port=stub.port, heartbeat_interval=3600, request_timeout=5)
+    obs.connect()
+    assert obs.is_connected
+    yield obs
+    obs.disconnect()
+
+# --- stopping a recording (RecordStateChanged) ---
+
+def test_stop_recording_waits_for_the_stopped_event(stub, obs):
+    stub.stop_event_delay = 0.5
+    stub.path_in_stop_response = False
+    obs.start_recording()
+    assert wait_until(lambda: stub.recording)
+
+    started = time.time()
+    path = obs.stop_recording(timeout=5)
+
+    assert time.time() - started >= 0.5
+    assert path == stub.output_path
+    assert not obs.is_recording
+    assert 'StopRecord' in stub.requests
+
+def test_stop_recording_uses_the_path_from_the_stop_response(stub, obs):
+    stub.path_in_stop_event = False
+    stub.output_path = '/videos/from-response.mp4'
+    obs.start_recording()
+
+    assert obs.stop_recording(timeout=5) == '/videos/from-response.mp4'
+
+def test_stop_recording_gives_up_waiting_without_a_stopped_event(stub, obs):
+    stub.stop_event_delay = None
+    obs.start_recording()
+
+    started = time.time()
+    path = obs.stop_recording(timeout=1)
+
+    assert 1 <= time.time() - started < 5
+    assert path == stub.output_path
+    assert not obs.is_recording
+
+def test_stop_recording_when_not_recording_sends_nothing(stub, obs):
+    assert obs.stop_recording(timeout=1) is None
+    assert 'StopRecord' not in stub.requests
+
+# --- shared connection (heartbeat and reconnect) ---
+
+def test_heartbeat_reconnects_after_the_connection_drops(stub):
+    obs = OBSRecorder(host='127.0.0.1', port=stub.port, heartbeat_interval=0.2, request_timeout=5)
+    obs.start()
+    try:
+        stub.drop_connections()
+        assert wait_until(lambda: obs.reconnects >= 1 and obs.ping())
+        obs.start_recording()
+        assert obs.stop_recording(timeout=5) == stub.output_path
+    finally:
+        obs.disconnect()
+
+def test_request_is_retried_after_a_reconnect(stub, obs):
+    stub.drop_connections()
+
+    obs.start_recording()
+
+    assert stub.recording
+    assert obs.reconnects == 1
+
+def test_recording_stopped_while_disconnected_is_noticed(stub, obs):
+    obs.start_recording()
+    stub.drop_connections()
+    stub.recording = False
+
+    obs.reconnect()
+
+    assert not obs.is_recording
+    assert obs._record_stopped.is_set()
+
+# --- recording watchdog ---
+
+def watch(obs, **kwargs):
+    abort = threading.Event()
+    watchdog = RecordingWatchdog(obs, abort, interval=0.1, **kwargs)
+    watchdog.start()
+    return watchdog, abort
+
+def test_watchdog_leaves_a_healthy_recording_alone(stub, obs):
+    obs.start_recording()
+    watchdog, abort = watch(obs, stall_seconds=0.5)
+
+    assert not abort.wait(1.5)
+    watchdog.stop()
+    assert watchdog.samples >= 5 and watchdog.abort_reason is None
+
+def test_watchdog_aborts_a_stalled_recording(stub, obs):
+    stub.stalled = True
+    obs.start_recording()
+    watchdog, abort = watch(obs, stall_seconds=0.5)
+
+    assert abort.wait(5)
+    assert 'has not grown' in watchdog.abort_reason
+
+def test_watchdog_aborts_when_too_many_frames_drop(stub, obs):
+    stub.drop_rate = 0.5
+    obs.start_recording()
+    watchdog, abort = watch(obs, max_drop_rate=0.25)
+
+    assert abort.wait(5)
+    assert 'frames were dropped' in watchdog.abort_reason
+
+def test_watchdog_aborts_when_obs_stops_recording(stub, obs):
+    obs.start_recording()
+    watchdog, abort = watch(obs)
+    stub.recording = False
+
+    assert abort.wait(5)
+    assert 'stopped recording' in watchdog.abort_reason
@@ -0,0 +1,107 @@
+import queue
+import threading
+import time
+
+import pipeline
+
+STAGES = ('download', 'analyze', 'record', 'upload')
+
+class Recorder:
+    """Builds a pipeline whose handlers note which stages ran for which job."""
+
+    def __init__(self, checkpoint_valid=None, queue_sizes=None):
+        queue_sizes = queue_sizes or {'record': 1}
+        self.ran = []
+        self.entered = []
+        self.finished = queue.Queue()
+        self.recording = threading.Event()
+        self.release_recorder = threading.Event()
+        stages = [pipeline.Stage(name, self._handler(name), queue_size=queue_sizes.get(name, 0),
+                                 checkpoint_valid=checkpoint_valid)
+                  for name in STAGES]
+        self.pipeline = pipeline.Pipeline(stages, self.finished.put,
+                                          on_job_entered=lambda job: self.entered.append((job['name'], job.get('resume_from', 'download'))))
+        self.pipeline.start()
+
+    def _handler(self, name):
+        def handle(job):
+            self.ran.append((job['name'], name))
+            if name == 'record' and job.get('slow_recording'):
+                self.recording.set()
+                self.release_recorder.wait(10)
+        return handle
+
+    def submit(self, name, done=(), **fields):
+        job = dict(fields, name=name)
+        if done:
+            job['checkpoints'] = {stage: {"finished_at": 0, "outputs": {}} for stage in done}
+        self.pipeline.stages[0].queue.put(job)
+        return job
+
+    def stages_run(self, name):
+        return [stage for job_name, stage in self.ran if job_name == name]
+
+def test_job_without_checkpoints_runs_every_stage():
+    recorder = Recorder()
+    recorder.submit('a')
+
+    job = recorder.finished.get(timeout=5)
+    assert job['name'] == 'a' and 'error' not in job
+    assert recorder.stages_run('a') == list(STAGES)
+    assert set(job['checkpoints']) == set(STAGES)
+
+def test_resumed_job_skips_to_the_stage_after_its_last_checkpoint():
+    recorder = Recorder()
+    recorder.submit('a', done=('download', 'analyze'))
+
+    job = recorder.finished.get(timeout=5)
+    assert recorder.stages_run('a') == ['record', 'upload']
+    assert recorder.entered == [('a', 'record')]
+    assert 'resume_from' not in job
+
+def test_job_retried_at_upload_does_not_wait_for_the_recorder():
+    recorder = Recorder()
+    recorder.submit('recording', slow_recording=True)
+    assert recorder.recording.wait(5)
+    # The record queue (size 1) is full as well.
+    recorder.submit('waiting')
+
+    recorder.submit('retried', done=('download', 'analyze', 'record'))
+    try:
+        job = recorder.finished.get(timeout=5)
+        assert job['name'] == 'retried'
+        assert recorder.stages_run('retried') == ['upload']
+    finally:
+        recorder.release_recorder.set()
+
+def test_invalid_checkpoint_runs_the_stage_again():
+    recorder = Recorder(checkpoint_valid=lambda job: False)
+    recorder.submit('a', done=('download', 'analyze'))
+
+    recorder.finished.get(timeout=5)
+    assert recorder.stages_run('a') == list(STAGES)
+
+def test_job_with_every_stage_done_only_finishes():
+    recorder = Recorder()
+    recorder.submit('a', done=STAGES)
+
+    recorder.finished.get(timeout=5)
+    assert recorder.stages_run('a') == []
+
+def test_download_stops_once_the_queues_ahead_of_the_recorder_are_full():
+    # Like main.py with prefetch_depth = 2: both the analyze and the record queue hold two jobs.
+    recorder = Recorder(queue_sizes={'analyze': 2, 'record': 2})
+    recorder.submit('recording', slow_recording=True)
+    assert recorder.recording.wait(5)
+    for i in range(20):
+        recorder.submit(f'waiting-{i}')
+
+    # One job is recording, two wait for it, one is blocked in analysis, two wait for
+    # analysis and one is blocked in download. The rest of the backlog is left alone.
+    time.sleep(1)
+    try:
+        downloaded = [name for name, stage in recorder.ran if stage == 'download']
+        assert len(downloaded) == 7
+        assert recorder.pipeline.stages[0].queue.qsize() == 14
+    finally:
+        recorder.release_recorder.set()
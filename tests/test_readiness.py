@@ -0,0 +1,41 @@
+import time
+
+import pytest
+
+import readiness
+
+class FakeTracker:
+    """Stands in for GameProcessTracker; the game 'exits' after `runs_for` seconds."""
+
+    def __init__(self, runs_for):
+        self.found_at = time.time()
+        self.exits_at = self.found_at + runs_for
+
+    def is_running(self):
+        return time.time() < self.exits_at
+
+class NeverReady:
+    name = 'never'
+
+    def check(self):
+        return False
+
+def test_wait_fails_when_the_game_exits_before_playback_starts():
+    started = time.time()
+
+    with pytest.raises(RuntimeError):
+        readiness.wait_until_ready([NeverReady()], timeout=10, poll_interval=0.05, tracker=FakeTracker(0.3))
+    assert time.time() - started < 2
+
+def test_wait_times_out_while_the_game_keeps_running():
+    assert readiness.wait_until_ready([NeverReady()], timeout=0.3, poll_interval=0.05, tracker=FakeTracker(60)) is None
+
+def test_console_probe_fires_on_a_new_matching_line(tmp_path):
+    log = tmp_path / 'console.log'
+    log.write_text("Playing demo from the last session\n")
+    (probe,) = readiness.build_probes(['console'], None, console_log_path=str(log))
+    assert not probe.check()
+
+    with open(log, 'a') as f:
+        f.write("Loading map\nPlaying demo highlights.dem\n")
+    assert readiness.wait_until_ready([probe], timeout=1, poll_interval=0.05) == 'console'
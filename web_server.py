@@ -1,20 +1,34 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
-import queue
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, abort, Response, stream_with_context
 import logging
-from collections import deque
 import os
-import json
 import configparser
+import csv
+import io
 import secrets
+import threading
+import time
 from threading import Lock
 
+import csdm_cli_handler
+import demo_downloader
+import metrics
+from eta import StageTimings, estimate_queue
+from job_queue import JobQueue, AGENT_OWNER_PREFIX, FINAL_STATES, STAGE_STATES
+from results_store import ResultStore
+from status_events import EventBus
+
 app = Flask(__name__)
 
+# Shared secret that recording agents must send in the X-Agent-Token header. Empty: no check.
+agent_token = ''
+
 # Load configuration and set secret key
 def load_config():
+    global agent_token
     config = configparser.ConfigParser()
     if os.path.exists('config.ini'):
         config.read('config.ini')
+        agent_token = config.get('Agent', 'token', fallback='')
         # Use password from config as base for secret key, or generate one
         if config.has_option('Web', 'password'):
             password = config.get('Web', 'password')
@@ -32,7 +46,33 @@ load_config()
 log = logging.getLogger('werkzeug')
 log.setLevel(logging.ERROR)
 
-demo_queue = queue.Queue()
+# Dashboard updates pushed to the browsers over /events. Its version is part of the ETag of /status.
+events = EventBus()
+
+def demo_identity(demo):
+    """The demo a submission refers to: the URL, or the share code however it was pasted."""
+    demo = (demo or '').strip()
+    if demo_downloader.is_demo_url(demo):
+        return demo
+    return demo_downloader.parse_share_code(demo)
+
+def job_dedup_key(job):
+    """Jobs for the same demo and suspect do the same work."""
+    demo = demo_identity(job.get('share_code'))
+    if not demo:
+        return None
+    return f"{demo}|{str(job.get('suspect_steam_id') or '').strip()}"
+
+# Persistent queue of jobs waiting to be picked up; survives restarts.
+demo_queue = JobQueue(on_change=lambda job, state, added: publish_job(job, state, added), dedup_key=job_dedup_key)
+# Jobs that have left demo_queue and are somewhere in the processing pipeline.
+pipeline_jobs = []
+# /status lists at most this many waiting jobs; the total is reported separately.
+STATUS_QUEUE_LIMIT = 100
+# /jobs/<id> predicts start and finish times for jobs up to this far back in the queue.
+JOB_ETA_LIMIT = 1000
+# Maximum number of rows accepted by one /jobs/bulk request.
+MAX_BULK_JOBS = 2000
 
 current_status = {
     "status": "Idle",
@@ -40,33 +80,104 @@ current_status = {
     "step": "Waiting for a new demo to be submitted."
 }
 
+# Recording agents that reported in, by agent ID: their status and when they were last heard from.
+agents = {}
+
+# Results of every finished job, searchable through /results.
+results_store = ResultStore()
+# The dashboard (/status) shows this many of the latest results.
+STATUS_RESULTS_LIMIT = 50
+# Queue ETAs in /status are recomputed at least this often (seconds), even when no event changed the queue.
+STATUS_ETA_REFRESH = 30
+# Rolling stage durations of finished jobs, for queue ETAs. Filled from the latest results on first use.
+stage_timings = StageTimings(window=200, seed=lambda: results_store.recent(200))
+# Jobs this process can record at once (0 when it only coordinates agents).
+local_record_slots = 1
+# Where earlier versions kept the last 50 results. Imported into results_store once.
 RESULTS_FILE = 'results.json'
-completed_jobs = deque(maxlen=50) 
-results_lock = Lock()
 
-def save_results():
-    with results_lock:
+def add_result(job):
+    """Adds a job that left the pipeline (here or on a recording agent) to the results."""
+    failed_status = "Recording Aborted" if job.get('abort_reason') else "Processing Failed"
+    entry = {
+        "suspect_steam_id": job['suspect_steam_id'],
+        "share_code": job['share_code'],
+        "youtube_link": job.get('youtube_link') or failed_status,
+        "task_status": job.get('task_status') or failed_status,
+        "abort_reason": job.get('abort_reason'),
+        "job_id": job.get('job_id'),
+        "agent": job.get('agent'),
+        "final_video_path": job.get('final_video_path'),
+        "youtube_upload": job.get('youtube_upload'),
+        "submitted_by": job.get('submitted_by', 'N/A'),
+        "timings": job.get('timings'),
+        "demo_bytes": job.get('demo_bytes')
+    }
+    try:
+        results_store.add(entry)
+    except Exception as e:
+        logging.error(f"Failed to save the result of job {entry['job_id']}: {e}")
+    if not job.get('error'):
+        stage_timings.add_job(entry)
+    events.publish('result', entry)
+
+# --- Pushed dashboard updates ---
+# Events: 'status' (current_status changed), 'job_enqueued', 'job_updated' (a job changed stage
+# or step, with its state), 'job_finished' (it left the queue) and 'result' (a results entry).
+# Job events carry the number of unfinished jobs, so clients can keep the queue count without polling.
+
+# What was last published per unfinished job ID and for current_status, to only publish changes.
+_published_jobs = {}
+_published_status = {}
+_publish_lock = Lock()
+
+def unfinished_jobs():
+    return sum(count for state, count in demo_queue.counts().items() if state not in FINAL_STATES)
+
+def publish_job(job, state, added=False, known_only=False):
+    """Publishes a job's change, unless nothing that is shown changed. With `known_only`, only
+    jobs already published as unfinished are considered (a finished job stays finished)."""
+    if job.get('job_id') is None:
+        return
+    fingerprint = (state, job.get('step'), job.get('agent'))
+    with _publish_lock:
+        if known_only and job['job_id'] not in _published_jobs:
+            return
+        if state in FINAL_STATES:
+            _published_jobs.pop(job['job_id'], None)
+        elif _published_jobs.get(job['job_id']) == fingerprint and not added:
+            return
+        else:
+            _published_jobs[job['job_id']] = fingerprint
+    if state in FINAL_STATES:
+        event = 'job_finished'
+    else:
+        event = 'job_enqueued' if added else 'job_updated'
+    events.publish(event, {"job": dict(job, state=state), "queue_length": unfinished_jobs()})
+
+def publish_changes():
+    """
+    Publishes changes that are made in place rather than through the job queue: the current
+    status and the step of jobs in this process's pipeline (e.g. download progress).
+    """
+    with _publish_lock:
+        status_changed = current_status != _published_status
+        if status_changed:
+            _published_status.clear()
+            _published_status.update(current_status)
+    if status_changed:
+        events.publish('status', dict(current_status))
+    for job in list(pipeline_jobs):
+        if job.get('stage'):
+            publish_job(job, STAGE_STATES.get(job['stage'], job['stage']), known_only=True)
+
+def watch_changes(interval=1.0):
+    while True:
+        time.sleep(interval)
         try:
-            with open(RESULTS_FILE, 'w') as f:
-                json.dump(list(completed_jobs), f, indent=4)
-            logging.info(f"Successfully saved {len(completed_jobs)} results to {RESULTS_FILE}")
+            publish_changes()
         except Exception as e:
-            logging.error(f"Failed to save results to {RESULTS_FILE}: {e}")
-
-def load_results():
-    with results_lock:
-        if os.path.exists(RESULTS_FILE):
-            with open(RESULTS_FILE, 'r') as f:
-                try:
-                    content = f.read()
-                    if content:
-                        results_list = json.loads(content)
-                        completed_jobs.extend(results_list)
-                        logging.info(f"Loaded {len(completed_jobs)} previous results from {RESULTS_FILE}")
-                except json.JSONDecodeError:
-                    logging.error(f"Could not decode JSON from {RESULTS_FILE}. Starting with empty results.")
-        else:
-            logging.info(f"{RESULTS_FILE} not found. Starting with empty results.")
+            logging.error(f"Failed to publish dashboard updates: {e}")
 
 # The /login and /logout routes are no longer needed.
 
@@ -135,18 +246,330 @@ def run_hyperlink():
     
     return redirect(url_for('index'))
 
+def validate_submission(demo, steam64, submitted_by):
+    """Returns what is wrong with a job submission, or None if it is valid."""
+    if not all([demo, steam64, submitted_by]):
+        return "share_code, suspect_steam_id and submitted_by are required."
+    if not demo_identity(demo):
+        return "Not a valid share code or demo URL (.dem.bz2)."
+    if not steam64.isdigit() or len(steam64) != 17:
+        return "Invalid Steam64 ID format. Must be 17 digits."
+    return None
+
+def read_bulk_rows():
+    """Reads the rows of a /jobs/bulk request: a JSON list (or {"jobs": [...]}), or CSV with a header row."""
+    upload = request.files.get('file')
+    if upload is not None or request.mimetype in ('text/csv', 'text/plain'):
+        text = upload.read().decode('utf-8-sig') if upload is not None else request.get_data(as_text=True)
+        return list(csv.DictReader(io.StringIO(text)))
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('jobs')
+    if not isinstance(data, list):
+        raise ValueError("Expected a JSON list of jobs, or CSV.")
+    return data
+
+@app.route('/jobs/bulk', methods=['POST'])
+def add_jobs_bulk():
+    """
+    Queues many jobs at once, from JSON or CSV rows with share_code, suspect_steam_id,
+    submitted_by and optionally youtube_upload. Every row is validated first; if any row
+    is invalid nothing is queued, unless skip_invalid=true. Rows whose demo and suspect
+    are already queued, in progress or done are skipped as duplicates. The valid rows are
+    queued in a single transaction. The answer lists the outcome of each row.
+    """
+    try:
+        rows = read_bulk_rows()
+    except (ValueError, csv.Error, UnicodeDecodeError) as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    if not rows:
+        return jsonify({"success": False, "message": "No jobs submitted."}), 400
+    if len(rows) > MAX_BULK_JOBS:
+        return jsonify({"success": False, "message": f"At most {MAX_BULK_JOBS} jobs per request."}), 413
+    skip_invalid = request.args.get('skip_invalid', '').lower() == 'true'
+
+    outcomes = []
+    jobs = []
+    for number, row in enumerate(rows, start=1):
+        if not isinstance(row, dict):
+            outcomes.append({"row": number, "status": "invalid", "message": "Each job must be an object."})
+            continue
+        demo = str(row.get('share_code') or '').strip()
+        steam64 = str(row.get('suspect_steam_id') or '').strip()
+        submitted_by = str(row.get('submitted_by') or '').strip()
+        error = validate_submission(demo, steam64, submitted_by)
+        if error:
+            outcomes.append({"row": number, "status": "invalid", "message": error})
+            continue
+        job = {"share_code": demo, "suspect_steam_id": steam64, "submitted_by": submitted_by}
+        if str(row.get('youtube_upload', '')).strip():
+            job['youtube_upload'] = str(row['youtube_upload']).strip().lower() in ('true', '1', 'yes')
+        outcomes.append({"row": number, "status": "queued"})
+        jobs.append((outcomes[-1], job))
+
+    invalid = sum(1 for outcome in outcomes if outcome['status'] == 'invalid')
+    if invalid and not skip_invalid:
+        for outcome, _ in jobs:
+            outcome['status'] = 'not_queued'
+        return jsonify({"success": False, "message": f"{invalid} invalid row(s). Nothing was queued.",
+                        "queued": 0, "duplicates": 0, "invalid": invalid, "rows": outcomes}), 400
+
+    job_ids = demo_queue.put_many([job for _, job in jobs])
+    for (outcome, _), job_id in zip(jobs, job_ids):
+        if job_id is None:
+            outcome['status'] = 'duplicate'
+            outcome['message'] = "This demo and suspect are already queued or done."
+        else:
+            outcome['job_id'] = job_id
+    queued = sum(1 for job_id in job_ids if job_id is not None)
+    logging.info(f"Bulk submission: {queued} job(s) queued, {len(job_ids) - queued} duplicate(s), {invalid} invalid.")
+    return jsonify({"success": True, "message": f"{queued} job(s) added to the queue.",
+                    "queued": queued, "duplicates": len(job_ids) - queued, "invalid": invalid, "rows": outcomes})
+
 @app.route('/status')
 def status():
     # No login check is needed.
-    queued_jobs = list(demo_queue.queue)
-    results = list(completed_jobs) 
-    return jsonify({
+    # The jobs, status and results listed here are published as events when they change, so the
+    # event version identifies them. The ETAs also depend on the number of recording slots (agents
+    # going online or offline publish no event) and drift with time, so those are part of the ETag
+    # too. Polls that find nothing new are answered with 304 Not Modified.
+    publish_changes()
+    etag = f"{events.version}-{record_slots()}-{int(time.time() // STATUS_ETA_REFRESH)}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    # Jobs already in the pipeline first, then the ones still waiting to be picked up.
+    # Jobs on recording agents are listed with the agent's name.
+    in_pipeline = list(pipeline_jobs) + demo_queue.active(exclude_owner=demo_queue.owner)
+    waiting = demo_queue.snapshot(limit=STATUS_QUEUE_LIMIT)
+    queued_jobs = with_eta(in_pipeline, waiting)
+    results = results_store.recent(STATUS_RESULTS_LIMIT)
+    response = jsonify({
         "current_job": current_status,
         "queue": queued_jobs,
+        "queue_length": len(in_pipeline) + demo_queue.qsize(),
         "results": results 
     })
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def record_slots():
+    """Jobs that can be recorded at the same time: this process plus the online agents."""
+    return local_record_slots + sum(1 for agent in agent_summaries().values() if agent['online'])
+
+def with_eta(in_pipeline, waiting):
+    """Copies of the jobs with their queue position and predicted start/finish times."""
+    estimates = estimate_queue(in_pipeline, waiting, stage_timings, record_slots())
+    return [dict(job, **estimates.get(job.get('job_id'), {})) for job in in_pipeline + waiting]
+
+@app.route('/timings')
+def timings():
+    """Recent stage durations (median and 90th percentile) that queue ETAs are based on."""
+    return jsonify({"stages": stage_timings.stats(), "record_slots": record_slots()})
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """
+    Metrics of this process and of the recording agents (labelled agent=<id>) in the
+    Prometheus text format. Only reads in-memory counters and a few cheap gauges.
+    """
+    sources = [(metrics.registry.snapshot(), {})]
+    for agent_id, agent in list(agents.items()):
+        if agent.get('metrics'):
+            sources.append((agent['metrics'], {"agent": agent_id}))
+    return Response(metrics.render(sources), mimetype='text/plain; version=0.0.4')
+
+@app.route('/events')
+def event_stream():
+    """
+    Server-Sent Events stream of dashboard updates. A reconnecting browser sends Last-Event-ID
+    and gets the events it missed, or a 'reset' event if it must reload /status.
+    """
+    after = events.parse_event_id(request.headers.get('Last-Event-ID'))
+    if request.headers.get('Last-Event-ID') and after is None:
+        after = -1   # From a previous run of the server: force a reset.
+    response = Response(stream_with_context(events.stream(after)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'   # Don't let a reverse proxy buffer the stream.
+    return response
+
+@app.route('/results')
+def list_results():
+    """
+    Results of finished jobs, newest first, a page at a time.
+    Filters (exact match): suspect, submitted_by, share_code, status.
+    Paging: limit (at most 500), and before=<next_before of the previous page>.
+    """
+    filters = {
+        "suspect_steam_id": request.args.get('suspect'),
+        "submitted_by": request.args.get('submitted_by'),
+        "share_code": request.args.get('share_code'),
+        "task_status": request.args.get('status')
+    }
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+    results, next_before = results_store.query(before=request.args.get('before', type=int), limit=limit, **filters)
+    return jsonify({"results": results, "next_before": next_before, "total": results_store.count(**filters)})
+
+@app.route('/jobs/<int:job_id>')
+def job_details(job_id):
+    """
+    A job's state, attempts and checkpoints (which stages finished and what they produced).
+    Unfinished jobs also get their queue position and predicted start and finish times,
+    as far as JOB_ETA_LIMIT jobs back in the queue.
+    """
+    job = demo_queue.get_job(job_id)
+    if job is None:
+        return jsonify({"success": False, "message": "Job not found."}), 404
+    if job['state'] not in FINAL_STATES:
+        in_pipeline = list(pipeline_jobs) + demo_queue.active(exclude_owner=demo_queue.owner)
+        estimates = estimate_queue(in_pipeline, demo_queue.snapshot(limit=JOB_ETA_LIMIT), stage_timings, record_slots())
+        job['eta'] = estimates.get(job_id)
+    return jsonify(job)
+
+@app.route('/jobs/<int:job_id>/retry', methods=['POST'])
+def retry_job(job_id):
+    """Re-queues a failed job. It resumes at the stage that failed."""
+    if not demo_queue.retry(job_id):
+        return jsonify({"success": False, "message": "No failed job with this ID."}), 404
+    logging.info(f"Job {job_id} was re-queued for a retry.")
+    return jsonify({"success": True, "message": "Job re-queued."})
+
+# --- Recording agents ---
+# Agents on other machines run the pipeline for jobs they claim from demo_queue. Each claimed
+# job is leased to 'agent:<agent_id>'; the lease is renewed by the agent's heartbeat and
+# expires (putting the job back in the queue) when the agent stops reporting.
+
+def agent_request():
+    """Returns the request's JSON body and the agent's lease owner, or aborts with 401/400."""
+    if agent_token and not secrets.compare_digest(request.headers.get('X-Agent-Token', ''), agent_token):
+        abort(401)
+    data = request.get_json(silent=True) or {}
+    agent_id = str(data.get('agent_id') or '').strip()
+    if not agent_id:
+        abort(400)
+    agents.setdefault(agent_id, {"status": {}, "jobs": 0, "claimed": 0, "finished": 0})['last_seen'] = time.time()
+    return data, AGENT_OWNER_PREFIX + agent_id
+
+def agent_summaries():
+    now = time.time()
+    return {
+        agent_id: dict({key: value for key, value in agent.items() if key != 'metrics'},
+                       seconds_since_heartbeat=round(now - agent['last_seen'], 1),
+                       online=now - agent['last_seen'] < demo_queue.lease_seconds)
+        for agent_id, agent in list(agents.items())
+    }
+
+def agent_job(data, job_id):
+    job = data.get('job') or {}
+    job['job_id'] = job_id
+    return job
+
+@app.route('/agent/claim', methods=['POST'])
+def agent_claim():
+    """Hands the agent the next queued job. Waits up to `wait` seconds (at most 30) for one."""
+    data, owner = agent_request()
+    wait = min(max(float(data.get('wait') or 0), 0), 30)
+    job = demo_queue.wait_for_job(owner, wait)
+    if job is None:
+        return '', 204
+    agents[data['agent_id']]['claimed'] += 1
+    logging.info(f"Job {job['job_id']} was claimed by agent {data['agent_id']}.")
+    return jsonify({"job": job})
+
+@app.route('/agent/heartbeat', methods=['POST'])
+def agent_heartbeat():
+    """
+    Renews the leases of the jobs the agent is working on and stores their progress.
+    Answers with the IDs of jobs the agent no longer holds (their lease expired).
+    """
+    data, owner = agent_request()
+    jobs = [job for job in data.get('jobs') or [] if job.get('job_id') is not None]
+    held = set(demo_queue.renew_leases(owner, [job['job_id'] for job in jobs]))
+    for job in jobs:
+        if job['job_id'] in held and job.get('stage'):
+            demo_queue.transition(job, job['stage'], owner=owner)
+    agent = agents[data['agent_id']]
+    agent['status'] = data.get('status') or {}
+    # Served by the coordinator's /metrics with an agent label.
+    agent['metrics'] = data.get('metrics') or []
+    agent['jobs'] = len(held)
+    return jsonify({"lost": [job['job_id'] for job in jobs if job['job_id'] not in held]})
+
+@app.route('/agent/jobs/<int:job_id>/update', methods=['POST'])
+def agent_update(job_id):
+    """Records that a job on an agent entered a stage."""
+    data, owner = agent_request()
+    if not data.get('stage'):
+        abort(400)
+    if not demo_queue.transition(agent_job(data, job_id), data['stage'], owner=owner):
+        return jsonify({"success": False, "message": "The job is not leased to this agent."}), 409
+    return jsonify({"success": True})
+
+@app.route('/agent/jobs/<int:job_id>/complete', methods=['POST'])
+def agent_complete(job_id):
+    """Records the final state of a job an agent finished, and adds it to the results."""
+    data, owner = agent_request()
+    job = agent_job(data, job_id)
+    job['agent'] = data['agent_id']
+    if not demo_queue.complete(job, owner=owner):
+        return jsonify({"success": False, "message": "The job is not leased to this agent."}), 409
+    agents[data['agent_id']]['finished'] += 1
+    add_result(job)
+    return jsonify({"success": True})
+
+@app.route('/agent/jobs/<int:job_id>/retry_later', methods=['POST'])
+def agent_retry_later(job_id):
+    """Puts a job that failed on an agent back in the queue, to be claimed again after `delay` seconds."""
+    data, owner = agent_request()
+    if not demo_queue.schedule_retry(agent_job(data, job_id), float(data.get('delay') or 0), owner=owner):
+        return jsonify({"success": False, "message": "The job is not leased to this agent."}), 409
+    return jsonify({"success": True})
+
+@app.route('/agents')
+def list_agents():
+    """The recording agents that reported in, with their status and job counters."""
+    return jsonify({"agents": agent_summaries()})
+
+@app.route('/cache/stats')
+def cache_stats():
+    """Hit/miss counters of the share code -> download URL cache."""
+    return jsonify({"share_code_cache": demo_downloader.url_cache.stats()})
+
+@app.route('/mirrors')
+def mirror_stats():
+    """Rolling latency/error scores of the share code decode mirrors, best first."""
+    return jsonify({"mirrors": demo_downloader.mirror_pool.stats()})
+
+@app.route('/analysis_cache', methods=['GET'])
+def list_analyses():
+    """Lists the most recent entries of the analysis ledger."""
+    limit = request.args.get('limit', 100, type=int)
+    return jsonify({"analyses": csdm_cli_handler.analysis_ledger.entries(limit)})
+
+@app.route('/analysis_cache', methods=['DELETE'])
+@app.route('/analysis_cache/<demo_sha256>', methods=['DELETE'])
+def invalidate_analyses(demo_sha256=None):
+    """
+    Forgets recorded analyses so the demo is analyzed again by the next job that uses it.
+    Without a hash, the whole ledger is cleared (e.g. after resetting the CSDM database).
+    """
+    removed = csdm_cli_handler.analysis_ledger.invalidate(demo_sha256)
+    logging.info(f"Invalidated {removed} analysis ledger entries ({demo_sha256 or 'all'}).")
+    return jsonify({"success": True, "removed": removed})
+
+@app.route('/csdm/stats')
+def csdm_stats():
+    """Recent CSDM command durations per mode (daemon vs. separate process) and worker health."""
+    return jsonify(csdm_cli_handler.latency_stats())
 
 def run_web_server(): # Password parameter is removed
-    load_results()
+    results_store.import_json(RESULTS_FILE)
+    metrics.registry.gauge('demo2video_jobs', 'Jobs in the job queue by state.', lambda: demo_queue.counts(), label='state')
+    metrics.registry.gauge('demo2video_agents_online', 'Recording agents that sent a heartbeat within the lease time.',
+                           lambda: sum(1 for agent in agent_summaries().values() if agent['online']))
+    threading.Thread(target=watch_changes, name="StatusEvents", daemon=True).start()
     # No need to set the password in the app config.
     app.run(host='0.0.0.0', port=5001)
@@ -6,6 +6,8 @@ from googleapiclient.http import MediaFileUpload
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
 
+import metrics
+
 # This module handles the video upload to YouTube.
 
 TOKEN_FILE = 'token.json'
@@ -83,6 +85,7 @@ def upload_video(video_path, title, description="Suspected cheater highlights.",
             if status:
                 logging.info(f"Uploaded {int(status.progress() * 100)}%.")
         
+        metrics.upload_bytes.inc(os.path.getsize(video_path))
         video_id = response.get('id')
         video_url = f"https://www.youtube.com/watch?v={video_id}"
         logging.info(f"Upload successful! Video URL: {video_url}")